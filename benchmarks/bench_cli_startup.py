@@ -0,0 +1,93 @@
+"""
+times the start up of ml_engine.py in fresh python processes and checks that parsing never imports the models
+
+    python benchmarks/bench_cli_startup.py --pdf data.pdf --repeat 5
+
+every case runs --repeat times and reports the fastest run, the parse case parses the pdf with the pypdf backend
+and no extraction cache, so it is the whole parse command and not only its imports
+the exit code is 1 when the parse command or --help imports one of HEAVY_MODULES
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the dependencies of the models, parsing and --help have no use for them
+HEAVY_MODULES = ["sklearn", "scipy", "category_encoders", "joblib"]
+
+RUN_COMMAND = """
+import json, sys, time
+start = time.perf_counter()
+import ml_engine
+try:
+    ml_engine.main({argv!r})
+except SystemExit:
+    pass
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "imported": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_command(argv, repeat):
+    """
+    fastest of repeat fresh interpreters running ml_engine.main(argv), with the heavy modules it imported
+    :param argv:
+    :param repeat:
+    :return:
+    """
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", RUN_COMMAND.format(argv=argv, heavy=HEAVY_MODULES)],
+                                cwd=ROOT, capture_output=True, text=True, check=True)
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return min(runs, key=lambda r: r["seconds"])
+
+
+def time_import(module, repeat):
+    """
+    fastest of repeat fresh interpreters importing module
+    :param module:
+    :param repeat:
+    :return:
+    """
+    code = "import time; start = time.perf_counter(); import {0}; print(time.perf_counter() - start)".format(module)
+    return min(float(subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                                    check=True).stdout.strip()) for _ in range(repeat))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--pdf", default=os.path.join(ROOT, "data.pdf"))
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--output", default=None, help="json file with the results")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        destination = os.path.join(directory, "crab_data.csv")
+        cases = {"help": ["--help"],
+                 "parse --help": ["parse", "--help"],
+                 "parse": ["parse", "-i", os.path.abspath(args.pdf), "-d", destination, "--backend", "pypdf",
+                           "--no-cache"]}
+        results = {name: time_command(argv, args.repeat) for name, argv in cases.items()}
+    # what every command paid before the imports were moved into the commands
+    results["import crab_ml"] = {"seconds": time_import("crab_analyser.crab_ml", args.repeat), "imported": None}
+
+    print("{0:<16} {1:>9}  {2}".format("case", "seconds", "heavy modules imported"))
+    for name, result in results.items():
+        imported = "-" if result["imported"] is None else ", ".join(result["imported"]) or "none"
+        print("{0:<16} {1:>9.3f}  {2}".format(name, result["seconds"], imported))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = [name for name, result in results.items() if result["imported"]]
+    if failed:
+        print("heavy modules imported by: {0}".format(", ".join(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+compares the pdf text backends on data.pdf and on larger synthetic pdfs
+
+cold start is measured in a fresh python process (imports, JVM / tika server start up and the first page), the
+per page throughput is measured in process once the backend is warm
+
+    python benchmarks/bench_pdf_backends.py --pdf data.pdf --scales 1 10 --backends tika pypdf
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crab_analyser.crab_pdf_backends import BACKENDS, get_backend
+
+COLD_START = """
+import time
+start = time.perf_counter()
+from crab_analyser.crab_pdf_backends import get_backend
+next(iter(get_backend({backend!r}).read_pages({source!r})))
+print(time.perf_counter() - start)
+"""
+
+
+def write_scaled_pdf(source_location, scale, destination_location):
+    """
+    writes a pdf that repeats all the pages of the source pdf scale times
+    :param source_location:
+    :param scale:
+    :param destination_location:
+    :return:
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(source_location)
+    writer = PdfWriter()
+    for _ in range(scale):
+        for page in reader.pages:
+            writer.add_page(page)
+    with open(destination_location, "wb") as f:
+        writer.write(f)
+
+
+def cold_start(backend, source_location):
+    """
+    seconds until a fresh interpreter has the first page of the pdf
+    :param backend:
+    :param source_location:
+    :return:
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", COLD_START.format(backend=backend, source=source_location)],
+                            cwd=root, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def throughput(backend, source_location):
+    """
+    pages per second and lines read by a warm backend
+    :param backend:
+    :param source_location:
+    :return:
+    """
+    pdf_backend = get_backend(backend)
+    next(iter(pdf_backend.read_pages(source_location)))
+    start = time.perf_counter()
+    pages = 0
+    lines = 0
+    for page in pdf_backend.read_pages(source_location):
+        pages += 1
+        lines += len(page)
+    seconds = time.perf_counter() - start
+    return {"pages": pages, "lines": lines, "seconds": seconds, "pages_per_second": pages / seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf", default="data.pdf", help="pdf the synthetic pdfs are built from")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10], help="how many times the pages are repeated")
+    parser.add_argument("--backends", nargs="+", default=sorted(BACKENDS), choices=sorted(BACKENDS))
+    parser.add_argument("--output", help="optional json file for the results")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            source_location = os.path.abspath(args.pdf)
+            if scale != 1:
+                source_location = os.path.join(directory, "crabs_x{0}.pdf".format(scale))
+                write_scaled_pdf(args.pdf, scale, source_location)
+            for backend in args.backends:
+                result = {"backend": backend, "scale": scale}
+                try:
+                    result["cold_start_seconds"] = cold_start(backend, source_location)
+                    result.update(throughput(backend, source_location))
+                except Exception as e:
+                    # tika needs java, a missing runtime is reported instead of stopping the other backends
+                    result["error"] = "{0}: {1}".format(type(e).__name__, str(e).strip().splitlines()[-1:])
+                print(json.dumps(result))
+                results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
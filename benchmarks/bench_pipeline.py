@@ -0,0 +1,203 @@
+"""
+times every stage of the crab pipeline on synthetic surveys of growing size and compares them with a saved baseline
+
+    python benchmarks/bench_pipeline.py --scales 1 10 100 --output bench_results.json --save_baseline
+    python benchmarks/bench_pipeline.py --scales 1 10 100 --baseline benchmarks/baseline.json
+
+read_raw_pdf times the pdf backend on the generated pdf, the later stages work on the same lines read from the
+generated text file so they can be timed at scales where reading the pdf would take too long
+every stage has a largest scale it runs at (see MAX_SCALES, --limit overrides them), larger ones are skipped
+the exit code is 1 when a stage is more than --tolerance slower than in the baseline, timings are only comparable
+on the same machine so the baseline is not part of the repository, save one before changing the code
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from functools import partial
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crab_analyser.crab_ml import CrabAgePredictor
+from crab_analyser.crab_pdf_backends import BACKENDS, get_backend
+from crab_analyser.crab_pdf_parser_v2 import CrabPDFParser
+from crab_survey_generator import BASE_ROWS, survey_pages, write_survey_pdf, write_survey_text
+
+STAGES = ["read_raw_pdf", "extract_raw_features", "process_age", "pre_process_data", "ols_prediction",
+          "rf_prediction"]
+# largest scale every stage runs at by default, the forest fits 5000 trees and the pdf backends read ~100 pages/s,
+# pre_process_data only takes the mean of the numeric columns and grows linearly (2.3s at scale 1000)
+MAX_SCALES = {"read_raw_pdf": 10, "extract_raw_features": 1000, "process_age": 1000, "pre_process_data": 1000,
+              "ols_prediction": 100, "rf_prediction": 1}
+# differences below this many seconds are noise and never flagged
+NOISE_SECONDS = 0.05
+
+
+def timed(prepare, repeat, budget):
+    """
+    best of up to repeat timings, once the runs took more than budget seconds the stage is not repeated
+    :param prepare: returns the call to time, so copying the input is not part of the timing
+    :param repeat:
+    :param budget:
+    :return: result of the last call, seconds of the fastest call and the number of calls
+    """
+    timings = []
+    while len(timings) < repeat and sum(timings) <= budget:
+        call = prepare()
+        start = time.perf_counter()
+        result = call()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings), len(timings)
+
+
+def bench_scale(scale, directory, backend, max_scales, predictor_args, repeat=3, budget=10.0):
+    """
+    generates the survey of one scale and times the stages that run at that scale
+    :param scale:
+    :param directory: working directory for the generated files and the csv files the models write
+    :param backend: pdf backend used by read_raw_pdf
+    :param max_scales: largest scale of every stage
+    :param predictor_args: extra arguments of CrabAgePredictor
+    :param repeat: every stage reports the best of up to repeat runs
+    :param budget: seconds after which a stage is not repeated any more
+    :return: list of results
+    """
+    results = []
+
+    def record(stage, rows, prepare):
+        result, seconds, runs = timed(prepare, repeat, budget)
+        entry = {"scale": scale, "stage": stage, "rows": rows, "seconds": seconds, "runs": runs,
+                 "rows_per_second": rows / seconds if seconds else None}
+        print(json.dumps(entry))
+        results.append(entry)
+        return result
+
+    text_location = os.path.join(directory, "crabs_x{0}.txt".format(scale))
+    write_survey_text(survey_pages(scale), text_location)
+    rows = BASE_ROWS * scale
+    if scale <= max_scales["read_raw_pdf"]:
+        pdf_location = os.path.join(directory, "crabs_x{0}.pdf".format(scale))
+        write_survey_pdf(survey_pages(scale), pdf_location)
+        record("read_raw_pdf", rows, lambda: CrabPDFParser(pdf_location, None, None, get_backend(backend)).read_raw_pdf)
+        os.remove(pdf_location)
+
+    with open(text_location) as f:
+        lines = f.read().split("\n")[:-1]
+    crab_data_parser = CrabPDFParser(text_location, None)
+    if scale > max_scales["extract_raw_features"]:
+        return results
+    raw_features = record("extract_raw_features", rows, lambda: partial(crab_data_parser.extract_raw_features, lines))
+    if scale <= max_scales["process_age"]:
+        age_list = record("process_age", rows, lambda: partial(crab_data_parser.process_age, len(raw_features), lines))
+        raw_features["age"] = pd.Series(age_list)
+    del lines
+
+    if "age" in raw_features and scale <= max_scales["pre_process_data"]:
+        record("pre_process_data", rows,
+               lambda: CrabAgePredictor(raw_features.copy(), **predictor_args).pre_process_data)
+    if "age" in raw_features and scale <= max_scales["ols_prediction"]:
+        ml = CrabAgePredictor(raw_features.copy(), **predictor_args)
+        record("ols_prediction", rows, lambda: CrabAgePredictor(raw_features.copy(), **predictor_args).ols_prediction)
+        if scale <= max_scales["rf_prediction"]:
+            # run() order, ols_prediction imputes the data the forest is then fitted on
+            ml.pre_process_data()
+            record("rf_prediction", rows, lambda: ml.rf_prediction)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    returns the results that are more than tolerance slower than the same stage and scale of the baseline
+    :param results:
+    :param baseline: results of an earlier run
+    :param tolerance: allowed relative slow down, 0.5 is 50%
+    :return:
+    """
+    reference = {(b["scale"], b["stage"]): b["seconds"] for b in baseline}
+    regressions = []
+    for r in results:
+        before = reference.get((r["scale"], r["stage"]))
+        if before is None:
+            continue
+        r["baseline_seconds"] = before
+        r["ratio"] = r["seconds"] / before if before else None
+        if r["seconds"] > before * (1 + tolerance) and r["seconds"] - before > NOISE_SECONDS:
+            regressions.append(r)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100, 1000],
+                        help="survey sizes in multiples of the rows of data.pdf")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="pypdf", help="pdf backend of read_raw_pdf")
+    parser.add_argument("--limit", nargs="*", default=[], metavar="STAGE=SCALE",
+                        help="largest scale of a stage, e.g. rf_prediction=10")
+    parser.add_argument("--adaptive_forest", action="store_true", help="time the adaptive forest instead of 5000 trees")
+    parser.add_argument("--n_jobs", type=int, default=None, help="cores of the random forest")
+    parser.add_argument("--output", default="bench_results.json", help="json file for the results")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           "baseline.json"),
+                        help="json file of an earlier run the results are compared with")
+    parser.add_argument("--save_baseline", action="store_true", help="also save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slow down of a stage")
+    parser.add_argument("--repeat", type=int, default=3, help="every stage reports the best of up to this many runs")
+    parser.add_argument("--budget", type=float, default=10.0,
+                        help="seconds after which a stage is not repeated any more")
+    args = parser.parse_args()
+
+    max_scales = dict(MAX_SCALES)
+    for limit in args.limit:
+        stage, _, scale = limit.partition("=")
+        if stage not in max_scales:
+            parser.error("Unknown stage {0}, expected one of {1}".format(stage, STAGES))
+        max_scales[stage] = int(scale)
+    # the pipeline logs every dirty row, that is not what is timed here
+    logging.getLogger('crabdata').setLevel(logging.WARNING)
+
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # ols_prediction and rf_prediction write their csv files to the working directory
+        os.chdir(directory)
+        try:
+            for scale in args.scales:
+                results.extend(bench_scale(scale, directory, args.backend, max_scales,
+                                           {"n_jobs": args.n_jobs, "adaptive_forest": args.adaptive_forest},
+                                           args.repeat, args.budget))
+        finally:
+            os.chdir(cwd)
+
+    run = {"created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+           "python_version": platform.python_version(),
+           "machine": platform.machine(),
+           "cpus": os.cpu_count(),
+           "backend": args.backend,
+           "adaptive_forest": args.adaptive_forest,
+           "results": results}
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for r in regressions:
+            print("REGRESSION {0} at scale {1}: {2:.3f}s vs {3:.3f}s in the baseline ({4:.2f}x)".format(
+                r["stage"], r["scale"], r["seconds"], r["baseline_seconds"], r["ratio"]))
+        run["regressions"] = regressions
+    with open(args.output, "w") as f:
+        json.dump(run, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=2)
+        print("Baseline saved: {0}".format(args.baseline))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
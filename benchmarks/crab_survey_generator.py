@@ -0,0 +1,156 @@
+"""
+writes synthetic crab survey pdfs (and the same lines as text) in the layout of data.pdf
+
+every page starts with the Sheet1 / Page N markers, the first page has the column header, the feature rows run over
+as many pages as needed and the ages follow on their own pages after an Age header, dirty lines without an age and
+feature rows with garbage cells are mixed in like in data.pdf
+
+    python benchmarks/crab_survey_generator.py --scale 10 --output crabs_x10.pdf --text crabs_x10.txt
+"""
+import argparse
+
+import numpy as np
+
+# rows of data.pdf, scale 1 writes as many
+BASE_ROWS = 3894
+ROWS_PER_PAGE = 53
+HEADER = "Sex  Length  Diameter  Height  Weight  Shucked Weight  Viscera Weight  Shell Weight"
+DIRTY_LINES = ["that's not valid for sure", "omg such dirty data"]
+# one dirty line without an age and one garbage feature row with an age every so many rows
+DIRTY_LINE_EVERY = 1300
+GARBAGE_ROW_EVERY = 2800
+
+
+def feature_rows(rows, seed=100):
+    """
+    returns the feature lines and the ages of rows synthetic crabs, the measurements follow the shape of data.pdf
+    :param rows:
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    sex = rng.choice(np.array(["F", "M", "I"]), rows)
+    # lengths and diameters are multiples of 1/80 inch in data.pdf
+    length = np.clip(np.round(rng.normal(1.31, 0.3, rows) * 80) / 80, 0.1875, 2.0375)
+    diameter = np.clip(np.round((length * 0.78 + rng.normal(0, 0.03, rows)) * 80) / 80, 0.1375, 1.625)
+    height = np.clip(np.round((length * 0.27 + rng.normal(0, 0.02, rows)) * 80) / 80, 0.0125, 0.6)
+    weight = np.round(np.clip(length ** 3 * 10.3 + rng.normal(0, 1.5, rows), 0.05, 80), 8)
+    shucked = np.round(weight * rng.uniform(0.35, 0.52, rows), 8)
+    viscera = np.round(weight * rng.uniform(0.18, 0.25, rows), 8)
+    shell = np.round(weight * rng.uniform(0.25, 0.35, rows), 8)
+    age = np.clip(np.rint(length * 6 + rng.normal(2, 2, rows)), 1, 29).astype(int)
+    lines = [" ".join(("{0}".format(s), *("{0:.10g}".format(v) for v in values)))
+             for s, *values in zip(sex, length, diameter, height, weight, shucked, viscera, shell)]
+    return lines, age
+
+
+def survey_pages(scale, seed=100):
+    """
+    generator that returns the lines of the synthetic survey page by page
+    :param scale: the survey has scale times the rows of data.pdf
+    :param seed:
+    :return:
+    """
+    rows = BASE_ROWS * scale
+    lines, age = feature_rows(rows, seed)
+    body = [HEADER]
+    for c, line in enumerate(lines):
+        if c and c % GARBAGE_ROW_EVERY == 0:
+            # a row with text in place of measurements, it is kept with missing values and still has an age
+            tokens = line.split()
+            line = " ".join(tokens[:4] + ["LOL", tokens[5], "OMG", "BBQ"])
+        body.append(line)
+        if c and c % DIRTY_LINE_EVERY == 0:
+            body.append(DIRTY_LINES[(c // DIRTY_LINE_EVERY) % len(DIRTY_LINES)])
+    page = 1
+    for start in range(0, len(body), ROWS_PER_PAGE):
+        yield ["Sheet1", "Page {0}".format(page)] + body[start:start + ROWS_PER_PAGE]
+        page += 1
+    ages = [" Age"] + [str(a) for a in age]
+    for start in range(0, len(ages), ROWS_PER_PAGE):
+        yield ["Sheet1", "Page {0}".format(page)] + ages[start:start + ROWS_PER_PAGE]
+        page += 1
+
+
+def escape(text):
+    """
+    escapes a line for a pdf string literal
+    :param text:
+    :return:
+    """
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_survey_pdf(pages, destination_location):
+    """
+    writes the pages as a minimal pdf with one helvetica text block per page, objects are written as they are
+    generated so the pdf does not have to fit in memory
+    :param pages: iterable of lists of lines
+    :param destination_location:
+    :return: number of pages
+    """
+    offsets = []
+
+    with open(destination_location, "wb") as f:
+        def write_object(number, body):
+            while len(offsets) < number:
+                offsets.append(None)
+            offsets[number - 1] = f.tell()
+            f.write("{0} 0 obj\n".format(number).encode() + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        page_objects = []
+        number = 4
+        for lines in pages:
+            text = "BT /F1 8 Tf 10 TL 40 812 Td " + " T* ".join("({0}) Tj".format(escape(l)) for l in lines) + " ET"
+            content = text.encode("latin-1")
+            write_object(number, "<< /Length {0} >>\nstream\n".format(len(content)).encode() + content +
+                         b"\nendstream")
+            write_object(number + 1, "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {0} 0 R "
+                                     "/Resources << /Font << /F1 3 0 R >> >> >>".format(number).encode())
+            page_objects.append(number + 1)
+            number += 2
+        kids = " ".join("{0} 0 R".format(p) for p in page_objects)
+        write_object(2, "<< /Type /Pages /Kids [{0}] /Count {1} >>".format(kids, len(page_objects)).encode())
+        write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref = f.tell()
+        f.write("xref\n0 {0}\n0000000000 65535 f \n".format(len(offsets) + 1).encode())
+        for offset in offsets:
+            f.write("{0:010d} 00000 n \n".format(offset).encode())
+        f.write("trailer\n<< /Size {0} /Root 1 0 R >>\nstartxref\n{1}\n%%EOF\n".format(len(offsets) + 1,
+                                                                                       xref).encode())
+    return len(page_objects)
+
+
+def write_survey_text(pages, destination_location):
+    """
+    writes the lines of the pages as a text file, the lines a pdf backend returns for the pdf
+    :param pages: iterable of lists of lines
+    :param destination_location:
+    :return: number of lines
+    """
+    count = 0
+    with open(destination_location, "w") as f:
+        for lines in pages:
+            f.write("\n".join(lines) + "\n")
+            count += len(lines)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=1, help="the survey has scale times the rows of data.pdf")
+    parser.add_argument("--seed", type=int, default=100)
+    parser.add_argument("--output", help="pdf file to write")
+    parser.add_argument("--text", help="text file to write with the same lines")
+    args = parser.parse_args()
+    if args.output:
+        print("{0}: {1} pages".format(args.output, write_survey_pdf(survey_pages(args.scale, args.seed),
+                                                                    args.output)))
+    if args.text:
+        print("{0}: {1} lines".format(args.text, write_survey_text(survey_pages(args.scale, args.seed), args.text)))
+
+
+if __name__ == "__main__":
+    main()
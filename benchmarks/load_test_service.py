@@ -0,0 +1,110 @@
+"""
+load test of the crab age service, every client thread keeps one connection open and sends its requests one after
+the other, so --clients is the number of concurrent requests the service can merge into a micro batch
+
+    python -m crab_analyser.crab_service --model_dir models &
+    python benchmarks/load_test_service.py --csv crab_data.csv --clients 32 --requests 200 --rows 1
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crab_analyser.crab_ml import OUTPUT_COLUMNS
+
+
+def load_rows(csv_location):
+    """
+    rows of the parser csv with the column names of the README, the measurements the service expects
+    :param csv_location:
+    :return:
+    """
+    crab_data = pd.read_csv(csv_location).dropna()
+    crab_data = crab_data[[c for c in OUTPUT_COLUMNS if c in crab_data.columns]].rename(columns=OUTPUT_COLUMNS)
+    return crab_data.to_dict(orient="records")
+
+
+def client(host, port, bodies, latencies, failures):
+    """
+    sends the bodies over one keep alive connection and appends the latency of every request
+    :param host:
+    :param port:
+    :param bodies:
+    :param latencies: shared list
+    :param failures: shared list
+    :return:
+    """
+    connection = http.client.HTTPConnection(host, port)
+    for body in bodies:
+        start = time.perf_counter()
+        connection.request("POST", "/predict", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            failures.append(response.status)
+    connection.close()
+
+
+def fetch_stats(host, port):
+    """
+    counters reported by the service
+    :param host:
+    :param port:
+    :return:
+    """
+    connection = http.client.HTTPConnection(host, port)
+    connection.request("GET", "/stats")
+    stats = json.loads(connection.getresponse().read())
+    connection.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--csv", default="crab_data.csv", help="csv file written by the parser")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent connections")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--rows", type=int, default=1, help="rows per request")
+    parser.add_argument("--output", default=None, help="optional json file for the results")
+    args = parser.parse_args()
+
+    rows = load_rows(args.csv)
+    rng = np.random.default_rng(100)
+    bodies = [[json.dumps([rows[i] for i in rng.integers(0, len(rows), args.rows)]) for _ in range(args.requests)]
+              for _ in range(args.clients)]
+    latencies, failures = [], []
+    threads = [threading.Thread(target=client, args=(args.host, args.port, b, latencies, failures)) for b in bodies]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    result = {"clients": args.clients, "requests": len(latencies), "rows_per_request": args.rows,
+              "failures": len(failures), "seconds": seconds,
+              "requests_per_second": len(latencies) / seconds,
+              "rows_per_second": len(latencies) * args.rows / seconds,
+              "p50_ms": float(np.percentile(latencies_ms, 50)),
+              "p99_ms": float(np.percentile(latencies_ms, 99)),
+              "service": fetch_stats(args.host, args.port)}
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
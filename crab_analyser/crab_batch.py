@@ -0,0 +1,113 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+from crab_analyser.crab_columnar import columnar_location, write_columnar
+from crab_analyser.crab_pdf_parser_v2 import CrabPDFParser
+
+logger = logging.getLogger('crabdata')
+
+
+def parse_pdf_file(source_location, cache=None, backend=None):
+    """
+    worker function, parses a single pdf file and returns its data frame together with the numbers for the report
+    it is a module level function so that it can be pickled and sent to the process pool
+    a file that fails to parse returns no frame so that one bad survey does not stop the whole batch
+    :param source_location:
+    :param cache: optional CrabExtractionCache shared by the workers
+    :param backend: optional pdf backend, tika by default
+    :return:
+    """
+    start = time.perf_counter()
+    crab_data_parser = CrabPDFParser(source_location, None, cache, backend)
+    try:
+        frame = crab_data_parser.extract()
+        error = None
+    except Exception as e:
+        frame = None
+        error = "{0}: {1}".format(type(e).__name__, e)
+    report = {"source_file": os.path.basename(source_location),
+              "rows": 0 if frame is None else len(frame),
+              "dirty_rows": len(crab_data_parser.dirty_rows),
+              "seconds": time.perf_counter() - start,
+              "error": error}
+    return frame, report
+
+
+class CrabBatchParser:
+    def __init__(self, source_directory, destination_location, report_location=None, workers=None, cache=None,
+                 backend=None, columnar_format=None):
+        """
+        parses every pdf of a directory on a process pool and merges them into a single data set
+        :param source_directory: directory holding the survey pdf files
+        :param destination_location: csv file for the merged data set
+        :param report_location: optional csv file for the per file report
+        :param workers: number of worker processes, defaults to the number of cpus
+        :param cache: optional CrabExtractionCache, unchanged files are then loaded instead of parsed
+        :param backend: optional pdf backend, tika by default
+        :param columnar_format: feather or parquet, also writes a columnar copy of the merged data set
+        """
+        self.source_directory = source_directory
+        self.destination_location = destination_location
+        self.report_location = report_location
+        self.workers = workers
+        self.cache = cache
+        self.backend = backend
+        self.columnar_format = columnar_format
+        logger.debug("CrabBatchParser called")
+
+    def list_source_files(self):
+        """
+        returns the pdf files of the source directory sorted by name
+        sorting makes the row order of the merged data set independent from the order the workers finish in
+        :return:
+        """
+        return sorted(os.path.join(self.source_directory, f) for f in os.listdir(self.source_directory)
+                      if f.lower().endswith(".pdf"))
+
+    def process(self):
+        """
+        main entry function for this class
+        returns the per file report as a data frame
+        :return:
+        """
+        source_files = self.list_source_files()
+        if not source_files:
+            raise FileNotFoundError("No pdf files found in {0}".format(self.source_directory))
+        logger.info("Parsing {0} pdf files with {1} workers".format(len(source_files),
+                                                                    self.workers or os.cpu_count()))
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            # map returns the results in the order of source_files no matter which worker finishes first
+            results = list(executor.map(partial(parse_pdf_file, cache=self.cache, backend=self.backend), source_files))
+
+        frames = []
+        for frame, report in results:
+            if frame is not None:
+                frame.insert(0, "source_file", report["source_file"])
+                frames.append(frame)
+        if not frames:
+            raise RuntimeError("None of the {0} pdf files could be parsed".format(len(source_files)))
+        crab_data = pd.concat(frames, ignore_index=True)
+        crab_data.to_csv(self.destination_location, index=False)
+        if self.columnar_format:
+            write_columnar(crab_data, columnar_location(self.destination_location, self.columnar_format),
+                           self.columnar_format)
+
+        report = pd.DataFrame([r for _, r in results])
+        for r in report.itertuples():
+            if r.error:
+                logger.error("{0}: failed after {1:.2f}s ({2})".format(r.source_file, r.seconds, r.error))
+            else:
+                logger.info("{0}: {1} rows, {2} dirty rows, {3:.2f}s".format(r.source_file, r.rows, r.dirty_rows,
+                                                                             r.seconds))
+        logger.info("Batch parsing of {0} files finished in {1:.2f}s, {2} failed".format(
+            len(source_files), time.perf_counter() - start, report["error"].notna().sum()))
+        if self.report_location:
+            report.to_csv(self.report_location, index=False)
+        return report
@@ -0,0 +1,95 @@
+import logging
+import os
+import time
+
+import pandas as pd
+
+from crab_analyser.crab_dtypes import apply_dtype_policy
+
+logger = logging.getLogger('crabdata')
+
+COLUMNAR_FORMATS = {"feather": ".feather", "parquet": ".parquet"}
+
+
+def columnar_location(location, columnar_format):
+    """
+    location of the columnar copy of a csv file, the same file with the extension of the format
+    :param location:
+    :param columnar_format: feather or parquet
+    :return:
+    """
+    return os.path.splitext(location)[0] + COLUMNAR_FORMATS[columnar_format]
+
+
+def write_columnar(frame, location, columnar_format):
+    """
+    writes the frame with the compact dtype policy as feather or parquet, the age is a nullable integer column
+    feather files are written uncompressed so that readers can memory map them without copying
+    :param frame:
+    :param location:
+    :param columnar_format: feather or parquet
+    :return:
+    """
+    # pyarrow is optional, it is only needed for the columnar output
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(apply_dtype_policy(frame, "compact", nullable_age=True), preserve_index=False)
+    if columnar_format == "feather":
+        import pyarrow.feather as pf
+
+        pf.write_feather(table, location, compression="uncompressed")
+    elif columnar_format == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, location)
+    else:
+        raise ValueError("Unknown columnar format {0}, expected one of {1}".format(columnar_format,
+                                                                                sorted(COLUMNAR_FORMATS)))
+    logger.info("Columnar copy saved: {0}".format(location))
+
+
+def read_columnar(location, columns=None):
+    """
+    reads a feather or parquet file written by write_columnar, only the given columns are read
+    feather files are memory mapped, the pages of the columns that are not used are never loaded
+    :param location:
+    :param columns: optional subset of columns to read
+    :return:
+    """
+    if location.lower().endswith(COLUMNAR_FORMATS["feather"]):
+        import pyarrow.feather as pf
+
+        table = pf.read_table(location, columns=columns, memory_map=True)
+    else:
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(location, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def compare_with_csv(csv_location, location, columns=None, repeat=3):
+    """
+    file size and best of repeat load time of the columnar copy next to the csv file it was written with
+    :param csv_location:
+    :param location: columnar copy of the csv file
+    :param columns: optional subset of columns to load from both files
+    :param repeat:
+    :return:
+    """
+    def best_of(load):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            load()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    report = {"csv_bytes": os.path.getsize(csv_location),
+              "columnar_bytes": os.path.getsize(location),
+              "csv_load_seconds": best_of(lambda: pd.read_csv(csv_location, usecols=columns)),
+              "columnar_load_seconds": best_of(lambda: read_columnar(location, columns))}
+    logger.info("{0}: {1:.2f} MB and {2:.1f} ms to load, {3}: {4:.2f} MB and {5:.1f} ms to load{6}".format(
+        os.path.basename(csv_location), report["csv_bytes"] / 2 ** 20, report["csv_load_seconds"] * 1000,
+        os.path.basename(location), report["columnar_bytes"] / 2 ** 20, report["columnar_load_seconds"] * 1000,
+        "" if columns is None else " ({0})".format(", ".join(columns))))
+    return report
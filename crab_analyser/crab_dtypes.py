@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+MEASUREMENT_COLUMNS = ["length", "diameter", "height", "weight", "shucked_weight", "viscera_weight", "shell_weight"]
+# predicted ages and their errors, they are only in the frames of the prediction csv files
+PREDICTION_COLUMNS = ["age_ols", "age_forest", "percentage_difference"]
+CATEGORY_COLUMNS = ["sex", "source_file"]
+
+# dtypes of the frames that go from the parser to the models and of the columnar files, wide is what pandas infers on
+# its own
+# measurements have far fewer significant digits than float32 keeps and the forest casts to float32 anyway, but frames
+# written from compact columns get float32 digits (24.6357155 becomes 24.635715), so wide is the default and the
+# parsed csv file and the model history are always written at full precision
+# the age gets the first integer dtype of the list that holds all of it, see age_dtype
+DTYPE_POLICIES = {"wide": {"measurements": np.float64, "age": ["Int64"], "categories": object,
+                           "encoded": np.float64},
+                  "compact": {"measurements": np.float32, "age": ["Int8", "Int16"], "categories": "category",
+                              "encoded": np.float32}}
+
+
+def get_dtype_policy(name):
+    """
+    returns the dtypes of a policy by name, None is the wide one
+    :param name: one of the keys of DTYPE_POLICIES
+    :return:
+    """
+    if name is None:
+        return DTYPE_POLICIES["wide"]
+    if name not in DTYPE_POLICIES:
+        raise ValueError("Unknown dtype policy {0}, expected one of {1}".format(name, sorted(DTYPE_POLICIES)))
+    return DTYPE_POLICIES[name]
+
+
+def csv_dtypes(name):
+    """
+    dtype argument of pd.read_csv for the parser output, the age is left to apply_dtype_policy because its dtype
+    depends on the values
+    :param name: dtype policy
+    :return:
+    """
+    policy = get_dtype_policy(name)
+    dtypes = {c: policy["measurements"] for c in MEASUREMENT_COLUMNS}
+    dtypes.update({c: policy["categories"] for c in CATEGORY_COLUMNS})
+    return dtypes
+
+
+def age_dtype(age, name, nullable=False):
+    """
+    dtype of the age column under a policy, the first integer dtype of the policy that holds every age, the
+    measurement dtype when the ages are not whole numbers and None when the column is left as it is
+    the integers are nullable, so rows without an age stay missing in the columnar files; the models need numpy
+    dtypes, so without nullable the numpy version is returned and an age with missing values is left as it is
+    :param age: series
+    :param name: dtype policy
+    :param nullable:
+    :return:
+    """
+    policy = get_dtype_policy(name)
+    known = age.dropna()
+    if not (known == np.round(known)).all():
+        return policy["measurements"]
+    if not nullable and len(known) < len(age):
+        return None
+    for dtype in map(pd.api.types.pandas_dtype, policy["age"]):
+        limits = np.iinfo(dtype.numpy_dtype)
+        if known.empty or known.between(limits.min, limits.max).all():
+            return dtype if nullable else dtype.numpy_dtype
+    return None
+
+
+def apply_dtype_policy(frame, name, nullable_age=False):
+    """
+    returns the frame with the dtypes of the policy, columns it does not know keep theirs
+    :param frame:
+    :param name: dtype policy
+    :param nullable_age: see age_dtype, the frames of the models need it off and the columnar files on
+    :return:
+    """
+    policy = get_dtype_policy(name)
+    dtypes = {c: policy["measurements"] for c in MEASUREMENT_COLUMNS + PREDICTION_COLUMNS
+              if c in frame and pd.api.types.is_numeric_dtype(frame[c])}
+    dtypes.update({c: policy["categories"] for c in CATEGORY_COLUMNS if c in frame})
+    if "age" in frame and pd.api.types.is_numeric_dtype(frame["age"]):
+        dtype = age_dtype(frame["age"], name, nullable_age)
+        if dtype is not None:
+            dtypes["age"] = dtype
+    # astype copies even when nothing changes, the frame is returned as it is then
+    dtypes = {c: d for c, d in dtypes.items() if frame[c].dtype != d}
+    return frame.astype(dtypes) if dtypes else frame
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+logger = logging.getLogger('crabdata')
+
+
+class CrabExtractionCache:
+    def __init__(self, cache_directory, max_bytes=512 * 1024 * 1024):
+        """
+        on disk cache of parsed pdf files
+        entries are keyed by the sha256 of the pdf content and the parser version, so a renamed or copied file is
+        still a hit while a changed file or a new parser version is a miss
+        :param cache_directory:
+        :param max_bytes: total size the cache is trimmed back to, least recently used entries are evicted first
+        """
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+    def key(self, source_location, parser_version):
+        """
+        content hash of the pdf file combined with the parser version
+        :param source_location:
+        :param parser_version:
+        :return:
+        """
+        digest = hashlib.sha256()
+        with open(source_location, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return "{0}-{1}".format(digest.hexdigest(), parser_version)
+
+    def entry_location(self, key):
+        """
+        file that holds the entry of the key
+        :param key:
+        :return:
+        """
+        return os.path.join(self.cache_directory, key + ".pkl")
+
+    def get(self, key):
+        """
+        returns the cached (data frame, dirty rows) for the key or None
+        a hit refreshes the modification time of the entry, which is what the lru eviction is ordered by
+        :param key:
+        :return:
+        """
+        location = self.entry_location(key)
+        try:
+            with open(location, "rb") as f:
+                entry = pickle.load(f)
+            os.utime(location)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        logger.debug("Extraction cache hit: {0}".format(key))
+        return entry["frame"], entry["dirty_rows"]
+
+    def put(self, key, frame, dirty_rows):
+        """
+        stores the parsed data frame and its dirty rows as a pickle and evicts old entries if needed
+        the entry is written to a temporary file first so that parallel writers never leave a half written entry
+        :param key:
+        :param frame:
+        :param dirty_rows:
+        :return:
+        """
+        handle, temporary_location = tempfile.mkstemp(dir=self.cache_directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                pickle.dump({"frame": frame, "dirty_rows": list(dirty_rows)}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_location, self.entry_location(key))
+        except BaseException:
+            os.remove(temporary_location)
+            raise
+        logger.debug("Extraction cache stored: {0}".format(key))
+        self.evict()
+
+    def evict(self):
+        """
+        removes the least recently used entries until the cache fits in max_bytes
+        :return:
+        """
+        entries = []
+        for name in os.listdir(self.cache_directory):
+            if not name.endswith(".pkl"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_directory, name))
+                logger.debug("Extraction cache evicted: {0}".format(name))
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
@@ -0,0 +1,172 @@
+import logging
+import pickle
+import time
+
+import numpy as np
+
+logger = logging.getLogger('crabdata')
+
+# number of (row, tree) pairs walked at the same time, bounds the memory of the evaluator to a few 10 MB
+EVALUATION_BLOCK = 1 << 21
+# the rows that reached their leaf are dropped from the evaluation every COMPACTION_STEPS levels
+COMPACTION_STEPS = 4
+
+
+class CompiledForest:
+    def __init__(self, preprocess, target_transformer, feature, threshold, left, value, roots, depth):
+        """
+        random forest flattened into contiguous numpy arrays, one entry per node of every tree
+        the two children of a node are stored next to each other, so a row moves to left + (value > threshold)
+        leaves point to themselves with an infinite threshold, so a row that reached its leaf stays there
+        use CompiledForest.compile to build one from a fitted pipeline
+        :param preprocess: fitted column transformer of the pipeline
+        :param target_transformer: fitted target transformer of the TransformedTargetRegressor
+        :param feature: int32 feature index of every node
+        :param threshold: float32 split threshold of every node, rows go left when value <= threshold
+        :param left: int32 global offset of the left child, the right child follows it
+        :param value: float32 prediction of every node, only read at the leaves
+        :param roots: int32 offset of the root of every tree
+        :param depth: depth of the deepest tree
+        """
+        self.preprocess = preprocess
+        self.target_transformer = target_transformer
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+
+    @classmethod
+    def compile(cls, f_reg_ttr):
+        """
+        compiles the fitted forest pipeline of CrabAgePredictor.fit_forest
+        :param f_reg_ttr: fitted TransformedTargetRegressor around the preprocess / model pipeline
+        :return:
+        """
+        forest = f_reg_ttr.regressor_.named_steps['model']
+        features, thresholds, lefts, values, roots = [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            order = cls.sibling_order(tree.children_left, tree.children_right)
+            is_leaf = tree.children_left[order] == -1
+            # position of every original node in the new order
+            position = np.empty(tree.node_count, dtype=np.int64)
+            position[order] = np.arange(tree.node_count)
+            features.append(np.where(is_leaf, 0, tree.feature[order]).astype(np.int32))
+            # sklearn compares the float32 input with a float64 threshold, rounding the threshold down to the
+            # next float32 keeps x <= threshold exact for every float32 x
+            threshold = tree.threshold[order].astype(np.float32)
+            too_high = threshold.astype(np.float64) > tree.threshold[order]
+            threshold[too_high] = np.nextafter(threshold[too_high], np.float32(-np.inf))
+            threshold[is_leaf] = np.inf
+            thresholds.append(threshold)
+            left = np.where(is_leaf, np.arange(tree.node_count), position[tree.children_left[order]])
+            lefts.append(left.astype(np.int32) + offset)
+            values.append(tree.value[order, 0, 0].astype(np.float32))
+            roots.append(offset)
+            offset += tree.node_count
+        compiled = cls(f_reg_ttr.regressor_.named_steps['preprocess'], f_reg_ttr.transformer_,
+                       np.concatenate(features), np.concatenate(thresholds), np.concatenate(lefts),
+                       np.concatenate(values), np.array(roots, dtype=np.int32),
+                       max(estimator.tree_.max_depth for estimator in forest.estimators_))
+        logger.debug("Compiled {0} trees with {1} nodes into {2:.1f} MB".format(
+            len(compiled.roots), offset, compiled.nbytes() / 2 ** 20))
+        return compiled
+
+    @staticmethod
+    def sibling_order(children_left, children_right):
+        """
+        breadth first order of the nodes of one tree in which the right child always follows the left child
+        :param children_left: sklearn child arrays, -1 marks a leaf
+        :param children_right:
+        :return:
+        """
+        order = [np.zeros(1, dtype=np.int64)]
+        frontier = order[0]
+        while len(frontier):
+            parents = frontier[children_left[frontier] != -1]
+            frontier = np.column_stack((children_left[parents], children_right[parents])).ravel()
+            order.append(frontier)
+        return np.concatenate(order)
+
+    def nbytes(self):
+        """
+        memory taken by the node arrays
+        :return:
+        """
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.value, self.roots))
+
+    def predict_transformed(self, X):
+        """
+        vectorized evaluation of the already preprocessed rows
+        all the (row, tree) pairs of a block move one level down per step, so the python loop runs depth times
+        per block instead of once per tree, pairs that reached their leaf are dropped every few steps
+        :param X: 2d array of preprocessed features
+        :return:
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        flat_X = X.ravel()
+        totals = np.zeros(n_rows, dtype=np.float64)
+        block_rows = max(1, EVALUATION_BLOCK // n_trees)
+        for start in range(0, n_rows, block_rows):
+            stop = min(start + block_rows, n_rows)
+            rows = np.repeat(np.arange(stop - start, dtype=np.int64), n_trees)
+            block_X = flat_X[start * n_features:stop * n_features]
+            node = np.tile(self.roots, stop - start)
+            for step in range(1, self.depth + 1):
+                go_right = block_X[rows * n_features + self.feature[node]] > self.threshold[node]
+                node = self.left[node] + go_right
+                if step % COMPACTION_STEPS == 0 or step == self.depth:
+                    done = self.left[node] == node
+                    totals[start:stop] += np.bincount(rows[done], weights=self.value[node[done]],
+                                                      minlength=stop - start)
+                    rows, node = rows[~done], node[~done]
+                    if not len(node):
+                        break
+        return totals / n_trees
+
+    def predict(self, X):
+        """
+        predicted age of every row, same as f_reg_ttr.predict(X).ravel() up to float32 rounding of the leaves
+        :param X: data frame with the feature columns the forest was fitted on
+        :return:
+        """
+        y = self.predict_transformed(self.preprocess.transform(X))
+        return self.target_transformer.inverse_transform(y.reshape(-1, 1)).ravel()
+
+    def compare(self, f_reg_ttr, X, repeat=3):
+        """
+        returns memory, throughput and the largest prediction difference of the compiled forest against the
+        sklearn model it was compiled from
+        :param f_reg_ttr: the fitted pipeline passed to compile
+        :param X: rows to score
+        :param repeat: the best of repeat timings is reported
+        :return:
+        """
+        def best_time(predict):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                predictions = predict(X)
+                timings.append(time.perf_counter() - start)
+            return min(timings), np.ravel(predictions)
+
+        sklearn_seconds, sklearn_predictions = best_time(f_reg_ttr.predict)
+        compiled_seconds, compiled_predictions = best_time(self.predict)
+        report = {"trees": len(self.roots),
+                  "nodes": len(self.feature),
+                  "sklearn_bytes": len(pickle.dumps(f_reg_ttr.regressor_.named_steps['model'],
+                                                    protocol=pickle.HIGHEST_PROTOCOL)),
+                  "compiled_bytes": self.nbytes(),
+                  "sklearn_rows_per_second": len(X) / sklearn_seconds,
+                  "compiled_rows_per_second": len(X) / compiled_seconds,
+                  "max_abs_difference": float(np.max(np.abs(sklearn_predictions - compiled_predictions)))}
+        logger.info("Compiled forest: {0:.1f} MB vs {1:.1f} MB, {2:.0f} vs {3:.0f} rows/s, max difference {4:.2e}"
+                    .format(report["compiled_bytes"] / 2 ** 20, report["sklearn_bytes"] / 2 ** 20,
+                            report["compiled_rows_per_second"], report["sklearn_rows_per_second"],
+                            report["max_abs_difference"]))
+        return report
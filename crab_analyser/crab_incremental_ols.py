@@ -0,0 +1,272 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import QuantileTransformer
+
+from crab_analyser.crab_preprocess import CrabStreamingPreprocessor, merge_moments
+
+logger = logging.getLogger('crabdata')
+
+MEASUREMENT_COLUMNS = ["length", "diameter", "height", "weight", "shucked_weight", "viscera_weight", "shell_weight"]
+COLUMNS = ["sex"] + MEASUREMENT_COLUMNS + ["age"]
+
+
+def holdout_mask(start, stop, test_size, random_state):
+    """
+    splits the rows start to stop into train and test rows
+    the split only depends on the position of the row, so every pass over the csv file finds the same test rows
+    without keeping them in memory
+    :param start: position of the first row among the rows left after the outlier filter
+    :param stop:
+    :param test_size: fraction of the rows used for testing
+    :param random_state:
+    :return:
+    """
+    # splitmix64 of the row position
+    with np.errstate(over="ignore"):
+        z = np.arange(start, stop, dtype=np.uint64) + np.uint64(random_state) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) * 2.0 ** -53 < test_size
+
+
+def weighted_percentiles(values, counts, references):
+    """
+    np.nanpercentile(column, references * 100) of the column that repeats every value counts times
+    the column itself is never built, so this works for any number of rows
+    :param values: sorted distinct values
+    :param counts: number of rows of every value
+    :param references: quantiles between 0 and 1
+    :return:
+    """
+    cumulative = np.cumsum(counts)
+    # same arithmetic as numpy's linear method so that the quantiles match the in memory fit
+    virtual = (cumulative[-1] - 1) * np.true_divide(references * 100, 100)
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    previous = np.clip(previous, 0, cumulative[-1] - 1).astype(np.int64)
+    upcoming = np.clip(previous + 1, 0, cumulative[-1] - 1)
+    a = values[np.searchsorted(cumulative, previous, side="right")]
+    b = values[np.searchsorted(cumulative, upcoming, side="right")]
+    quantiles = a + (b - a) * gamma
+    high = gamma >= 0.5
+    quantiles[high] = b[high] - (b - a)[high] * (1 - gamma[high])
+    return quantiles
+
+
+def empty_statistics(features):
+    """
+    sufficient statistics of no rows for a design matrix with the given number of columns, see add_rows
+    :param features:
+    :return:
+    """
+    return {"count": 0, "mean": np.zeros(features), "codeviation": np.zeros((features, features)),
+            "age_rows": {}, "age_sums": {}}
+
+
+def add_rows(statistics, X, age):
+    """
+    merges the rows of the design matrix X and their ages into the sufficient statistics, in place
+    means and deviations of the columns, the centered cross products and the sum of the design rows of every age
+    :param statistics: returned by empty_statistics
+    :param X:
+    :param age:
+    :return:
+    """
+    if not len(X):
+        return statistics
+    chunk_mean = X.mean(axis=0)
+    centered = X - chunk_mean
+    statistics["count"], statistics["mean"], statistics["codeviation"] = merge_moments(
+        statistics["count"], statistics["mean"], statistics["codeviation"], len(X), chunk_mean, centered.T @ centered)
+    for value in np.unique(age):
+        rows = X[age == value]
+        statistics["age_rows"][value] = statistics["age_rows"].get(value, 0) + len(rows)
+        statistics["age_sums"][value] = statistics["age_sums"].get(value, 0) + rows.sum(axis=0)
+    return statistics
+
+
+def fit_quantile_transformer(values, counts, output_distribution="normal"):
+    """
+    QuantileTransformer fitted on the ages from their counts, sklearn computes the same quantiles on up to its
+    subsample of 10000 rows and estimates them from a random subsample above that
+    :param values: sorted distinct ages
+    :param counts:
+    :param output_distribution:
+    :return:
+    """
+    transformer = QuantileTransformer(output_distribution=output_distribution)
+    transformer.n_quantiles_ = max(1, min(transformer.n_quantiles, counts.sum()))
+    transformer.references_ = np.linspace(0, 1, transformer.n_quantiles_, endpoint=True)
+    quantiles = weighted_percentiles(values.astype(np.float64), counts, transformer.references_)
+    transformer.quantiles_ = np.maximum.accumulate(quantiles).reshape(-1, 1)
+    transformer.n_features_in_ = 1
+    return transformer
+
+
+def solve_least_squares(codeviation, cross):
+    """
+    minimum norm solution of the normal equations, which is what LinearRegression returns for the one hot
+    columns that always add up to one
+    the columns are scaled to unit variance first so that the rank cut off does not depend on their units
+    :param codeviation: X'X of the centered design matrix
+    :param cross: X'y of the centered design matrix and target
+    :return:
+    """
+    deviation = np.sqrt(np.diag(codeviation))
+    # columns without variance, like a sex that never appears, get no weight as with drop_invariant
+    used = deviation > 0
+    scaled = codeviation[np.ix_(used, used)] / np.outer(deviation[used], deviation[used])
+    eigenvalues, eigenvectors = np.linalg.eigh(scaled)
+    rank = eigenvalues > eigenvalues.max() * 1e-10
+    inverse = (eigenvectors[:, rank] / eigenvalues[rank]) @ eigenvectors[:, rank].T
+    coef_used = inverse @ (cross[used] / deviation[used]) / deviation[used]
+    # remove the part in the null space of the unscaled problem, that leaves the minimum norm solution
+    null_space = eigenvectors[:, ~rank] / deviation[used][:, None]
+    if null_space.shape[1]:
+        coef_used -= null_space @ np.linalg.lstsq(null_space, coef_used, rcond=None)[0]
+    coef = np.zeros(len(cross))
+    coef[used] = coef_used
+    return coef
+
+
+def solve_statistics(statistics, transform_values):
+    """
+    least squares fit of the transformed age on the design matrix from the sufficient statistics alone
+    keeping the rows per age makes X'y of the transformed age exact, ages are whole numbers so there are few
+    :param statistics: returned by add_rows
+    :param transform_values: function that returns the transformed age of the sorted distinct ages
+    :return: coefficients and intercept
+    """
+    age_rows, age_sums, mean = statistics["age_rows"], statistics["age_sums"], statistics["mean"]
+    values = np.array(sorted(age_rows))
+    counts = np.array([age_rows[v] for v in values])
+    transformed = transform_values(values)
+    transformed_mean = (transformed * counts).sum() / statistics["count"]
+    # X'y of the centered design matrix and the centered transformed age
+    cross = sum(t * (age_sums[v] - age_rows[v] * mean) for v, t in zip(values, transformed))
+    coef = solve_least_squares(statistics["codeviation"], cross)
+    return coef, transformed_mean - mean @ coef
+
+
+class CrabIncrementalOLS:
+    def __init__(self, source_location, chunk_size=100000, test_size=0.2, random_state=100):
+        """
+        out of core version of CrabAgePredictor.fit_ols for csv files that do not fit in memory
+        the csv file is read in chunks and only sufficient statistics are kept, so memory does not grow with the
+        number of rows: means and deviations of the columns, the centered cross products of the design matrix and
+        the sum of the design rows of every distinct age
+        the age is only transformed once its quantiles are known, keeping the rows per age makes X'y of the
+        transformed age exact after one pass, ages are whole numbers so there are only a few of them
+        :param source_location: csv or parquet file with the columns of the parser output
+        :param chunk_size: rows read at a time
+        :param test_size: fraction of the rows held out for the r-squared
+        :param random_state: seed of the train / test split
+        """
+        self.source_location = source_location
+        self.preprocessor = CrabStreamingPreprocessor(source_location, chunk_size)
+        self.test_size = test_size
+        self.random_state = random_state
+        self.categories = []
+        self.feature_columns = None
+        self.transformer = None
+        self.coef_ = None
+        self.intercept_ = None
+        self.training_rows = 0
+        logger.debug("CrabIncrementalOLS called")
+
+    def filter_and_encode(self, chunk):
+        """
+        imputes the chunk, drops rows more than 3 std away and one hot encodes sex like the in memory fit
+        returns the design matrix and the age of the rows that are kept
+        :param chunk:
+        :return:
+        """
+        chunk = self.preprocessor.clean(chunk)
+        sex = chunk["sex"].astype(str).to_numpy()
+        X = np.empty((len(chunk), len(self.feature_columns)))
+        for j, category in enumerate(self.categories):
+            X[:, j] = sex == category
+        X[:, len(self.categories):] = chunk[MEASUREMENT_COLUMNS].to_numpy(dtype=np.float64)
+        return X, chunk["age"].to_numpy(dtype=np.float64)
+
+    def fit(self):
+        """
+        reads the source file twice and solves the least squares problem once at the end
+        :return:
+        """
+        start = time.perf_counter()
+        self.preprocessor.collect_statistics(COLUMNS)
+        self.categories = self.preprocessor.categories
+        self.feature_columns = ["sex_{0}".format(c) for c in self.categories] + MEASUREMENT_COLUMNS
+        statistics = empty_statistics(len(self.feature_columns))
+        position = 0
+        for chunk in self.preprocessor.iter_chunks(COLUMNS):
+            X, age = self.filter_and_encode(chunk)
+            train = ~holdout_mask(position, position + len(X), self.test_size, self.random_state)
+            position += len(X)
+            add_rows(statistics, X[train], age[train])
+        if statistics["count"] == 0:
+            raise ValueError("No training rows left in {0}".format(self.source_location))
+        self.training_rows = statistics["count"]
+
+        values = np.array(sorted(statistics["age_rows"]))
+        self.transformer = fit_quantile_transformer(values, np.array([statistics["age_rows"][v] for v in values]))
+        self.coef_, self.intercept_ = solve_statistics(
+            statistics, lambda v: self.transformer.transform(v.reshape(-1, 1)).ravel())
+        logger.info("Incremental OLS fitted on {0} rows in {1:.2f}s".format(self.training_rows,
+                                                                          time.perf_counter() - start))
+        return self
+
+    def predict_matrix(self, X):
+        """
+        predicted age of the encoded design matrix
+        :param X:
+        :return:
+        """
+        return self.transformer.inverse_transform((X @ self.coef_ + self.intercept_).reshape(-1, 1)).ravel()
+
+    def score(self, destination_location=None):
+        """
+        last pass, r-squared of the test rows and optionally the predictions of all the rows that are kept, in the
+        format of CrabAgePredictor.ols_prediction, written chunk by chunk
+        :param destination_location:
+        :return:
+        """
+        count, mean, m2, squared_error = 0, 0.0, 0.0, 0.0
+        position = 0
+        header = True
+        for chunk in self.preprocessor.iter_chunks(COLUMNS):
+            X, age = self.filter_and_encode(chunk)
+            test = holdout_mask(position, position + len(X), self.test_size, self.random_state)
+            position += len(X)
+            predicted_age = self.predict_matrix(X)
+            if test.any():
+                squared_error += ((age[test] - predicted_age[test]) ** 2).sum()
+                count, mean, m2 = merge_moments(count, mean, m2, test.sum(), age[test].mean(),
+                                                ((age[test] - age[test].mean()) ** 2).sum())
+            if destination_location:
+                crab_df = pd.DataFrame(X[:, len(self.categories):], columns=MEASUREMENT_COLUMNS)
+                crab_df["age"] = age
+                crab_df["age_ols"] = predicted_age
+                crab_df["sex"] = np.array(self.categories)[X[:, :len(self.categories)].argmax(axis=1)]
+                crab_df["percentage_difference"] = np.abs(np.divide(age - predicted_age, age) * 100)
+                crab_df.to_csv(destination_location, index=False, header=header, mode="w" if header else "a")
+                header = False
+        return 1 - squared_error / m2 if m2 else float("nan")
+
+    def run(self):
+        """
+        main function for the class, fits, logs the r-squared and saves the predictions like ols_prediction
+        :return:
+        """
+        logger.info("running out of core Linear Regression model")
+        self.fit()
+        s = self.score("crab_predit_ols.csv")
+        logger.info("R-squared from Linear Regression is: {0}".format(s))
+        logger.debug("Linear Regression coefficients: {0}".format(dict(zip(self.feature_columns, self.coef_))))
+        logger.info("Crab data with predicted variables saved: {0}".format("crab_predit_ols.csv"))
+        logger.info("Linear Regression execution finished")
@@ -0,0 +1,197 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import time
+
+logger = logging.getLogger('crabdata')
+
+
+def read_peak_rss():
+    """
+    peak resident memory of the process in bytes since start up or since the last reset_peak_rss
+    :return:
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def reset_peak_rss():
+    """
+    resets the peak resident memory to the current one, only linux allows it
+    returns False when the peak can not be reset and read_peak_rss keeps the peak of the whole process
+    :return:
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class CrabMetrics:
+    def __init__(self):
+        """
+        records wall time, cpu time, peak memory and row counts of the pipeline stages
+        stages can be nested, the peak memory of a stage includes the stages inside it
+        one stage can be run under cProfile, see profile
+        """
+        self.records = []
+        self.stack = []
+        self.started = time.perf_counter()
+        self.started_at = datetime.datetime.now()
+        self.profile_stage = None
+        self.profile_location = None
+        # resetting the peak of a stage also resets the one of the process, the largest one seen is kept here
+        self.peak_rss_bytes = 0
+        self.frames = []
+
+    def read_peak_rss(self):
+        """
+        read_peak_rss that also keeps the largest peak of the run
+        :return:
+        """
+        peak = read_peak_rss()
+        self.peak_rss_bytes = max(self.peak_rss_bytes, peak)
+        return peak
+
+    def reset(self):
+        """
+        forgets the recorded stages, a new run starts now
+        :return:
+        """
+        self.records = []
+        self.stack = []
+        self.started = time.perf_counter()
+        self.started_at = datetime.datetime.now()
+        self.peak_rss_bytes = 0
+        self.frames = []
+
+    def profile(self, stage_name, destination_location):
+        """
+        runs the next stage with the given name under cProfile and dumps the stats to destination_location, they can be
+        read with pstats or snakeviz
+        :param stage_name:
+        :param destination_location:
+        :return:
+        """
+        self.profile_stage = stage_name
+        self.profile_location = destination_location
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        """
+        context manager that records one stage, the yielded dict can be used to set the rows of the stage once known
+        :param name: dotted stage name, e.g. parse.read_pdf
+        :param rows:
+        :return:
+        """
+        record = {"stage": name, "parent": self.stack[-1]["stage"] if self.stack else None, "rows": rows}
+        if self.stack:
+            # the peak is reset for this stage, the parent keeps the part of its peak that was before it
+            self.stack[-1]["peak_rss_bytes"] = max(self.stack[-1]["peak_rss_bytes"], self.read_peak_rss())
+        record["peak_scope"] = "stage" if reset_peak_rss() else "process"
+        record["peak_rss_bytes"] = 0
+        self.stack.append(record)
+        profiler = None
+        if name == self.profile_stage:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile_location)
+                logger.info("Profile of {0} saved: {1}".format(name, self.profile_location))
+                self.profile_stage = None
+            self.stack.pop()
+            record["peak_rss_bytes"] = max(record["peak_rss_bytes"], self.read_peak_rss())
+            if self.stack:
+                self.stack[-1]["peak_rss_bytes"] = max(self.stack[-1]["peak_rss_bytes"], record["peak_rss_bytes"])
+            record["peak_rss_mb"] = record.pop("peak_rss_bytes") / 2 ** 20
+            self.records.append(record)
+            logger.debug("{0}: {1:.3f}s wall, {2:.3f}s cpu, {3:.1f} MB peak{4}".format(
+                name, record["wall_seconds"], record["cpu_seconds"], record["peak_rss_mb"],
+                "" if record["rows"] is None else ", {0} rows".format(record["rows"])))
+
+    def frame(self, name, data, rows=None):
+        """
+        records how much memory a data frame or array of a stage takes, the memory report shows it per row
+        :param name: dotted stage name, e.g. parse.decode
+        :param data: data frame or numpy array
+        :param rows: rows the memory is for when data only holds a sample of them, the bytes are scaled up
+        :return:
+        """
+        if hasattr(data, "memory_usage"):
+            size = int(data.memory_usage(deep=True, index=False).sum())
+            dtypes = data.dtypes.astype(str).value_counts().to_dict()
+        else:
+            size = int(data.nbytes)
+            dtypes = {str(data.dtype): data.shape[1] if data.ndim > 1 else 1}
+        sample_rows = len(data)
+        rows = sample_rows if rows is None else rows
+        bytes_per_row = size / sample_rows if sample_rows else 0.0
+        record = {"stage": name, "rows": rows, "bytes": int(bytes_per_row * rows), "bytes_per_row": bytes_per_row,
+                  "dtypes": dtypes}
+        self.frames.append(record)
+        return record
+
+    def log_memory(self):
+        """
+        logs the bytes per row of every frame recorded with frame
+        :return:
+        """
+        for record in self.frames:
+            logger.info("{0}: {1:.1f} bytes per row, {2:.1f} MB for {3} rows ({4})".format(
+                record["stage"], record["bytes_per_row"], record["bytes"] / 2 ** 20, record["rows"],
+                ", ".join("{0} x{1}".format(d, n) for d, n in record["dtypes"].items())))
+
+    def report(self, **extra):
+        """
+        one json serialisable record of the run with all its stages in the order they finished
+        :param extra: values added to the record, e.g. the command line arguments
+        :return:
+        """
+        report = {"started_at": self.started_at.isoformat(timespec="seconds"),
+                  "wall_seconds": time.perf_counter() - self.started,
+                  "cpu_seconds": time.process_time(),
+                  "peak_rss_mb": max(self.peak_rss_bytes, self.read_peak_rss()) / 2 ** 20,
+                  "python_version": platform.python_version(),
+                  "cpus": os.cpu_count(),
+                  "stages": self.records,
+                  "frames": self.frames}
+        report.update(extra)
+        return report
+
+    def write(self, destination_location, **extra):
+        """
+        saves the report of the run as json
+        :param destination_location:
+        :param extra: values added to the record
+        :return:
+        """
+        with open(destination_location, "w") as f:
+            json.dump(self.report(**extra), f, indent=2, default=str)
+        logger.info("Metrics saved: {0}".format(destination_location))
+
+
+# shared by the parser and the models the same way the crabdata logger is
+metrics = CrabMetrics()
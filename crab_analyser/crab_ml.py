@@ -1,27 +1,127 @@
 import logging
+import os
+import time
+import uuid
 
 import category_encoders as ce
 import numpy as np
 import pandas as pd
 from scipy import stats
 from sklearn import linear_model
+from sklearn.base import clone
 from sklearn.compose import TransformedTargetRegressor, make_column_transformer
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
-from sklearn.metrics import mean_squared_error, mean_absolute_error
-from sklearn.preprocessing import OneHotEncoder, QuantileTransformer, RobustScaler
+from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.preprocessing import OneHotEncoder, PowerTransformer, QuantileTransformer, RobustScaler
+
+from crab_analyser.crab_columnar import columnar_location, write_columnar
+from crab_analyser.crab_dtypes import apply_dtype_policy, get_dtype_policy
+from crab_analyser.crab_forest_compiler import CompiledForest
+from crab_analyser.crab_incremental_ols import (add_rows, empty_statistics, fit_quantile_transformer, holdout_mask,
+                                                solve_statistics)
+from crab_analyser.crab_metrics import metrics
+from crab_analyser.crab_quantile_sketch import CrabSketchQuantileTransformer
 
 logger = logging.getLogger('crabdata')
 
+# column names of the prediction output asked for in the README
+OUTPUT_COLUMNS = {"sex": "Sex", "length": "Length", "diameter": "Diameter", "height": "Height", "weight": "Weight",
+                  "shucked_weight": "Shucked Weight", "viscera_weight": "Viscera Weight",
+                  "shell_weight": "Shell Weight", "age": "Age"}
+
+# number of trees added at a time when the forest is grown until its out of bag error converges
+FOREST_GROWTH_STEP = 100
+# the update mode holds out this share of the new rows to check the updated models for drift
+UPDATE_TEST_SIZE = 0.2
+# hyperparameters of the models, the ones saved by the tuning search (crab_tuning) replace them
+FOREST_PARAMS = {"max_depth": 20, "min_samples_leaf": 2, "min_samples_split": 4}
+OLS_PARAMS = {"target_transform": "quantile_normal"}
+# sketch_* are the quantile transforms fitted with a mergeable quantile sketch, see crab_quantile_sketch
+OLS_TARGET_TRANSFORMS = ["quantile_normal", "quantile_uniform", "sketch_normal", "sketch_uniform", "power", "none"]
+
+
+def make_target_transformer(name):
+    """
+    target transformer of the linear regression by name, see OLS_TARGET_TRANSFORMS
+    :param name:
+    :return:
+    """
+    if name == "quantile_normal":
+        return QuantileTransformer(output_distribution='normal')
+    if name == "quantile_uniform":
+        return QuantileTransformer(output_distribution='uniform')
+    if name == "sketch_normal":
+        return CrabSketchQuantileTransformer(output_distribution='normal')
+    if name == "sketch_uniform":
+        return CrabSketchQuantileTransformer(output_distribution='uniform')
+    if name == "power":
+        return PowerTransformer()
+    if name == "none":
+        return None
+    raise ValueError("Unknown target transform {0}, expected one of {1}".format(name, OLS_TARGET_TRANSFORMS))
+
+
+def reverse_one_hot(crab_df, column="sex"):
+    """
+    the categorical column the one hot encoder split into column_<value> columns, without a python call per row
+    rows where none of them is 1 get na like CrabAgePredictor.reverse_ohe
+    :param crab_df: frame with the one hot encoded columns
+    :param column:
+    :return: series with the category of every row
+    """
+    prefix = column + "_"
+    dummies = [c for c in crab_df.columns if c.startswith(prefix)]
+    encoded = crab_df[dummies].to_numpy() == 1
+    categories = np.array([c[len(prefix):] for c in dummies] + ["na"], dtype=object)
+    # argmax finds the first 1 of a row, rows without one point at na
+    first = np.where(encoded.any(axis=1), encoded.argmax(axis=1), len(dummies))
+    return pd.Series(categories[first], index=crab_df.index, name=column)
+
+
+def fitted_categories(artifact):
+    """
+    the values the one hot encoder of the forest was fitted with for every categorical feature, the encoder raises
+    on any other value, so callers can reject such rows before they are scored
+    :param artifact: returned by CrabAgePredictor.train
+    :return: feature column -> list of values
+    """
+    preprocess = artifact["forest_model"].regressor_.named_steps["preprocess"]
+    for _, encoder, columns in preprocess.transformers_:
+        if isinstance(encoder, OneHotEncoder):
+            features = np.asarray(preprocess.feature_names_in_)[np.asarray(columns)]
+            return {feature: values.tolist() for feature, values in zip(features, encoder.categories_)}
+    return {}
+
 
 class CrabAgePredictor:
-    def __init__(self, crab_data):
+    def __init__(self, crab_data, n_jobs=None, adaptive_forest=False, compare_fixed_forest=False,
+                 compile_forest=False, columnar_format=None, params=None, dtype_policy=None):
         """
         constructor
         :param crab_data:
+        :param n_jobs: number of cores the random forest is trained and scored on, -1 uses all of them
+        :param adaptive_forest: grow the forest until the out of bag error converges instead of fitting 5000 trees
+        :param compare_fixed_forest: with adaptive_forest, also fit the fixed 5000 tree forest and report the difference
+        :param compile_forest: compile the fitted forest into flat arrays and report its memory and throughput
+        :param columnar_format: feather or parquet, the predictions are then also saved in that format
+        :param params: optional {"forest": {...}, "ols": {...}} hyperparameters that replace FOREST_PARAMS and OLS_PARAMS
+        :param dtype_policy: compact or wide, see crab_dtypes, the encoders output the float dtype of the policy too
         """
-        self.crab_data = crab_data
+        self.dtype_policy = dtype_policy
+        self.dtypes = get_dtype_policy(dtype_policy)
+        self.crab_data = apply_dtype_policy(crab_data, dtype_policy) if dtype_policy else crab_data
+        self.n_jobs = n_jobs
+        self.adaptive_forest = adaptive_forest
+        self.compare_fixed_forest = compare_fixed_forest
+        self.compile_forest = compile_forest
+        self.columnar_format = columnar_format
+        self.forest_params = dict(FOREST_PARAMS, **(params or {}).get("forest", {}))
+        self.ols_params = dict(OLS_PARAMS, **(params or {}).get("ols", {}))
+        self.ols_report = {}
+        self.forest_report = {}
+        self.compiled_report = {}
         self.columns = ["length", "diameter", "height", "weight", "shucked_weight", "viscera_weight", "shell_weight",
                         "age", "sex"]
         self.continuous_var_columns = ["length", "diameter", "height", "weight", "shucked_weight", "viscera_weight",
@@ -49,11 +149,42 @@ class CrabAgePredictor:
         :return:
         """
         logger.debug("Preprocessing called")
-        self.crab_data.fillna(self.crab_data.mean(), inplace=True)
+        self.crab_data.fillna(self.crab_data.mean(numeric_only=True), inplace=True)
         raw_df_cont = self.crab_data[self.continuous_var_columns]
         x = raw_df_cont[~(np.abs(stats.zscore(raw_df_cont)) < 3).all(axis=1)]
         return self.crab_data.drop(x.index).copy().reset_index(drop=True)
 
+    def fit_ols(self):
+        """
+        fits the linear regression on the preprocessed data after standardising the target to normal dist
+        returns the fitted encoder and model together with the encoded design matrix, y and the test split
+        :return:
+        """
+        with metrics.stage("ml.ols.preprocess", rows=len(self.crab_data)):
+            crab_df_woo = self.pre_process_data()
+        ohe, t_reg = self.ols_pipeline()
+        with metrics.stage("ml.ols.encode", rows=len(crab_df_woo)):
+            crab_df_woo_enc = ohe.fit_transform(crab_df_woo)
+        X = crab_df_woo_enc.drop("age", axis=1).astype(self.dtypes["encoded"])
+        y = crab_df_woo_enc[["age"]]
+        metrics.frame("ml.ols.encode", X)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=100)
+        with metrics.stage("ml.ols.fit", rows=len(X_train)):
+            t_reg.fit(X_train, y_train)
+        return ohe, t_reg, X, y, X_test, y_test
+
+    def ols_pipeline(self):
+        """
+        returns the unfitted one hot encoder and linear regression of fit_ols
+        :return:
+        """
+        # since I observed that the data was skewed, I decided to transform the continuous variables to normal dist
+        transformer = make_target_transformer(self.ols_params["target_transform"])
+        reg = linear_model.LinearRegression()
+        t_reg = TransformedTargetRegressor(regressor=reg, transformer=transformer)
+        ohe = ce.OneHotEncoder(handle_unknown='ignore', use_cat_names=True, drop_invariant=True)
+        return ohe, t_reg
+
     def ols_prediction(self):
         """
         uses linear regression after standardising to normal dist
@@ -62,77 +193,340 @@ class CrabAgePredictor:
         :return:
         """
         logger.info("running Linear Regression model")
-        crab_df_woo = self.pre_process_data()
-        transformer = QuantileTransformer(output_distribution='normal')
-        # since I observed that the data was skewed, I decided to transform the continuous variables to normal dist
-        reg = linear_model.LinearRegression()
-        t_reg = TransformedTargetRegressor(regressor=reg, transformer=transformer)
-        ohe = ce.OneHotEncoder(handle_unknown='ignore', use_cat_names=True, drop_invariant=True)
-        crab_df_woo_enc = ohe.fit_transform(crab_df_woo)
-        X = crab_df_woo_enc.drop("age", axis=1)
-        y = crab_df_woo_enc[["age"]]
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=100)
-        t_reg.fit(X_train, y_train)
-        s = t_reg.score(X_test, y_test)
-        logger.info("R-squared from Linear Regression is: {0}".format(s))
-        y_pred = t_reg.predict(X)
-        mse = np.sqrt(mean_squared_error(y, y_pred))
-        mae = mean_absolute_error(y, y_pred)
-        logger.debug("Linear Regression MAE: {0}".format(mae))
-        logger.debug("Linear Regression RMSE: {0}".format(mse))
-        logger.debug("Linear Regression R-squared: {0}".format(s))
-
-        crab_df = X.copy()
-        crab_df["age"] = pd.Series(y.values.ravel())
-        crab_df["age_ols"] = pd.Series(y_pred.ravel())
-        crab_df['sex'] = crab_df.apply(lambda row: self.reverse_ohe(row), axis=1)
-        crab_df.drop(["sex_I", "sex_M", "sex_F"], axis=1, inplace=True)
-        crab_df["percentage_difference"] = np.abs(
-            np.divide((crab_df["age"] - crab_df["age_ols"]), crab_df["age"]) * 100)
-        crab_df.to_csv("crab_predit_ols.csv", index=False)
-        logger.info("Crab data with predicted variables saved: {0}".format("crab_predit_ols.csv"))
+        with metrics.stage("ml.ols", rows=len(self.crab_data)):
+            ohe, t_reg, X, y, X_test, y_test = self.fit_ols()
+            s = t_reg.score(X_test, y_test)
+            logger.info("R-squared from Linear Regression is: {0}".format(s))
+            with metrics.stage("ml.ols.predict", rows=len(X)):
+                y_pred = t_reg.predict(X)
+            mse = np.sqrt(mean_squared_error(y, y_pred))
+            mae = mean_absolute_error(y, y_pred)
+            logger.debug("Linear Regression MAE: {0}".format(mae))
+            logger.debug("Linear Regression RMSE: {0}".format(mse))
+            logger.debug("Linear Regression R-squared: {0}".format(s))
+            self.ols_report = {"test_r2": s, "mae": mae, "rmse": mse, "rows": len(X)}
+
+            with metrics.stage("ml.ols.write_csv", rows=len(X)):
+                crab_df = X.copy()
+                crab_df["age"] = pd.Series(y.values.ravel())
+                crab_df["age_ols"] = pd.Series(y_pred.ravel())
+                crab_df['sex'] = reverse_one_hot(crab_df)
+                crab_df.drop(["sex_I", "sex_M", "sex_F"], axis=1, inplace=True)
+                crab_df["percentage_difference"] = np.abs(
+                    np.divide((crab_df["age"] - crab_df["age_ols"]), crab_df["age"]) * 100)
+                crab_df.to_csv("crab_predit_ols.csv", index=False)
+            if self.columnar_format:
+                with metrics.stage("ml.ols.write_columnar", rows=len(crab_df)):
+                    write_columnar(crab_df, columnar_location("crab_predit_ols.csv", self.columnar_format),
+                                   self.columnar_format)
+            logger.info("Crab data with predicted variables saved: {0}".format("crab_predit_ols.csv"))
         logger.info("Linear Regression execution finished")
 
-    def rf_prediction(self):
+    def fit_forest(self):
         """
-        uses ensemble (Random Forest) method to predict crab age
+        fits the random forest pipeline, scaling and one hot encoding are part of the pipeline
+        returns the fitted model together with the design matrix, y and the test split
         :return:
         """
-        logger.info("running Random Forest model")
         X = self.crab_data.drop("age", axis=1)
         y = self.crab_data[["age"]]
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=100)
-        #
-        numerical_features = X_train.dtypes == 'float'
+        f_reg_ttr = self.forest_pipeline(X_train)
+        if self.adaptive_forest:
+            # the first trees are fitted through the pipeline as usual, grow_forest adds the rest
+            f_reg_ttr.regressor.named_steps['model'].set_params(n_estimators=FOREST_GROWTH_STEP, warm_start=True,
+                                                                oob_score=True)
+        self.forest_report = {}
+        start = time.perf_counter()
+        with metrics.stage("ml.forest.fit", rows=len(X_train)):
+            f_reg_ttr.fit(X_train, y_train)
+            if self.adaptive_forest:
+                self.grow_forest(f_reg_ttr, X_train, y_train)
+        # the pipeline does not keep its design matrix, a few rows of it give the bytes per row
+        metrics.frame("ml.forest.preprocess",
+                      f_reg_ttr.regressor_.named_steps['preprocess'].transform(X_train.iloc[:100]), len(X_train))
+        self.forest_report.update({"trees": f_reg_ttr.regressor_.named_steps['model'].n_estimators,
+                                   "training_seconds": time.perf_counter() - start,
+                                   "adaptive": self.adaptive_forest,
+                                   "n_jobs": self.n_jobs})
+        logger.info("Random Forest with {0} trees trained in {1:.2f}s".format(self.forest_report["trees"],
+                                                                             self.forest_report["training_seconds"]))
+        return f_reg_ttr, X, y, X_test, y_test
+
+    def forest_pipeline(self, X_train, memory=None):
+        """
+        returns the unfitted random forest pipeline of fit_forest, scaling and one hot encoding are part of it
+        :param X_train: only its dtypes are used to pick the numerical columns
+        :param memory: optional cache of the fitted preprocessing, see sklearn.pipeline.Pipeline
+        :return:
+        """
+        numerical_features = X_train.dtypes.map(pd.api.types.is_float_dtype)
         categorical_features = ~numerical_features
         # I used pipelining so that the predicted values were automatically transformed/scaled back
         preprocess = make_column_transformer(
             (RobustScaler(), numerical_features),
-            (OneHotEncoder(sparse=False), categorical_features)
+            (OneHotEncoder(sparse=False, dtype=self.dtypes["encoded"]), categorical_features)
         )
-        forest = RandomForestRegressor(n_estimators=5000, max_depth=20, min_samples_leaf=2, min_samples_split=4,
-                                       random_state=100)
-        f_reg = Pipeline(steps=[('preprocess', preprocess), ('model', forest)])
-        f_reg_ttr = TransformedTargetRegressor(regressor=f_reg)
-        f_reg_ttr.fit(X_train, y_train)
-        s = f_reg_ttr.score(X_test, y_test)
-        logger.info("R-squared from Random Forest is: {0}".format(s))
-        y_pred = f_reg_ttr.predict(X)
-        mse = np.sqrt(mean_squared_error(y, y_pred))
-        mae = mean_absolute_error(y, y_pred)
-        logger.debug("RandomForest MAE: {0}".format(mae))
-        logger.debug("RandomForest RMSE: {0}".format(mse))
-        logger.debug("RandomForest R-squared: {0}".format(s))
-        # recreate the original dataset
-        crab_df = X.copy()
-        crab_df["age"] = pd.Series(y.values.ravel())
-        crab_df["age_forest"] = pd.Series(y_pred.ravel())
-        crab_df["percentage_difference"] = np.abs(
-            np.divide((crab_df["age"] - crab_df["age_forest"]), crab_df["age"]) * 100)
-        crab_df.to_csv("crab_predit_forest.csv", index=False)
-        logger.info("Crab data with predicted variables saved: {0}".format("crab_predit_forest.csv"))
+        forest = RandomForestRegressor(n_estimators=5000, random_state=100, n_jobs=self.n_jobs, **self.forest_params)
+        f_reg = Pipeline(steps=[('preprocess', preprocess), ('model', forest)], memory=memory)
+        return TransformedTargetRegressor(regressor=f_reg)
+
+    def grow_forest(self, f_reg_ttr, X_train, y_train, max_trees=5000, tolerance=0.001, patience=3):
+        """
+        adds FOREST_GROWTH_STEP trees at a time to the fitted forest until the out of bag mse changes by less than
+        tolerance (relative) for patience steps in a row, or max_trees is reached
+        the preprocessing of the pipeline is already fitted, so only the new trees are trained on each step
+        :param f_reg_ttr: fitted forest pipeline whose forest has warm_start and oob_score switched on
+        :param X_train:
+        :param y_train:
+        :param max_trees:
+        :param tolerance:
+        :param patience:
+        :return:
+        """
+        forest = f_reg_ttr.regressor_.named_steps['model']
+        X_train_t = f_reg_ttr.regressor_.named_steps['preprocess'].transform(X_train)
+        y = np.ravel(y_train)
+        previous_error = mean_squared_error(y, forest.oob_prediction_)
+        stable_steps = 0
+        while forest.n_estimators < max_trees and stable_steps < patience:
+            forest.set_params(n_estimators=min(forest.n_estimators + FOREST_GROWTH_STEP, max_trees))
+            forest.fit(X_train_t, y)
+            error = mean_squared_error(y, forest.oob_prediction_)
+            logger.debug("Random Forest with {0} trees, out of bag mse: {1}".format(forest.n_estimators, error))
+            stable_steps = stable_steps + 1 if abs(previous_error - error) <= tolerance * previous_error else 0
+            previous_error = error
+        self.forest_report["oob_mse"] = previous_error
+        return forest.n_estimators
+
+    def compare_forest_sizes(self, adaptive_score):
+        """
+        fits the fixed 5000 tree forest on the same split and logs trees, training time and accuracy next to the
+        adaptive forest that was just fitted
+        :param adaptive_score: test r-squared of the adaptive forest
+        :return:
+        """
+        adaptive_report = dict(self.forest_report, test_r2=adaptive_score)
+        self.adaptive_forest = False
+        try:
+            fixed_ttr, _, _, X_test, y_test = self.fit_forest()
+        finally:
+            self.adaptive_forest = True
+        fixed_report = dict(self.forest_report, test_r2=fixed_ttr.score(X_test, y_test))
+        self.forest_report = dict(adaptive_report, fixed=fixed_report,
+                                  r2_difference=adaptive_report["test_r2"] - fixed_report["test_r2"])
+        logger.info("Adaptive forest: {0} trees, {1:.2f}s, R-squared {2:.4f}; fixed forest: {3} trees, {4:.2f}s, "
+                    "R-squared {5:.4f}; difference {6:+.4f}".format(
+                        adaptive_report["trees"], adaptive_report["training_seconds"], adaptive_report["test_r2"],
+                        fixed_report["trees"], fixed_report["training_seconds"], fixed_report["test_r2"],
+                        self.forest_report["r2_difference"]))
+
+    def rf_prediction(self):
+        """
+        uses ensemble (Random Forest) method to predict crab age
+        :return:
+        """
+        logger.info("running Random Forest model")
+        with metrics.stage("ml.forest", rows=len(self.crab_data)):
+            f_reg_ttr, X, y, X_test, y_test = self.fit_forest()
+            with metrics.stage("ml.forest.score", rows=len(X_test)):
+                s = f_reg_ttr.score(X_test, y_test)
+            logger.info("R-squared from Random Forest is: {0}".format(s))
+            if self.adaptive_forest and self.compare_fixed_forest:
+                self.compare_forest_sizes(s)
+            if self.compile_forest:
+                with metrics.stage("ml.forest.compile", rows=len(X_test)):
+                    self.compiled_report = CompiledForest.compile(f_reg_ttr).compare(f_reg_ttr, X_test)
+            with metrics.stage("ml.forest.predict", rows=len(X)):
+                y_pred = f_reg_ttr.predict(X)
+            mse = np.sqrt(mean_squared_error(y, y_pred))
+            mae = mean_absolute_error(y, y_pred)
+            logger.debug("RandomForest MAE: {0}".format(mae))
+            logger.debug("RandomForest RMSE: {0}".format(mse))
+            logger.debug("RandomForest R-squared: {0}".format(s))
+            self.forest_report.update({"test_r2": s, "mae": mae, "rmse": mse, "rows": len(X)})
+            # recreate the original dataset
+            with metrics.stage("ml.forest.write_csv", rows=len(X)):
+                crab_df = X.copy()
+                crab_df["age"] = pd.Series(y.values.ravel())
+                crab_df["age_forest"] = pd.Series(y_pred.ravel())
+                crab_df["percentage_difference"] = np.abs(
+                    np.divide((crab_df["age"] - crab_df["age_forest"]), crab_df["age"]) * 100)
+                crab_df.to_csv("crab_predit_forest.csv", index=False)
+            if self.columnar_format:
+                with metrics.stage("ml.forest.write_columnar", rows=len(crab_df)):
+                    write_columnar(crab_df, columnar_location("crab_predit_forest.csv", self.columnar_format),
+                                   self.columnar_format)
+            logger.info("Crab data with predicted variables saved: {0}".format("crab_predit_forest.csv"))
         logger.info("Random Forest execution finished")
 
+    def train(self):
+        """
+        fits both models and returns them as one artifact together with the fitted preprocessing
+        the artifact holds everything CrabAgeScorer needs to score new rows without refitting
+        :return:
+        """
+        logger.info("training models")
+        # the values pre_process_data imputes with, new rows are imputed with the same ones
+        fill_values = self.crab_data.mean(numeric_only=True)
+        history_rows = len(self.crab_data)
+        ohe, t_reg, X_ols, y_ols, X_test, y_test = self.fit_ols()
+        ols_score = t_reg.score(X_test, y_test)
+        logger.info("R-squared from Linear Regression is: {0}".format(ols_score))
+        # sufficient statistics of the training rows of the linear regression, update adds new rows to them
+        X_train = X_ols.drop(index=X_test.index)
+        ols_statistics = add_rows(empty_statistics(X_ols.shape[1]), X_train.to_numpy(dtype=np.float64),
+                                  y_ols.drop(index=X_test.index).to_numpy(dtype=np.float64).ravel())
+        # fit_ols imputed crab_data in place, these are the mean and std pre_process_data filtered with
+        continuous = self.crab_data[self.continuous_var_columns]
+        outlier_filter = {"mean": continuous.mean().to_dict(), "scale": continuous.std(ddof=0).to_dict()}
+        f_reg_ttr, X, _, X_test, y_test = self.fit_forest()
+        forest_score = f_reg_ttr.score(X_test, y_test)
+        logger.info("R-squared from Random Forest is: {0}".format(forest_score))
+        compiled_forest = CompiledForest.compile(f_reg_ttr) if self.compile_forest else None
+        return {"fill_values": fill_values.to_dict(),
+                "feature_columns": list(X.columns),
+                "ols_encoder": ohe,
+                "ols_model": t_reg,
+                "forest_model": f_reg_ttr,
+                "compiled_forest": compiled_forest,
+                "metrics": {"ols_r2": ols_score, "forest_r2": forest_score,
+                            "forest_trees": self.forest_report["trees"]},
+                "params": {"forest": self.forest_params, "ols": self.ols_params},
+                "training_rows": len(X),
+                "history_rows": history_rows,
+                "ols_columns": list(X_ols.columns),
+                "ols_statistics": ols_statistics,
+                "outlier_filter": outlier_filter,
+                "forest_rows": len(X) - len(X_test),
+                "dtype_policy": self.dtype_policy,
+                # changes with every fit, CrabPredictionCache drops its predictions when it does
+                "revision": uuid.uuid4().hex,
+                "updates": []}
+
+    def update(self, artifact, history_location=None, drift_tolerance=0.05, min_drift_rows=30, history_data=None):
+        """
+        refreshes the models of an artifact returned by train with the rows of crab_data, which only holds the new
+        rows, the artifact is updated in place and returned
+        the new rows are imputed and filtered with the values of the last full fit and a share of them is held out,
+        the rest is added to the sufficient statistics of the linear regression, which is solved again, and trains
+        new trees that replace the oldest ones of the forest, so the time depends on the new rows only
+        the held out rows check the updated models, when the r-squared of a model drops more than drift_tolerance
+        below the one of the last full fit, both are fitted again from scratch on the history
+        :param artifact:
+        :param history_location: csv file all the rows are appended to, needed for the full refit
+        :param drift_tolerance:
+        :param min_drift_rows: fewer held out rows than this are too noisy to check
+        :param history_data: rows appended to the history, crab_data when None; the full precision rows when crab_data
+        follows the compact dtype policy, so that a refit does not start from float32 values
+        :return:
+        """
+        if "ols_statistics" not in artifact:
+            raise ValueError("The artifact has no training statistics, train it again before updating it")
+        logger.info("updating models with {0} new rows".format(len(self.crab_data)))
+        start = time.perf_counter()
+        if history_location:
+            with metrics.stage("ml.update.history", rows=len(self.crab_data)):
+                (self.crab_data if history_data is None else history_data).to_csv(
+                    history_location, index=False, mode="a", header=not os.path.exists(history_location))
+
+        crab_data = self.crab_data.fillna(artifact["fill_values"])
+        continuous = crab_data[self.continuous_var_columns]
+        z = (continuous - pd.Series(artifact["outlier_filter"]["mean"])) / pd.Series(
+            artifact["outlier_filter"]["scale"])
+        crab_data = crab_data[(np.abs(z) < 3).all(axis=1)].reset_index(drop=True)
+        test = holdout_mask(artifact["history_rows"], artifact["history_rows"] + len(crab_data), UPDATE_TEST_SIZE,
+                            100)
+        train_rows, test_rows = crab_data[~test], crab_data[test]
+        artifact["history_rows"] += len(self.crab_data)
+        artifact["training_rows"] += len(crab_data)
+        with metrics.stage("ml.update.ols", rows=len(train_rows)):
+            self.update_ols(artifact, train_rows)
+        with metrics.stage("ml.update.forest", rows=len(train_rows)) as stage:
+            stage["trees"] = self.update_forest(artifact, train_rows)
+        artifact["revision"] = uuid.uuid4().hex
+
+        report = {"new_rows": len(self.crab_data), "outliers": len(self.crab_data) - len(crab_data),
+                  "test_rows": len(test_rows), "trees_replaced": stage["trees"], "refit": False}
+        if len(test_rows) >= min_drift_rows:
+            scorer = CrabAgeScorer(artifact)
+            for model in ["ols", "forest"]:
+                report[model + "_r2"] = r2_score(test_rows["age"], scorer.predict(test_rows, model))
+            degraded = [m for m in ["ols", "forest"]
+                        if artifact["metrics"][m + "_r2"] - report[m + "_r2"] > drift_tolerance]
+            if degraded and history_location:
+                logger.warning("R-squared of {0} dropped by more than {1} on the new rows, fitting again on all {2} "
+                               "rows".format(", ".join(degraded), drift_tolerance, artifact["history_rows"]))
+                history = pd.read_csv(history_location).drop(columns=["source_file"], errors="ignore")
+                updates = artifact["updates"]
+                artifact = CrabAgePredictor(history, self.n_jobs, self.adaptive_forest, False, self.compile_forest,
+                                            params=artifact["params"],
+                                            dtype_policy=artifact.get("dtype_policy")).train()
+                artifact["updates"] = updates
+                report["refit"] = True
+            elif degraded:
+                logger.warning("R-squared of {0} dropped by more than {1} on the new rows, no history to fit "
+                               "again on".format(", ".join(degraded), drift_tolerance))
+        report["seconds"] = time.perf_counter() - start
+        artifact["updates"].append(report)
+        logger.info("Models updated with {0} rows in {1:.2f}s, {2} trees replaced{3}".format(
+            report["new_rows"], report["seconds"], report["trees_replaced"],
+            ", fitted again on the history" if report["refit"] else ""))
+        return artifact
+
+    def update_ols(self, artifact, crab_data):
+        """
+        adds the rows to the sufficient statistics of the linear regression and solves it again
+        the target transformer is refitted from the age counts, see crab_incremental_ols, or the new ages are added
+        to its quantile sketch
+        :param artifact:
+        :param crab_data: imputed and filtered new training rows
+        :return:
+        """
+        if not len(crab_data):
+            return
+        X = artifact["ols_encoder"].transform(crab_data)[artifact["ols_columns"]]
+        statistics = add_rows(artifact["ols_statistics"], X.to_numpy(dtype=np.float64),
+                              crab_data["age"].to_numpy(dtype=np.float64))
+        values = np.array(sorted(statistics["age_rows"]))
+        counts = np.array([statistics["age_rows"][v] for v in values])
+        t_reg = artifact["ols_model"]
+        target_transform = artifact["params"]["ols"]["target_transform"]
+        if target_transform.startswith("quantile_"):
+            t_reg.transformer_ = fit_quantile_transformer(values, counts, target_transform.split("_")[1])
+        elif target_transform.startswith("sketch_"):
+            t_reg.transformer_.partial_fit(crab_data[["age"]].to_numpy(dtype=np.float64))
+        elif target_transform == "power":
+            # the lambda of the power transform has no sufficient statistics, it is fitted on the age column that
+            # repeats every age value as many times as it was seen
+            t_reg.transformer_ = PowerTransformer().fit(np.repeat(values, counts).reshape(-1, 1))
+        t_reg.regressor_.coef_, t_reg.regressor_.intercept_ = solve_statistics(
+            statistics, lambda v: t_reg.transformer_.transform(v.reshape(-1, 1)).ravel())
+
+    def update_forest(self, artifact, crab_data):
+        """
+        trains trees on the rows and swaps them for the oldest trees of the forest, the forest keeps its size
+        the new trees get the share of the forest the new rows have among all the rows it was trained on
+        :param artifact:
+        :param crab_data: imputed and filtered new training rows
+        :return: number of trees replaced
+        """
+        if not len(crab_data):
+            return 0
+        pipeline = artifact["forest_model"].regressor_
+        forest = pipeline.named_steps["model"]
+        X = pipeline.named_steps["preprocess"].transform(crab_data.drop("age", axis=1))
+        trees = len(forest.estimators_)
+        artifact["forest_rows"] += len(crab_data)
+        replaced = min(trees, max(1, round(trees * len(crab_data) / artifact["forest_rows"])))
+        new_forest = clone(forest).set_params(n_estimators=replaced, warm_start=False, oob_score=False,
+                                              random_state=artifact["history_rows"])
+        new_forest.fit(X, crab_data["age"].to_numpy())
+        forest.estimators_ = forest.estimators_[replaced:] + new_forest.estimators_
+        if artifact.get("compiled_forest") is not None:
+            artifact["compiled_forest"] = CompiledForest.compile(artifact["forest_model"])
+        return replaced
+
     def run(self):
         """
         main function for the class
@@ -142,3 +536,58 @@ class CrabAgePredictor:
         self.ols_prediction()
         self.rf_prediction()
         logger.info("machine learning process finished")
+
+
+class CrabAgeScorer:
+    def __init__(self, artifact):
+        """
+        scores new crab rows with the models of an artifact returned by CrabAgePredictor.train
+        nothing is fitted here, so scoring costs one transform and one predict per model
+        :param artifact:
+        """
+        self.artifact = artifact
+        self.feature_columns = artifact["feature_columns"]
+        self.fill_values = artifact["fill_values"]
+
+    def prepare(self, crab_data):
+        """
+        selects the feature columns in training order, imputes missing values with the training means and converts
+        them to the dtype policy the models were trained with
+        :param crab_data:
+        :return:
+        """
+        return apply_dtype_policy(crab_data[self.feature_columns].fillna(self.fill_values),
+                                  self.artifact.get("dtype_policy"))
+
+    def predict(self, crab_data, model="forest"):
+        """
+        returns the predicted age of every row
+        :param crab_data: data frame with the columns of the parser output, age is optional
+        :param model: forest, compiled or ols
+        :return:
+        """
+        X = self.prepare(crab_data)
+        if model == "forest":
+            return self.artifact["forest_model"].predict(X).ravel()
+        if model == "compiled":
+            # artifacts trained without compile_forest are compiled on the fly
+            if self.artifact.get("compiled_forest") is None:
+                self.artifact["compiled_forest"] = CompiledForest.compile(self.artifact["forest_model"])
+            return self.artifact["compiled_forest"].predict(X)
+        if model == "ols":
+            # the encoder was fitted on the frame with the age column, it is only there to be dropped again
+            X_enc = self.artifact["ols_encoder"].transform(X.assign(age=0)).drop("age", axis=1)
+            return self.artifact["ols_model"].predict(X_enc).ravel()
+        raise ValueError("Unknown model {0}, expected forest, compiled or ols".format(model))
+
+    def output_frame(self, crab_data, predicted_age):
+        """
+        the rows with their predicted age in the output format of the README, CrabScoringWriter and CrabPipeline
+        write it
+        :param crab_data:
+        :param predicted_age:
+        :return:
+        """
+        crab_df = crab_data[[c for c in OUTPUT_COLUMNS if c in crab_data.columns]].rename(columns=OUTPUT_COLUMNS)
+        crab_df["Predicted Age"] = np.rint(predicted_age).astype(int)
+        return crab_df
@@ -0,0 +1,93 @@
+import datetime
+import json
+import logging
+import os
+import platform
+import re
+
+import joblib
+import sklearn
+
+logger = logging.getLogger('crabdata')
+
+ARTIFACT_PATTERN = re.compile(r'^crab_age_model_v(\d+)\.joblib$')
+
+
+class CrabModelStore:
+    def __init__(self, model_directory):
+        """
+        keeps versioned model artifacts on disk
+        every save writes a new crab_age_model_v<N>.joblib next to a json file with its metadata, older versions
+        are never overwritten so a prediction can always be traced back to the artifact that made it
+        :param model_directory:
+        """
+        self.model_directory = model_directory
+
+    def versions(self):
+        """
+        returns the saved versions in ascending order
+        :return:
+        """
+        if not os.path.isdir(self.model_directory):
+            return []
+        return sorted(int(m.group(1)) for m in map(ARTIFACT_PATTERN.match, os.listdir(self.model_directory)) if m)
+
+    def location(self, version, extension="joblib"):
+        """
+        file that holds the artifact or the metadata of a version
+        :param version:
+        :param extension: joblib for the artifact, json for the metadata
+        :return:
+        """
+        return os.path.join(self.model_directory, "crab_age_model_v{0:04d}.{1}".format(version, extension))
+
+    def history_location(self):
+        """
+        csv file with every row the models of the directory were trained or updated on, used by the update mode
+        :return:
+        """
+        return os.path.join(self.model_directory, "crab_history.csv")
+
+    def save(self, artifact, metadata=None):
+        """
+        saves the artifact as the next version and returns that version
+        :param artifact: dict returned by CrabAgePredictor.train
+        :param metadata: extra json serialisable values to keep next to the artifact
+        :return:
+        """
+        os.makedirs(self.model_directory, exist_ok=True)
+        versions = self.versions()
+        version = versions[-1] + 1 if versions else 1
+        joblib.dump(artifact, self.location(version))
+        info = {"version": version,
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python_version": platform.python_version(),
+                "sklearn_version": sklearn.__version__,
+                "feature_columns": artifact["feature_columns"],
+                "training_rows": artifact["training_rows"],
+                "metrics": artifact["metrics"]}
+        info.update(metadata or {})
+        with open(self.location(version, "json"), "w") as f:
+            json.dump(info, f, indent=2)
+        logger.info("Model artifact saved: {0}".format(self.location(version)))
+        return version
+
+    def load(self, version=None):
+        """
+        loads an artifact and its metadata, the latest version when none is given
+        :param version:
+        :return:
+        """
+        if version is None:
+            versions = self.versions()
+            if not versions:
+                raise FileNotFoundError("No model artifacts found in {0}".format(self.model_directory))
+            version = versions[-1]
+        with open(self.location(version, "json")) as f:
+            metadata = json.load(f)
+        if metadata["sklearn_version"] != sklearn.__version__:
+            logger.warning("Model artifact v{0} was trained with scikit-learn {1}, running {2}".format(
+                version, metadata["sklearn_version"], sklearn.__version__))
+        artifact = joblib.load(self.location(version))
+        logger.info("Model artifact loaded: {0}".format(self.location(version)))
+        return artifact, metadata
@@ -0,0 +1,171 @@
+import functools
+import html
+import itertools
+import logging
+import os
+import re
+import tempfile
+
+from tika import parser
+
+# tika returns one div per page when xml content is requested, this lets us split the document page by page
+PAGE_PATTERN = re.compile(r'<div class="page">(.*?)</div>', re.DOTALL)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+# pages sent to the tika server per request when a document is streamed
+TIKA_STREAM_PAGES = 20
+
+logger = logging.getLogger('crabdata')
+
+
+class CrabPDFBackend:
+    """
+    turns a pdf file into the stream of text lines the crab parsers work on
+    subclasses implement read_pages, read_lines is the whole document as one list
+    """
+    name = None
+
+    def read_pages(self, source_location):
+        """
+        generator that returns the text lines of the pdf one page at a time
+        :param source_location:
+        :return:
+        """
+        raise NotImplementedError
+
+    def read_lines(self, source_location):
+        """
+        returns all the text lines of the pdf
+        :param source_location:
+        :return:
+        """
+        return [line for lines in self.read_pages(source_location) for line in lines]
+
+    def read_page_range(self, source_location, start, stop):
+        """
+        generator that returns the text lines of the pages start to stop (excluded), used to parse shards of one pdf
+        backends that can jump to a page override it, this one reads the pages before start too
+        :param source_location:
+        :param start:
+        :param stop:
+        :return:
+        """
+        return itertools.islice(self.read_pages(source_location), start, stop)
+
+    def stream_pages(self, source_location):
+        """
+        generator like read_pages that only ever holds a few pages of the document, used by the streaming parser and
+        the pipeline; backends whose read_pages is already lazy keep this one
+        :param source_location:
+        :return:
+        """
+        return self.read_pages(source_location)
+
+
+class TikaBackend(CrabPDFBackend):
+    """
+    sends the pdf to a tika server, which is started on a JVM the first time it is needed
+    """
+    name = "tika"
+
+    def read_pages(self, source_location):
+        raw = parser.from_file(source_location, xmlContent=True)
+        for page in PAGE_PATTERN.finditer(raw['content']):
+            text = html.unescape(TAG_PATTERN.sub('\n', page.group(1)))
+            yield [line for line in text.split('\n') if line.strip()]
+
+    def read_lines(self, source_location):
+        raw = parser.from_file(source_location)
+        return (raw['content'].strip().split('\n'))
+
+    def read_page_range(self, source_location, start, stop):
+        # tika always parses whole files, so the pages are copied to a pdf of their own first
+        from pypdf import PdfWriter
+
+        status = os.stat(source_location)
+        writer = PdfWriter()
+        for page in open_pdf(source_location, status.st_mtime_ns, status.st_size).pages[start:stop]:
+            writer.add_page(page)
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+            writer.write(f)
+            f.flush()
+            yield from self.read_pages(f.name)
+
+    def stream_pages(self, source_location):
+        # read_pages has the whole document parsed by tika before the first page comes out, so longer documents are
+        # sent TIKA_STREAM_PAGES pages at a time; splitting the pdf needs pypdf
+        try:
+            pages = count_pages(source_location)
+        except ImportError:
+            logger.warning("Streaming with the tika backend needs pypdf to split {0} into page ranges, the whole "
+                           "document is parsed at once".format(source_location))
+            pages = 0
+        if pages <= TIKA_STREAM_PAGES:
+            yield from self.read_pages(source_location)
+            return
+        for start in range(0, pages, TIKA_STREAM_PAGES):
+            yield from self.read_page_range(source_location, start, min(start + TIKA_STREAM_PAGES, pages))
+
+
+class PyPDFBackend(CrabPDFBackend):
+    """
+    extracts the text in process with pypdf, so there is no JVM to start and pages are only read when asked for
+    """
+    name = "pypdf"
+
+    def read_pages(self, source_location):
+        # pypdf is optional, it is only needed when this backend is picked
+        from pypdf import PdfReader
+
+        for page in PdfReader(source_location).pages:
+            yield [line for line in page.extract_text().split('\n') if line.strip()]
+
+    def read_page_range(self, source_location, start, stop):
+        # the shards of a pdf are parsed one after the other on the same workers, so they share the opened file
+        status = os.stat(source_location)
+        for page in open_pdf(source_location, status.st_mtime_ns, status.st_size).pages[start:stop]:
+            yield [line for line in page.extract_text().split('\n') if line.strip()]
+
+    def read_lines(self, source_location):
+        from pypdf import PdfReader
+
+        text = '\n'.join(page.extract_text() for page in PdfReader(source_location).pages)
+        return text.strip().split('\n')
+
+
+@functools.lru_cache(maxsize=1)
+def open_pdf(source_location, modified, size):
+    """
+    opened pypdf reader of the pdf, the last one is kept so that reading more pages does not parse the file again
+    the modification time and size are only part of the cache key, a changed file is opened again
+    :param source_location:
+    :param modified:
+    :param size:
+    :return:
+    """
+    from pypdf import PdfReader
+
+    return PdfReader(source_location)
+
+
+def count_pages(source_location):
+    """
+    number of pages of the pdf, pypdf only reads the page tree for it and not the text
+    :param source_location:
+    :return:
+    """
+    status = os.stat(source_location)
+    return len(open_pdf(source_location, status.st_mtime_ns, status.st_size).pages)
+
+
+BACKENDS = {TikaBackend.name: TikaBackend, PyPDFBackend.name: PyPDFBackend}
+
+
+def get_backend(name):
+    """
+    returns a backend instance for the given name
+    :param name: one of the keys of BACKENDS
+    :return:
+    """
+    if name not in BACKENDS:
+        raise ValueError("Unknown pdf backend {0}, expected one of {1}".format(name, sorted(BACKENDS)))
+    return BACKENDS[name]()
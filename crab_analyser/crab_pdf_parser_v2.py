@@ -1,9 +1,19 @@
 # Author: Sheikh Usman Shakeel
+import io
+import itertools
 import logging
+import math
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
-from tika import parser
+
+from crab_analyser.crab_columnar import columnar_location, write_columnar
+from crab_analyser.crab_dtypes import apply_dtype_policy
+from crab_analyser.crab_metrics import metrics
+from crab_analyser.crab_pdf_backends import TikaBackend, count_pages
 
 '''
 Assumptions:
@@ -16,10 +26,146 @@ Assumptions:
 
 logger = logging.getLogger('crabdata')
 
+# part of the extraction cache key, bump it whenever a change to the parser changes its output
+PARSER_VERSION = "2.1"
+
+# pages with feature rows take longer to parse than pages of ages, so the pages are split into more ranges than
+# there are workers and a worker that is done early takes the next range
+RANGES_PER_WORKER = 4
+
+FEATURE_COLUMNS = ["sex", "length", "diameter", "height", "weight", "shucked_weight", "viscera_weight",
+                   "shell_weight"]
+
+
+class CrabLineTokenizer:
+    def __init__(self):
+        """
+        single pass state machine over the text lines of a survey document
+        every line is classified once as a column header, a page/sheet marker, a feature row, a dirty row, the age
+        header or an age value, and the feature rows and age values are collected in the same traversal
+        lines can be fed page by page, streaming callers drain the collected rows between pages
+        """
+        self.feature_rows = []
+        self.feature_lines = []
+        self.feature_positions = []
+        self.dirty_lines = []
+        self.ages = []
+        self.age_header_count = 0
+        self.trailing_age = None
+        self.position = 0
+
+    def feed(self, lines):
+        """
+        classifies the given lines and collects feature rows, dirty rows and age values
+        feature rows are only stored as stripped strings here, they are decoded in bulk by the parser
+        :param lines:
+        :return:
+        """
+        position = self.position
+        for line in lines:
+            stripped = line.strip()
+            field_count = stripped.count(' ') + 1
+            if field_count == 8:
+                # feature row
+                self.feature_rows.append(stripped)
+                self.feature_lines.append(line)
+                self.feature_positions.append(position)
+            elif field_count == 1:
+                if stripped == "Age":
+                    # age header, only the values after the last one are part of the age column
+                    self.ages = []
+                    self.age_header_count += 1
+                else:
+                    # age value, anything else on its own is a sheet marker or a blank line
+                    try:
+                        self.ages.append(int(stripped))
+                    except ValueError:
+                        pass
+            elif 3 <= field_count <= 7:
+                vals = stripped.split(' ')
+                if not (vals.__contains__("Page") or vals.__contains__("Sheet")):
+                    # dirty row
+                    self.dirty_lines.append((position, line))
+            # two fields are page markers and more than eight is the column header, both are skipped
+            position += 1
+        self.position = position
+        if lines:
+            try:
+                self.trailing_age = int(lines[-1].strip())
+            except ValueError:
+                self.trailing_age = None
+
+    def leading_ages(self):
+        """
+        without an age header the index based lookup starts at index -1, so the last line is counted first and then
+        every age value of the document follows
+        :return:
+        """
+        if not self.age_header_count and self.trailing_age is not None:
+            return [self.trailing_age]
+        return []
+
+    def finish(self):
+        """
+        closes the state machine once all lines were fed
+        :return:
+        """
+        self.ages = self.leading_ages() + self.ages
+
+
+def parse_page_range(source_location, backend, start, stop):
+    """
+    worker function of CrabPDFParser.parse_shards, tokenizes and decodes the pages start to stop (excluded)
+    the age values are returned as the tokenizer left them, they can only be lined up with the feature rows once the
+    shards before and after are known
+    :param source_location:
+    :param backend:
+    :param start:
+    :param stop:
+    :return:
+    """
+    start_time, start_cpu = time.perf_counter(), time.process_time()
+    crab_data_parser = CrabPDFParser(source_location, None, backend=backend)
+    tokenizer = CrabLineTokenizer()
+    for lines in backend.read_page_range(source_location, start, stop):
+        tokenizer.feed(lines)
+    features = crab_data_parser.drain_features(tokenizer)
+    return {"features": features, "dirty_rows": crab_data_parser.dirty_rows, "ages": tokenizer.ages,
+            "age_header_count": tokenizer.age_header_count, "trailing_age": tokenizer.trailing_age,
+            "lines": tokenizer.position, "seconds": time.perf_counter() - start_time,
+            "cpu_seconds": time.process_time() - start_cpu}
+
+
+def merge_age_shards(shards):
+    """
+    age values of the whole document from the shards returned by parse_page_range, in document order
+    the same as one tokenizer fed every page: the values after the last age header, which is in the last shard that
+    has one, and without any age header the quirk of CrabLineTokenizer.leading_ages on the last line
+    :param shards:
+    :return:
+    """
+    headers = [c for c, shard in enumerate(shards) if shard["age_header_count"]]
+    ages = [age for shard in shards[headers[-1] if headers else 0:] for age in shard["ages"]]
+    if not headers:
+        trailing_age = [shard["trailing_age"] for shard in shards if shard["lines"]][-1:]
+        ages = [age for age in trailing_age if age is not None] + ages
+    return ages
+
+
 class CrabPDFParser:
-    def __init__(self, source_location, destination_location):
+    def __init__(self, source_location, destination_location, cache=None, backend=None, columnar_format=None,
+                 shards=None, dtype_policy=None):
         self.source_location = source_location
         self.destination_location = destination_location
+        self.cache = cache
+        # tika is the default backend, see crab_pdf_backends for the in process alternative
+        self.backend = backend or TikaBackend()
+        # feather or parquet, process then also writes a columnar copy of the csv file with compact dtypes
+        self.columnar_format = columnar_format
+        # number of worker processes that parse page ranges of the pdf, None parses it in this process
+        self.shards = shards
+        # see crab_dtypes, the frame process returns is converted to it once the csv file is written
+        self.dtype_policy = dtype_policy
         self.dirty_rows = []
 
         logger.debug("CrabPDF called")
@@ -69,47 +215,101 @@ class CrabPDFParser:
 
         return sex, length, diameter, height, weight, shucked_weight, viscera_weight, shell_weight, (success_count != 0)
 
-    def extract_raw_features(self, lines):
+    def tokenize_feature_rows(self, rows):
         """
-        extracts the feature matrix from pdf file
+        splits all the 8 field rows into a single (n, 8) array of strings with one join and one split
+        every row has exactly 7 single spaces, so the flat token list always reshapes cleanly
+        :param rows: stripped lines that have exactly 8 space separated fields
         :return:
         """
-        sex = []
-        # i have randomly initialised the array to 2000 in order to assign memory up front and
-        # save up on space and time (dynamic array resize)
-        length = 0 * [2000]
-        diameter = 0 * [2000]
-        height = 0 * [2000]
-        weight = 0 * [2000]
-        shucked_weight = 0 * [2000]
-        viscera_weight = 0 * [2000]
-        shell_weight = 0 * [2000]
-        for c in range(len(lines)):
-            vals = lines[c].strip().split(' ')
-            if 3 <= len(vals) <= 7 and not (vals.__contains__("Page") or vals.__contains__("Sheet")):
-                # I also wanted to keep track of dirty data rows to report
-                # these dirty rows are printed towards the end of this section
-                self.dirty_rows.append(lines[c])
-            elif len(vals) == 8:
-                s, l, d, h, w, sw, vw, sh_w, is_dirty = self.get_converted_row(vals)
-                if is_dirty:
-                    self.dirty_rows.append(lines[c])
-                sex.append(s)
-                length.append(l)
-                diameter.append(d)
-                height.append(h)
-                weight.append(w)
-                shucked_weight.append(sw)
-                viscera_weight.append(vw)
-                shell_weight.append(sh_w)
-
-        # create data frame from the collected lists
+        if not rows:
+            return np.empty((0, 8), dtype=object)
+        return np.array(" ".join(rows).split(" "), dtype=object).reshape(-1, 8)
+
+    def bulk_float_parse(self, block, measurements, failed):
+        """
+        converts a block of string cells to floats in one go, writing into measurements and failed
+        when float() rejects a cell somewhere in the block, the block is split into 32 smaller ones and only the
+        smallest blocks holding dirty values are parsed cell by cell with floatTryParse
+        :param block: (n, 7) object array of strings
+        :param measurements: (n, 7) float view to write the values to
+        :param failed: (n, 7) bool view to flag the cells that could not be parsed
+        :return:
+        """
+        try:
+            measurements[:] = block.astype(np.float64)
+            return
+        except ValueError:
+            pass
+        if len(block) <= 32:
+            for r, c in np.ndindex(block.shape):
+                measurements[r, c], success = self.floatTryParse(block[r, c])
+                failed[r, c] = not success
+            return
+        step = -(-len(block) // 32)
+        for start in range(0, len(block), step):
+            self.bulk_float_parse(block[start:start + step], measurements[start:start + step],
+                                  failed[start:start + step])
+
+    def decode_feature_rows(self, rows, block_size=256):
+        """
+        column oriented version of get_converted_row
+        every block of rows is decoded by np.loadtxt in one native call, it rounds like float() and never takes a
+        value float() rejects; only a block it fails on is tokenized and goes through bulk_float_parse, and the dirty
+        rows are the ones with any failed cell. the blocks are small so that a dirty row every few thousand rows
+        leaves most of them to np.loadtxt
+        returns the sex column, the (n, 7) measurement matrix and the dirty row mask
+        :param rows: stripped lines that have exactly 8 space separated fields
+        :param block_size:
+        :return:
+        """
+        sex = np.array([row[:row.index(' ')] for row in rows], dtype=object)
+        measurements = np.empty((len(rows), 7), dtype=np.float64)
+        failed = np.zeros((len(rows), 7), dtype=bool)
+        for start in range(0, len(rows), block_size):
+            end = start + block_size
+            block = rows[start:end]
+            try:
+                measurements[start:end] = np.loadtxt(io.StringIO('\n'.join(block)), delimiter=' ',
+                                                     usecols=range(1, 8), comments=None, ndmin=2)
+            except ValueError:
+                self.bulk_float_parse(self.tokenize_feature_rows(block)[:, 1:], measurements[start:end],
+                                      failed[start:end])
+        return sex, measurements, failed.any(axis=1)
+
+    def drain_features(self, tokenizer):
+        """
+        decodes the feature rows collected by the tokenizer in bulk and empties its row buffers
+        the dirty rows are appended to self.dirty_rows in the order they appear in the document
+        :param tokenizer: CrabLineTokenizer that has been fed some lines
+        :return:
+        """
+        sex, measurements, dirty = self.decode_feature_rows(tokenizer.feature_rows)
+        # I also wanted to keep track of dirty data rows to report
+        # these dirty rows are printed towards the end of this section
+        dirty_lines = tokenizer.dirty_lines + [(tokenizer.feature_positions[c], tokenizer.feature_lines[c])
+                                               for c in np.flatnonzero(dirty)]
+        self.dirty_rows.extend(line for _, line in sorted(dirty_lines, key=lambda d: d[0]))
+        tokenizer.feature_rows = []
+        tokenizer.feature_lines = []
+        tokenizer.feature_positions = []
+        tokenizer.dirty_lines = []
+
+        # create data frame from the decoded columns
         # i know that the expected output column names are different. i kept them this way to make analysis easier
         # this could be easily changed by providing a mapper dict object to pandas rename function
-        data_frame = pd.DataFrame({"sex": sex, "length": length, "diameter": diameter, "height": height,
-                                   "weight": weight, "shucked_weight": shucked_weight, "viscera_weight": viscera_weight,
-                                   "shell_weight": shell_weight})
-        return data_frame
+        if len(sex) == 0:
+            return pd.DataFrame({column: [] for column in FEATURE_COLUMNS})
+        return pd.DataFrame(dict(zip(FEATURE_COLUMNS, [sex] + list(measurements.T))))
+
+    def extract_raw_features(self, lines):
+        """
+        extracts the feature matrix from pdf file
+        :return:
+        """
+        tokenizer = CrabLineTokenizer()
+        tokenizer.feed(lines)
+        return self.drain_features(tokenizer)
 
     def get_index_of_age_variable(self, lines):
         """
@@ -154,21 +354,187 @@ class CrabPDFParser:
 
     def read_raw_pdf(self):
         """
-        uses adobe REST Api to return just the text of a PDF
+        returns the text lines of the PDF from the pdf backend
         :return:
         """
-        raw = parser.from_file(self.source_location)
-        return (raw['content'].strip().split('\n'))
+        return self.backend.read_lines(self.source_location)
 
-    def process(self):
+    def read_raw_pages(self):
         """
-        main entry function for this class
+        generator that returns the text lines of the PDF one page at a time
+        only a single page worth of lines is split and held at any point, tika gets the document a page range at a time
+        :return:
+        """
+        return self.backend.stream_pages(self.source_location)
+
+    def iter_records(self):
+        """
+        generator that returns one (sex, length, ..., shell_weight, age) record at a time
+        the age block trails the feature block in the document, so every page goes through the line tokenizer and
+        its feature rows and age values are spilled to temporary files, then zipped back together at the end.
+        this keeps memory bounded by a single page no matter how many pages there are
+        :return:
+        """
+        with tempfile.TemporaryFile(mode='w+') as feature_spill, tempfile.TemporaryFile(mode='w+') as age_spill:
+            tokenizer = CrabLineTokenizer()
+            feature_count = 0
+            age_count = 0
+            age_header_count = 0
+            for lines in self.read_raw_pages():
+                tokenizer.feed(lines)
+                features = self.drain_features(tokenizer)
+                for sex, values in zip(features["sex"], features.iloc[:, 1:].to_numpy().tolist()):
+                    feature_spill.write(sex + " " + " ".join(map(repr, values)) + "\n")
+                feature_count += len(features)
+
+                if tokenizer.age_header_count != age_header_count:
+                    # a new age header was found, the values spilled so far are not part of the age column
+                    age_spill.seek(0)
+                    age_spill.truncate()
+                    age_count = 0
+                    age_header_count = tokenizer.age_header_count
+                age_spill.writelines("{0}\n".format(age) for age in tokenizer.ages)
+                age_count += len(tokenizer.ages)
+                tokenizer.ages = []
+
+            leading_ages = tokenizer.leading_ages()
+            age_count += len(leading_ages)
+            if age_count != feature_count:
+                message = "Number of feature rows({0}) does not match number of rows for age ({1})".format(
+                    feature_count, age_count)
+                logger.critical(message)
+                raise RuntimeError(message)
+
+            feature_spill.seek(0)
+            age_spill.seek(0)
+            ages = itertools.chain(("{0}\n".format(age) for age in leading_ages), age_spill)
+            for feature_line, age_line in zip(feature_spill, ages):
+                vals = feature_line.split(' ')
+                yield (vals[0],) + tuple(float(v) for v in vals[1:]) + (int(age_line),)
+
+    def iter_record_chunks(self, chunk_size=10000):
+        """
+        groups the streamed records into data frames of at most chunk_size rows
+        :param chunk_size:
+        :return:
+        """
+        columns = FEATURE_COLUMNS + ["age"]
+        chunk = []
+        for record in self.iter_records():
+            chunk.append(record)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame.from_records(chunk, columns=columns)
+
+    def process_streaming(self, chunk_size=10000):
+        """
+        same output as process but the csv file is written chunk by chunk from the record generator
+        :param chunk_size:
+        :return:
+        """
+        row_count = 0
+        for chunk in self.iter_record_chunks(chunk_size):
+            chunk.to_csv(self.destination_location, index=False, header=(row_count == 0),
+                         mode='w' if row_count == 0 else 'a')
+            row_count += len(chunk)
+        if row_count == 0:
+            pd.DataFrame(columns=FEATURE_COLUMNS + ["age"]).to_csv(self.destination_location, index=False)
+
+        logger.info("Number of rows written: {0}".format(row_count))
+        logger.info("Number of dirty data rows: {0}".format(len(self.dirty_rows)))
+        for d in self.dirty_rows:
+            logger.debug(d)
+        logger.info("PDF parsing finished successfully")
+
+    def cache_key(self):
+        """
+        key of the pdf in the extraction cache, it changes with the content of the file, the parser and the backend
+        :return:
+        """
+        return self.cache.key(self.source_location, "{0}-{1}".format(PARSER_VERSION, self.backend.name))
+
+    def extract(self):
+        """
+        returns the feature matrix together with the age column without writing anything
+        when an extraction cache is set, an unchanged pdf is loaded from the cache and not parsed again
+        :return:
+        """
+        if self.cache is None:
+            return self.parse_shards() if self.shards else self.parse_document()
+        with metrics.stage("parse.cache_lookup"):
+            key = self.cache_key()
+            cached = self.cache.get(key)
+        if cached is not None:
+            logger.info("Loaded {0} from the extraction cache".format(self.source_location))
+            raw_features, self.dirty_rows = cached
+            return raw_features
+        raw_features = self.parse_shards() if self.shards else self.parse_document()
+        with metrics.stage("parse.cache_store", rows=len(raw_features)):
+            self.cache.put(key, raw_features, self.dirty_rows)
+        return raw_features
+
+    def parse_document(self):
+        """
+        parses the pdf and returns the feature matrix together with the age column
+        :return:
+        """
+        # one pass over the lines fills both the feature rows and the age values
+        tokenizer = CrabLineTokenizer()
+        with metrics.stage("parse.read_pdf") as stage:
+            lines = self.read_raw_pdf()
+            stage["rows"] = len(lines)
+        with metrics.stage("parse.tokenize", rows=len(lines)):
+            tokenizer.feed(lines)
+            tokenizer.finish()
+        del lines
+        with metrics.stage("parse.decode") as stage:
+            raw_features = self.drain_features(tokenizer)
+            stage["rows"] = len(raw_features)
+        return self.join_age(raw_features, tokenizer.ages)
+
+    def parse_shards(self):
+        """
+        same output as parse_document, but the pages are split into RANGES_PER_WORKER ranges per worker process and
+        parsed on a process pool; every range comes back with its feature rows and the age values its tokenizer
+        collected, they are merged in page order so the age column lines up with the feature rows wherever the range
+        boundaries fall
         :return:
         """
-        lines = self.read_raw_pdf()
-        raw_features = self.extract_raw_features(lines)
-        age_list = self.process_age(len(raw_features),lines)
+        with metrics.stage("parse.count_pages") as stage:
+            page_count = count_pages(self.source_location)
+            stage["rows"] = page_count
+        pages_per_range = max(1, math.ceil(page_count / (self.shards * RANGES_PER_WORKER)))
+        ranges = [(start, min(start + pages_per_range, page_count)) for start in range(0, page_count, pages_per_range)]
+        logger.info("Parsing {0} pages in {1} ranges of {2} pages on {3} processes".format(
+            page_count, len(ranges), pages_per_range, self.shards))
+        with metrics.stage("parse.shards") as stage:
+            with ProcessPoolExecutor(max_workers=min(self.shards, len(ranges) or 1)) as executor:
+                futures = [executor.submit(parse_page_range, self.source_location, self.backend, start, stop)
+                           for start, stop in ranges]
+                shards = [f.result() for f in futures]
+            stage["rows"] = sum(len(shard["features"]) for shard in shards)
+        if shards:
+            cpu_seconds = [shard["cpu_seconds"] for shard in shards]
+            logger.info("Shards took {0:.2f}s of cpu on average, the slowest {1:.2f}s".format(
+                sum(cpu_seconds) / len(cpu_seconds), max(cpu_seconds)))
+        with metrics.stage("parse.merge_shards", rows=stage["rows"]):
+            for shard in shards:
+                self.dirty_rows.extend(shard["dirty_rows"])
+            if shards:
+                raw_features = pd.concat([shard["features"] for shard in shards], ignore_index=True)
+            else:
+                raw_features = pd.DataFrame({column: [] for column in FEATURE_COLUMNS})
+            return self.join_age(raw_features, merge_age_shards(shards))
 
+    def join_age(self, raw_features, age_list):
+        """
+        adds the age column to the feature matrix, both have to have the same number of rows
+        :param raw_features:
+        :param age_list:
+        :return:
+        """
         if len(age_list) != len(raw_features):
             logger.critical(
                 "Number of feature rows({0}) does not match number of rows for age ({1})".format(len(age_list),
@@ -176,11 +542,30 @@ class CrabPDFParser:
             raise
 
         raw_features["age"] = pd.Series(age_list)
-        raw_features.to_csv(self.destination_location, index=False)
+        metrics.frame("parse.decode", raw_features)
+        return raw_features
+
+    def process(self):
+        """
+        main entry function for this class
+        returns the parsed data so that it can be handed over without reading the csv file back
+        :return:
+        """
+        with metrics.stage("parse") as stage:
+            raw_features = self.extract()
+            stage["rows"] = len(raw_features)
+            with metrics.stage("parse.write_csv", rows=len(raw_features)):
+                raw_features.to_csv(self.destination_location, index=False)
+            if self.columnar_format:
+                with metrics.stage("parse.write_columnar", rows=len(raw_features)):
+                    write_columnar(raw_features, columnar_location(self.destination_location, self.columnar_format),
+                                   self.columnar_format)
+            if self.dtype_policy:
+                # the csv file keeps the precision of the pdf, only the frame handed to the models is converted
+                raw_features = apply_dtype_policy(raw_features, self.dtype_policy)
+                metrics.frame("parse.output", raw_features)
         logger.info("Number of dirty data rows: {0}".format(len(self.dirty_rows)))
         for d in self.dirty_rows:
             logger.debug(d)
         logger.info("PDF parsing finished successfully")
-
-
-
+        return raw_features
@@ -0,0 +1,178 @@
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from crab_analyser.crab_columnar import columnar_location, write_columnar
+from crab_analyser.crab_metrics import metrics
+from crab_analyser.crab_pdf_parser_v2 import FEATURE_COLUMNS, CrabLineTokenizer
+
+logger = logging.getLogger('crabdata')
+
+# put on the queue by the parsing thread once every batch is there
+END_OF_DOCUMENT = None
+
+
+class CrabPipeline:
+    def __init__(self, parser, scorer, model="forest", batch_rows=10000, queue_size=4):
+        """
+        scores a pdf with a trained model while it is still being parsed
+        a thread reads the pdf page by page and puts the decoded feature rows on a bounded queue, the models are
+        applied to every batch as soon as it arrives, the age column trails the features in the document so it is
+        only joined back once the last page is read
+        the pages come from CrabPDFParser.read_raw_pages, the tika backend sends the pdf a page range at a time so
+        that the first batches are scored before the whole document is parsed; with an extraction cache an
+        unchanged pdf is not parsed at all and a parsed one is stored
+        nothing goes through a csv file, the csv file of the parser is still written at the end for compatibility
+        :param parser: CrabPDFParser, its destination_location is the csv file of the parsed data, None skips it
+        :param scorer: CrabAgeScorer of a trained artifact
+        :param model: forest, compiled or ols
+        :param batch_rows: rows parsed before a batch is handed over, a batch ends on a page boundary
+        :param queue_size: batches that can wait for the model before parsing blocks, bounds the memory in flight
+        """
+        self.parser = parser
+        self.scorer = scorer
+        self.model = model
+        self.batch_rows = batch_rows
+        self.queue_size = queue_size
+        self.ages = None
+        self.report = {}
+        # set when scoring fails, the parsing thread then stops at the next page
+        self.stopped = threading.Event()
+        logger.debug("CrabPipeline called")
+
+    def parse_batches(self):
+        """
+        generator that parses the pdf page by page and returns the feature rows in batches of at least batch_rows
+        rows, the age column is kept in self.ages once the last page is read
+        :return:
+        """
+        tokenizer = CrabLineTokenizer()
+        for lines in self.parser.read_raw_pages():
+            if self.stopped.is_set():
+                return
+            tokenizer.feed(lines)
+            if len(tokenizer.feature_rows) >= self.batch_rows:
+                yield self.parser.drain_features(tokenizer)
+        if tokenizer.feature_rows:
+            yield self.parser.drain_features(tokenizer)
+        tokenizer.finish()
+        self.ages = tokenizer.ages
+
+    def cached_batches(self, cached):
+        """
+        generator that returns the feature rows of a parsed frame from the extraction cache in batches of batch_rows
+        rows, like parse_batches
+        :param cached: parsed frame and dirty rows of CrabExtractionCache.get
+        :return:
+        """
+        crab_data, self.parser.dirty_rows = cached
+        for start in range(0, len(crab_data), self.batch_rows):
+            yield crab_data.iloc[start:start + self.batch_rows].drop(columns="age")
+        self.ages = crab_data["age"].tolist()
+
+    def produce(self, batches, cached=None):
+        """
+        parsing thread, puts the feature rows on the queue batch by batch and keeps the age column for the end
+        exceptions are put on the queue as well so that they are raised in the scoring thread
+        :param batches: bounded queue
+        :param cached: parsed frame and dirty rows from the extraction cache, None parses the pdf
+        :return:
+        """
+        try:
+            blocked = 0.0
+            for batch in self.parse_batches() if cached is None else self.cached_batches(cached):
+                if self.stopped.is_set():
+                    return
+                start = time.perf_counter()
+                batches.put(batch)
+                blocked += time.perf_counter() - start
+            self.report["parser_blocked_seconds"] = blocked
+            batches.put(END_OF_DOCUMENT)
+        except BaseException as e:
+            batches.put(e)
+
+    def run(self, prediction_location):
+        """
+        main entry function for this class
+        scores the batches as they are parsed, then saves the predictions in the output format of the README and
+        the parsed data like CrabPDFParser.process
+        :param prediction_location:
+        :return: predictions as a data frame
+        """
+        start = time.perf_counter()
+        key, cached = None, None
+        if self.parser.cache is not None:
+            # an unchanged pdf is not parsed again, its cached rows are scored batch by batch all the same
+            with metrics.stage("parse.cache_lookup"):
+                key = self.parser.cache_key()
+                cached = self.parser.cache.get(key)
+            if cached is not None:
+                logger.info("Loaded {0} from the extraction cache".format(self.parser.source_location))
+        batches = queue.Queue(maxsize=self.queue_size)
+        producer = threading.Thread(target=self.produce, args=(batches, cached), name="crab-pipeline-parser",
+                                    daemon=True)
+        producer.start()
+        frames, predictions = [], []
+        waiting, scoring = 0.0, 0.0
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                batch = batches.get()
+                waiting += time.perf_counter() - wait_start
+                if batch is END_OF_DOCUMENT:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                score_start = time.perf_counter()
+                predictions.append(self.scorer.predict(batch, self.model))
+                scoring += time.perf_counter() - score_start
+                frames.append(batch)
+                logger.debug("Scored a batch of {0} rows, {1} batches waiting".format(len(batch), batches.qsize()))
+        finally:
+            self.stopped.set()
+            # a parser blocked on the full queue has to get its batch through before it can stop
+            while producer.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            producer.join()
+
+        if frames:
+            crab_data = pd.concat(frames, ignore_index=True)
+        else:
+            crab_data = pd.DataFrame({column: [] for column in FEATURE_COLUMNS})
+        if len(self.ages) != len(crab_data):
+            message = "Number of feature rows({0}) does not match number of rows for age ({1})".format(
+                len(crab_data), len(self.ages))
+            logger.critical(message)
+            raise RuntimeError(message)
+        crab_data["age"] = pd.Series(self.ages, dtype=np.int64)
+        if key is not None and cached is None:
+            with metrics.stage("parse.cache_store", rows=len(crab_data)):
+                self.parser.cache.put(key, crab_data, self.parser.dirty_rows)
+        if self.parser.destination_location:
+            crab_data.to_csv(self.parser.destination_location, index=False)
+            if self.parser.columnar_format:
+                write_columnar(crab_data, columnar_location(self.parser.destination_location,
+                                                            self.parser.columnar_format),
+                               self.parser.columnar_format)
+        logger.info("Number of dirty data rows: {0}".format(len(self.parser.dirty_rows)))
+        for d in self.parser.dirty_rows:
+            logger.debug(d)
+
+        predicted_age = np.concatenate(predictions) if predictions else np.empty(0)
+        crab_df = self.scorer.output_frame(crab_data, predicted_age)
+        crab_df.to_csv(prediction_location, index=False)
+        self.report.update({"rows": len(crab_data), "batches": len(frames),
+                            "seconds": time.perf_counter() - start,
+                            "scoring_seconds": scoring, "scorer_waiting_seconds": waiting})
+        logger.info("Pipelined {0} rows in {1} batches in {2:.2f}s, {3:.2f}s scoring while parsing, the parser waited "
+                    "{4:.2f}s for the model".format(len(crab_data), len(frames), self.report["seconds"], scoring,
+                                                    self.report["parser_blocked_seconds"]))
+        logger.info("Crab data with predicted age saved: {0}".format(prediction_location))
+        return crab_df
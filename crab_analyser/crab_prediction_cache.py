@@ -0,0 +1,110 @@
+import collections
+import logging
+import uuid
+
+import numpy as np
+
+from crab_analyser.crab_ml import CrabAgeScorer
+
+logger = logging.getLogger('crabdata')
+
+
+def artifact_key(artifact):
+    """
+    identifies the fitted models of an artifact, CrabAgePredictor.train and update give every fit a new revision,
+    so it changes when another artifact is loaded and when the models of the same one are refitted in place
+    artifacts saved before revisions existed get one the first time they are seen
+    :param artifact:
+    :return:
+    """
+    return artifact.setdefault("revision", uuid.uuid4().hex)
+
+
+class CrabPredictionCache(CrabAgeScorer):
+    def __init__(self, artifact, max_entries=100000):
+        """
+        CrabAgeScorer that only sends the rows it has not seen before to the models
+        measurements are quantized and weights repeat, so every batch is scored once per unique feature vector and
+        the predictions are scattered back to the rows; predictions are kept across batches in a least recently
+        used cache of max_entries feature vectors per model
+        it is not thread safe, the micro batcher of the service and the pipeline score one batch at a time
+        :param artifact:
+        :param max_entries:
+        """
+        super().__init__(artifact)
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.entries_key = artifact_key(artifact)
+        self.rows = 0
+        self.unique_rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def invalidate(self):
+        """
+        drops every cached prediction, predict calls it when the artifact changes
+        :return:
+        """
+        if self.entries:
+            self.invalidations += 1
+            logger.info("Prediction cache invalidated, {0} entries dropped".format(len(self.entries)))
+        self.entries.clear()
+        self.feature_columns = self.artifact["feature_columns"]
+        self.fill_values = self.artifact["fill_values"]
+        self.entries_key = artifact_key(self.artifact)
+
+    def predict(self, crab_data, model="forest"):
+        """
+        returns the predicted age of every row, only the feature vectors missing from the cache are scored
+        :param crab_data: data frame with the columns of the parser output, age is optional
+        :param model: forest, compiled or ols
+        :return:
+        """
+        if artifact_key(self.artifact) != self.entries_key:
+            self.invalidate()
+        X = self.prepare(crab_data)
+        # imputation comes first, so rows that only differ in which values were missing share an entry
+        codes = X.groupby(self.feature_columns, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+        # the first row of every group, in the order of the group numbers
+        unique = X.iloc[np.unique(codes, return_index=True)[1]]
+        keys = [(model,) + row for row in unique.itertuples(index=False, name=None)]
+        predicted_age = np.empty(len(keys))
+        missing = []
+        for k, key in enumerate(keys):
+            value = self.entries.get(key)
+            if value is None:
+                missing.append(k)
+            else:
+                self.entries.move_to_end(key)
+                predicted_age[k] = value
+        if missing:
+            predicted_age[missing] = super().predict(unique.iloc[missing], model)
+            for k in missing:
+                self.entries[keys[k]] = predicted_age[k]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        self.rows += len(X)
+        self.unique_rows += len(keys)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return predicted_age[codes]
+
+    def stats(self):
+        """
+        returns the counters as a json serialisable dict
+        the hit rate is over the unique feature vectors of the batches, scored_fraction is the share of all the rows
+        that went through a model
+        :return:
+        """
+        return {"rows": self.rows,
+                "unique_rows": self.unique_rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / self.unique_rows if self.unique_rows else None,
+                "scored_fraction": self.misses / self.rows if self.rows else None,
+                "entries": len(self.entries),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations}
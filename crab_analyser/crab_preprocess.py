@@ -0,0 +1,142 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('crabdata')
+
+# same as CrabAgePredictor.continuous_var_columns
+CONTINUOUS_COLUMNS = ["length", "diameter", "height", "weight", "shucked_weight", "viscera_weight", "shell_weight",
+                      "age"]
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+
+def merge_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    """
+    merges the count, mean and sum of squared deviations (or co-deviations) of two groups of rows
+    this is welford's update for a whole chunk at a time (chan et al.), it does not lose precision the way summing
+    x and x squared does
+    :param count_a:
+    :param mean_a:
+    :param m2_a: vector of squared deviations or matrix of co-deviations
+    :param count_b:
+    :param mean_b:
+    :param m2_b:
+    :return:
+    """
+    count = count_a + count_b
+    if count_b == 0:
+        return count_a, mean_a, m2_a
+    if count_a == 0:
+        return count_b, mean_b, m2_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (count_b / count)
+    correction = np.outer(delta, delta) if np.ndim(m2_a) == 2 else delta ** 2
+    return count, mean, m2_a + m2_b + correction * (count_a * count_b / count)
+
+
+def is_parquet(location):
+    """
+    parquet files are recognised by their extension, everything else is read as csv
+    :param location:
+    :return:
+    """
+    return location.lower().endswith(PARQUET_EXTENSIONS)
+
+
+class CrabStreamingPreprocessor:
+    def __init__(self, source_location, chunk_size=100000):
+        """
+        chunked version of CrabAgePredictor.pre_process_data for csv or parquet files that do not fit in memory
+        the first pass keeps the running mean and standard deviation of the continuous columns, the second pass
+        imputes missing values with the means and drops rows more than 3 std away, one chunk at a time
+        CrabIncrementalOLS, the out of core linear regression of the run command, reads its rows through it
+        :param source_location: csv or parquet file with the columns of the parser output
+        :param chunk_size: rows read at a time
+        """
+        self.source_location = source_location
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.fill_values = None
+        self.scale = None
+        self.missing_columns = []
+        self.categories = []
+        logger.debug("CrabStreamingPreprocessor called")
+
+    def iter_chunks(self, columns=None):
+        """
+        generator that returns the source file chunk by chunk
+        :param columns: optional subset of columns to read
+        :return:
+        """
+        if is_parquet(self.source_location):
+            # pyarrow is optional, it is only needed for parquet files
+            import pyarrow.parquet as pq
+
+            for batch in pq.ParquetFile(self.source_location).iter_batches(self.chunk_size, columns=columns):
+                yield batch.to_pandas()
+        else:
+            for chunk in pd.read_csv(self.source_location, usecols=columns, chunksize=self.chunk_size):
+                yield chunk if columns is None else chunk[columns]
+
+    def collect_statistics(self, columns=None):
+        """
+        first pass, mean and population standard deviation of the continuous columns after mean imputation and the
+        sex categories in the order they appear in
+        :param columns: optional subset of columns to read, must include the continuous ones
+        :return:
+        """
+        start = time.perf_counter()
+        rows = 0
+        count, mean, m2 = np.zeros(len(CONTINUOUS_COLUMNS)), np.zeros(len(CONTINUOUS_COLUMNS)), \
+            np.zeros(len(CONTINUOUS_COLUMNS))
+        missing = np.zeros(len(CONTINUOUS_COLUMNS), dtype=bool)
+        categories = []
+        for chunk in self.iter_chunks(columns):
+            rows += len(chunk)
+            values = chunk[CONTINUOUS_COLUMNS].to_numpy(dtype=np.float64)
+            for j in range(len(CONTINUOUS_COLUMNS)):
+                column = values[:, j][~np.isnan(values[:, j])]
+                missing[j] |= len(column) < len(values)
+                if len(column):
+                    count[j], mean[j], m2[j] = merge_moments(count[j], mean[j], m2[j], len(column), column.mean(),
+                                                             ((column - column.mean()) ** 2).sum())
+            if "sex" in chunk:
+                for category in chunk["sex"].astype(str).unique():
+                    if category not in categories:
+                        categories.append(category)
+        if rows == 0:
+            raise ValueError("No rows found in {0}".format(self.source_location))
+        self.rows = rows
+        self.fill_values = pd.Series(mean, index=CONTINUOUS_COLUMNS)
+        # the imputed values sit on the mean, they add rows but no deviation, zscore uses the population std
+        self.scale = pd.Series(np.sqrt(m2 / rows), index=CONTINUOUS_COLUMNS)
+        self.missing_columns = [c for c, m in zip(CONTINUOUS_COLUMNS, missing) if m]
+        self.categories = categories
+        logger.debug("Statistics of {0} rows collected in {1:.2f}s".format(rows, time.perf_counter() - start))
+
+    def clean(self, chunk):
+        """
+        imputes the chunk and drops the rows with a continuous value more than 3 std away from the mean
+        :param chunk:
+        :return:
+        """
+        chunk = chunk.fillna(self.fill_values)
+        # columns with a missing value anywhere are float in the in memory frame, even in chunks without one
+        chunk = chunk.astype({c: np.float64 for c in self.missing_columns})
+        continuous = chunk[CONTINUOUS_COLUMNS].to_numpy(dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = (continuous - self.fill_values.to_numpy()) / self.scale.to_numpy()
+        return chunk[(np.abs(z) < 3).all(axis=1)]
+
+    def iter_clean_chunks(self, columns=None):
+        """
+        second pass, generator that returns the imputed and filtered chunks
+        :param columns: optional subset of columns to read, must include the continuous ones
+        :return:
+        """
+        if self.fill_values is None:
+            self.collect_statistics(columns)
+        for chunk in self.iter_chunks(columns):
+            yield self.clean(chunk)
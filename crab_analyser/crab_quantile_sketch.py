@@ -0,0 +1,234 @@
+import numpy as np
+from sklearn.preprocessing import QuantileTransformer
+from sklearn.utils import check_array, check_random_state
+from sklearn.utils.validation import FLOAT_DTYPES
+
+from crab_analyser.crab_incremental_ols import weighted_percentiles
+
+
+class CrabQuantileSketch:
+    def __init__(self, k=256, seed=None):
+        """
+        mergeable streaming quantile sketch with bounded memory
+        values are counted exactly as long as there are at most k distinct ones, which is always the case for the
+        age; past that they go into a hierarchy of compactors like in KLL: an item of level h stands for 2 ** h
+        values, and a level with more than k items is sorted and every other item, starting at a random one of the
+        first two, moves up a level
+        memory stays below k items on each of the log2(n / k) levels, and the rank of any value is off by at most
+        2 * n * log2(n / k) / k, in practice far less because the random offsets cancel out
+        :param k: items per level, the error goes down and the memory up with it
+        :param seed:
+        """
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.count = 0
+        # value -> number of times it was seen, None once there are more than k distinct values
+        self.exact = {}
+        self.levels = []
+
+    def update(self, values):
+        """
+        adds the values to the sketch, missing values are skipped
+        :param values:
+        :return:
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        if self.exact is None:
+            self.add_items(0, values)
+            self.compact()
+            return self
+        distinct, counts = np.unique(values, return_counts=True)
+        for value, count in zip(distinct.tolist(), counts.tolist()):
+            self.exact[value] = self.exact.get(value, 0) + count
+        if len(self.exact) > self.k:
+            self.spill()
+        return self
+
+    def merge(self, other):
+        """
+        adds the values of a sketch of another partition of the data, other is left as it is
+        :param other: CrabQuantileSketch
+        :return:
+        """
+        self.count += other.count
+        if self.exact is not None and other.exact is not None:
+            for value, count in other.exact.items():
+                self.exact[value] = self.exact.get(value, 0) + count
+            if len(self.exact) > self.k:
+                self.spill()
+            return self
+        if self.exact is not None:
+            self.spill()
+        for h, items in enumerate(other.level_items()):
+            self.add_items(h, items)
+        self.compact()
+        return self
+
+    def level_items(self):
+        """
+        items of every level, the exact counts are split into their powers of two
+        :return:
+        """
+        if self.exact is None:
+            return self.levels
+        levels = []
+        for value, count in self.exact.items():
+            h = 0
+            while count:
+                if count & 1:
+                    levels.extend([] for _ in range(h + 1 - len(levels)))
+                    levels[h].append(value)
+                count >>= 1
+                h += 1
+        return [np.array(items, dtype=np.float64) for items in levels]
+
+    def spill(self):
+        """
+        moves the exact counts to the compactors
+        :return:
+        """
+        self.levels = self.level_items()
+        self.exact = None
+        self.compact()
+
+    def add_items(self, h, items):
+        """
+        appends items to level h
+        :param h:
+        :param items:
+        :return:
+        """
+        while len(self.levels) <= h:
+            self.levels.append(np.empty(0))
+        self.levels[h] = np.concatenate([self.levels[h], items])
+
+    def compact(self):
+        """
+        halves every level that has more than k items, from the bottom up
+        :return:
+        """
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self.k:
+                level = np.sort(level)
+                # with an odd number of items the largest one stays, the others are paired up
+                paired = len(level) - len(level) % 2
+                self.levels[h] = level[paired:]
+                self.add_items(h + 1, level[self.rng.integers(2):paired:2])
+            h += 1
+
+    def weighted_values(self):
+        """
+        sorted distinct values of the sketch and the number of values each stands for
+        :return:
+        """
+        if self.exact is not None:
+            values = np.array(sorted(self.exact), dtype=np.float64)
+            return values, np.array([self.exact[v] for v in values.tolist()], dtype=np.int64)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** h, dtype=np.int64) for h, level in enumerate(self.levels)])
+        values, inverse = np.unique(items, return_inverse=True)
+        return values, np.bincount(inverse, weights=weights).astype(np.int64)
+
+    def quantiles(self, references):
+        """
+        np.percentile(values, references * 100) of all the values added, exact while the values are counted
+        :param references: quantiles between 0 and 1
+        :return:
+        """
+        if not self.count:
+            raise ValueError("The sketch has no values")
+        values, counts = self.weighted_values()
+        return weighted_percentiles(values, counts, np.asarray(references, dtype=np.float64))
+
+
+class CrabSketchQuantileTransformer(QuantileTransformer):
+    # the sketch sees every row, so there is no subsample, and sparse input is not supported
+    ignore_implicit_zeros = False
+
+    def __init__(self, *, n_quantiles=1000, output_distribution="uniform", sketch_size=256, random_state=None,
+                 copy=True):
+        """
+        QuantileTransformer whose quantiles come from a CrabQuantileSketch per feature instead of sorting the whole
+        column, so it can be fitted chunk by chunk with partial_fit and on separate partitions that are then merged
+        transform and inverse_transform are the ones of QuantileTransformer, it is a drop in replacement for it
+        with at most sketch_size distinct values, like the ages, the quantiles are the exact ones QuantileTransformer
+        finds on up to its 10000 row subsample; with more, the rank of a quantile is off by at most
+        2 * log2(n / sketch_size) / sketch_size of the rows, and the uniform output by as much
+        :param n_quantiles:
+        :param output_distribution: uniform or normal
+        :param sketch_size: items per level of the sketches
+        :param random_state:
+        :param copy:
+        """
+        super().__init__(n_quantiles=n_quantiles, output_distribution=output_distribution, random_state=random_state,
+                         copy=copy)
+        self.sketch_size = sketch_size
+
+    def fit(self, X, y=None):
+        """
+        fits the sketches on X from scratch
+        :param X:
+        :param y:
+        :return:
+        """
+        if hasattr(self, "sketches_"):
+            del self.sketches_
+            del self.n_features_in_
+        return self.partial_fit(X)
+
+    def partial_fit(self, X, y=None):
+        """
+        adds the rows of X to the sketches and updates the quantiles
+        :param X:
+        :param y:
+        :return:
+        """
+        X = check_array(X, dtype=FLOAT_DTYPES, force_all_finite="allow-nan")
+        if not hasattr(self, "sketches_"):
+            rng = check_random_state(self.random_state)
+            self.n_features_in_ = X.shape[1]
+            self.n_samples_seen_ = 0
+            self.sketches_ = [CrabQuantileSketch(self.sketch_size, rng.randint(np.iinfo(np.int32).max))
+                              for _ in range(X.shape[1])]
+        elif X.shape[1] != self.n_features_in_:
+            raise ValueError("X has {0} features, but {1} is expecting {2} features as input".format(
+                X.shape[1], type(self).__name__, self.n_features_in_))
+        self.n_samples_seen_ += X.shape[0]
+        for sketch, column in zip(self.sketches_, X.T):
+            sketch.update(column)
+        return self.fit_quantiles()
+
+    def merge(self, other):
+        """
+        adds the sketches of a transformer fitted on another partition of the data and updates the quantiles
+        :param other: fitted CrabSketchQuantileTransformer with the same features
+        :return:
+        """
+        if len(other.sketches_) != len(self.sketches_):
+            raise ValueError("Cannot merge sketches of {0} features into {1}".format(len(other.sketches_),
+                                                                                    len(self.sketches_)))
+        self.n_samples_seen_ += other.n_samples_seen_
+        for sketch, other_sketch in zip(self.sketches_, other.sketches_):
+            sketch.merge(other_sketch)
+        return self.fit_quantiles()
+
+    def fit_quantiles(self):
+        """
+        sets the quantiles QuantileTransformer transforms with from the sketches
+        like QuantileTransformer the number of quantiles comes from the rows and every feature gets them from its own
+        values, missing values are left out and a feature without any value gets nan quantiles
+        :return:
+        """
+        self.n_quantiles_ = max(1, min(self.n_quantiles, self.n_samples_seen_))
+        self.references_ = np.linspace(0, 1, self.n_quantiles_, endpoint=True)
+        quantiles = np.full((self.n_quantiles_, len(self.sketches_)), np.nan)
+        for j, sketch in enumerate(self.sketches_):
+            if sketch.count:
+                quantiles[:, j] = sketch.quantiles(self.references_)
+        # the quantiles have to be increasing for the interpolation, like in QuantileTransformer
+        self.quantiles_ = np.maximum.accumulate(quantiles)
+        return self
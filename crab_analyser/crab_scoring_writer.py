@@ -0,0 +1,124 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from crab_analyser.crab_metrics import metrics
+
+logger = logging.getLogger('crabdata')
+
+
+def percentage_difference(age, predicted_age):
+    """
+    absolute difference between the age and the predicted age in percent of the age, like the csv files of
+    CrabAgePredictor, rows without an age or with an age of 0 get nan
+    :param age:
+    :param predicted_age:
+    :return:
+    """
+    age = np.asarray(age, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        difference = np.abs((age - predicted_age) / age * 100)
+    difference[~np.isfinite(difference)] = np.nan
+    return difference
+
+
+class CrabScoringWriter:
+    def __init__(self, scorer, model="forest", model_columns=None, chunk_size=10000):
+        """
+        scores a csv file or a data frame chunk by chunk and streams the rows into one file in the output format of
+        the README, Predicted Age is the prediction of model
+        every model of model_columns adds its own Predicted Age (model) column and, when the input has the age, a
+        Percentage Difference (model) column; the mean absolute error and percentage difference of every model are
+        added up chunk by chunk, so only one chunk is ever in memory
+        :param scorer: CrabAgeScorer or CrabPredictionCache of a trained artifact
+        :param model: forest, compiled or ols
+        :param model_columns: models that get their own columns, None for none
+        :param chunk_size: rows scored and written at a time
+        """
+        self.scorer = scorer
+        self.model = model
+        self.model_columns = list(model_columns or [])
+        self.chunk_size = chunk_size
+        self.report = {}
+        logger.debug("CrabScoringWriter called")
+
+    def chunks(self, source):
+        """
+        the rows of a csv file or a data frame in chunks of chunk_size rows
+        :param source: csv file location or data frame
+        :return:
+        """
+        if isinstance(source, pd.DataFrame):
+            for start in range(0, len(source), self.chunk_size):
+                yield source.iloc[start:start + self.chunk_size]
+        else:
+            yield from pd.read_csv(source, chunksize=self.chunk_size)
+
+    def score_chunk(self, crab_data, totals):
+        """
+        output rows of one chunk, adds the errors of the chunk to totals
+        :param crab_data:
+        :param totals: model -> running sums of the errors
+        :return:
+        """
+        predictions = {}
+        for model in [self.model] + self.model_columns:
+            if model not in predictions:
+                predictions[model] = self.scorer.predict(crab_data, model)
+        crab_df = self.scorer.output_frame(crab_data, predictions[self.model])
+        for model, predicted_age in predictions.items():
+            if model in self.model_columns:
+                crab_df["Predicted Age ({0})".format(model)] = np.rint(predicted_age).astype(int)
+            if "age" not in crab_data:
+                continue
+            difference = percentage_difference(crab_data["age"], predicted_age)
+            if model in self.model_columns:
+                crab_df["Percentage Difference ({0})".format(model)] = difference
+            known = ~np.isnan(difference)
+            total = totals.setdefault(model, {"rows": 0, "absolute_error": 0.0, "percentage_difference": 0.0})
+            total["rows"] += int(known.sum())
+            total["absolute_error"] += float(np.abs(crab_data["age"].to_numpy(dtype=np.float64)[known] -
+                                                    predicted_age[known]).sum())
+            total["percentage_difference"] += float(difference[known].sum())
+        return crab_df
+
+    def write(self, source, destination_location):
+        """
+        main entry function for this class
+        scores the rows of source chunk by chunk and appends them to destination_location
+        :param source: csv file of the parsed data or data frame
+        :param destination_location:
+        :return: report with the rows per second and the errors of every model
+        """
+        start = time.perf_counter()
+        rows, chunks = 0, 0
+        totals = {}
+        with metrics.stage("predict.write") as stage, open(destination_location, "w", newline="") as f:
+            for crab_data in self.chunks(source):
+                crab_df = self.score_chunk(crab_data, totals)
+                crab_df.to_csv(f, header=not chunks, index=False)
+                rows += len(crab_df)
+                chunks += 1
+            stage["rows"] = rows
+            if not chunks:
+                # an empty input still gets the header
+                self.scorer.output_frame(pd.DataFrame(columns=list(self.scorer.feature_columns)),
+                                         np.empty(0)).to_csv(f, index=False)
+        seconds = time.perf_counter() - start
+        self.report = {"rows": rows, "chunks": chunks, "seconds": seconds,
+                       "rows_per_second": rows / seconds if seconds else None,
+                       "models": {model: {"rows": total["rows"],
+                                          "mae": total["absolute_error"] / total["rows"] if total["rows"] else None,
+                                          "mean_percentage_difference": total["percentage_difference"] /
+                                          total["rows"] if total["rows"] else None}
+                                  for model, total in totals.items()}}
+        logger.info("Scored {0} rows in {1} chunks in {2:.2f}s, {3:.0f} rows/s".format(
+            rows, chunks, seconds, self.report["rows_per_second"] or 0))
+        for model, total in self.report["models"].items():
+            if total["rows"]:
+                logger.info("{0}: MAE {1:.3f}, mean percentage difference {2:.2f}%".format(
+                    model, total["mae"], total["mean_percentage_difference"]))
+        logger.info("Crab data with predicted age saved: {0}".format(destination_location))
+        return self.report
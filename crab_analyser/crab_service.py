@@ -0,0 +1,387 @@
+"""
+local http service that scores crab measurements with a trained model artifact
+
+    python -m crab_analyser.crab_service --model_dir models --port 8080
+
+POST /predict takes one json row or a list of rows with the column names of the README (Sex, Length, ..., Shell
+Weight, Age is optional) and returns {"predicted_age": [...]}, GET /stats returns the latency and throughput
+counters and GET /health the model version
+"""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from crab_analyser.crab_ml import OUTPUT_COLUMNS, CrabAgeScorer, fitted_categories
+from crab_analyser.crab_model_store import CrabModelStore
+from crab_analyser.crab_prediction_cache import CrabPredictionCache
+
+logger = logging.getLogger('crabdata')
+
+# README column name -> parser column name
+INPUT_COLUMNS = {v: k for k, v in OUTPUT_COLUMNS.items()}
+# number of recent request latencies the percentiles are computed over
+LATENCY_WINDOW = 10000
+MAX_BODY_BYTES = 16 * 1024 * 1024
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+               500: "Internal Server Error"}
+
+
+class CrabServiceStats:
+    def __init__(self):
+        """
+        request, row and batch counters of the service with the latencies of the last LATENCY_WINDOW requests
+        """
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def record_batch(self, requests, rows):
+        """
+        counts a scored micro batch
+        :param requests: number of requests that were merged into the batch
+        :param rows:
+        :return:
+        """
+        self.batches += 1
+        self.requests += requests
+        self.rows += rows
+
+    def record_latency(self, seconds):
+        """
+        keeps the time a request took from arrival to response
+        :param seconds:
+        :return:
+        """
+        self.latencies.append(seconds)
+
+    def snapshot(self):
+        """
+        returns the counters as a json serialisable dict, latencies are in ms and throughput is since start up
+        :return:
+        """
+        uptime = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) * 1000
+        return {"uptime_seconds": uptime,
+                "requests": self.requests,
+                "rows": self.rows,
+                "batches": self.batches,
+                "errors": self.errors,
+                "mean_batch_rows": self.rows / self.batches if self.batches else 0,
+                "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+                "requests_per_second": self.requests / uptime,
+                "rows_per_second": self.rows / uptime}
+
+
+class CrabMicroBatcher:
+    def __init__(self, scorer, model="forest", max_batch_rows=4096, max_wait_ms=5.0, stats=None):
+        """
+        merges the rows of concurrent requests into one data frame so that the model is called once per batch
+        a batch is scored as soon as it has max_batch_rows rows or its first request waited max_wait_ms
+        the prediction runs in a worker thread, requests that arrive meanwhile form the next batch
+        :param scorer: CrabAgeScorer or anything with a predict(data frame, model) method
+        :param model: forest, compiled or ols
+        :param max_batch_rows:
+        :param max_wait_ms:
+        :param stats: optional CrabServiceStats the batches are counted in
+        """
+        self.scorer = scorer
+        self.model = model
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats or CrabServiceStats()
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        """
+        starts the batching task on the running event loop
+        :return:
+        """
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        """
+        stops the batching task
+        :return:
+        """
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def predict(self, rows):
+        """
+        queues the rows of one request and waits for their predictions
+        :param rows: list of dicts with parser column names
+        :return:
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((rows, future))
+        return await future
+
+    async def next_batch(self):
+        """
+        waits for the first request and collects more until the batch is full or max_wait is over
+        :return:
+        """
+        batch = [await self.queue.get()]
+        rows = len(batch[0][0])
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while rows < self.max_batch_rows:
+            timeout = deadline - asyncio.get_running_loop().time()
+            try:
+                item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    async def score(self, batch):
+        """
+        scores the merged rows of the requests of a batch and sets their futures
+        raises when the prediction fails, the futures are then left as they are
+        :param batch: list of (rows, future)
+        :return:
+        """
+        crab_data = pd.DataFrame.from_records([row for rows, _ in batch for row in rows])
+        predicted_age = await asyncio.get_running_loop().run_in_executor(None, self.scorer.predict, crab_data,
+                                                                          self.model)
+        self.stats.record_batch(len(batch), len(crab_data))
+        start = 0
+        for rows, future in batch:
+            if not future.done():
+                future.set_result(predicted_age[start:start + len(rows)].tolist())
+            start += len(rows)
+
+    async def run(self):
+        """
+        scores batches until cancelled
+        when a batch fails, its requests are scored one at a time so that only the requests that fail on their own
+        get the error
+        :return:
+        """
+        while True:
+            batch = await self.next_batch()
+            try:
+                await self.score(batch)
+                continue
+            except Exception as e:
+                if len(batch) == 1:
+                    self.fail(batch[0], e)
+                    continue
+                logger.warning("Scoring a batch of {0} requests failed, they are scored one at a time".format(
+                    len(batch)))
+            for item in batch:
+                try:
+                    await self.score([item])
+                except Exception as e:
+                    self.fail(item, e)
+
+    def fail(self, item, error):
+        """
+        answers a request that could not be scored with the error
+        :param item: (rows, future)
+        :param error:
+        :return:
+        """
+        logger.error("Scoring a request of {0} rows failed".format(len(item[0])), exc_info=error)
+        if not item[1].done():
+            item[1].set_exception(error)
+
+
+class CrabAgeService:
+    def __init__(self, scorer, feature_columns, model="forest", host="127.0.0.1", port=8080, max_batch_rows=4096,
+                 max_wait_ms=5.0, model_version=None, categories=None):
+        """
+        asyncio http server in front of a CrabMicroBatcher, it only listens on localhost by default
+        :param scorer: CrabAgeScorer of the loaded artifact
+        :param feature_columns: parser column names every row needs
+        :param model: forest, compiled or ols
+        :param host:
+        :param port: 0 picks a free port, see self.port once started
+        :param max_batch_rows:
+        :param max_wait_ms:
+        :param model_version: reported by /health
+        :param categories: feature column -> values the model was fitted with, see fitted_categories, rows with
+        any other value are rejected before they reach a batch
+        """
+        self.feature_columns = feature_columns
+        self.categories = categories or {}
+        self.host = host
+        self.port = port
+        self.model_version = model_version
+        self.stats = CrabServiceStats()
+        self.batcher = CrabMicroBatcher(scorer, model, max_batch_rows, max_wait_ms, self.stats)
+        self.server = None
+
+    def parse_rows(self, body):
+        """
+        turns the json body of a request into rows with parser column names
+        raises ValueError when a row misses a feature, has a non numeric measurement or a category the model was not
+        fitted with
+        :param body: bytes
+        :return:
+        """
+        payload = json.loads(body)
+        records = payload if isinstance(payload, list) else [payload]
+        rows = []
+        for record in records:
+            if not isinstance(record, dict):
+                raise ValueError("Rows must be json objects")
+            row = {INPUT_COLUMNS.get(k, k): v for k, v in record.items()}
+            missing = [OUTPUT_COLUMNS[c] for c in self.feature_columns if c not in row]
+            if missing:
+                raise ValueError("Missing columns {0}".format(missing))
+            for c, values in self.categories.items():
+                if row[c] not in values:
+                    raise ValueError("Unknown {0} {1!r}, expected one of {2}".format(OUTPUT_COLUMNS.get(c, c), row[c],
+                                                                                   values))
+            rows.append({c: row[c] if c == "sex" else float(row[c]) for c in self.feature_columns})
+        if not rows:
+            raise ValueError("No rows to score")
+        return rows
+
+    async def respond(self, path, method, body):
+        """
+        routes one request and returns the status and the json response
+        :param path:
+        :param method:
+        :param body:
+        :return:
+        """
+        if method == "POST" and path == "/predict":
+            try:
+                rows = self.parse_rows(body)
+            except (ValueError, TypeError) as e:
+                return 400, {"error": str(e)}
+            try:
+                return 200, {"predicted_age": await self.batcher.predict(rows)}
+            except Exception as e:
+                return 500, {"error": "{0}: {1}".format(type(e).__name__, e)}
+        if method == "GET" and path == "/stats":
+            snapshot = self.stats.snapshot()
+            if isinstance(self.batcher.scorer, CrabPredictionCache):
+                snapshot["prediction_cache"] = self.batcher.scorer.stats()
+            return 200, snapshot
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "model_version": self.model_version}
+        return 404, {"error": "Unknown endpoint {0} {1}".format(method, path)}
+
+    async def handle(self, reader, writer):
+        """
+        serves the requests of one keep alive connection
+        :param reader:
+        :param writer:
+        :return:
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                start = time.perf_counter()
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    status, response = 413, {"error": "Request body larger than {0} bytes".format(MAX_BODY_BYTES)}
+                else:
+                    status, response = await self.respond(path, method, await reader.readexactly(length))
+                if status != 200:
+                    self.stats.errors += 1
+                content = json.dumps(response).encode()
+                writer.write("HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n\r\n"
+                             .format(status, STATUS_TEXT[status], len(content)).encode() + content)
+                await writer.drain()
+                if path == "/predict":
+                    self.stats.record_latency(time.perf_counter() - start)
+                if headers.get("connection", "").lower() == "close" or status == 413:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        """
+        starts the batcher and the server
+        :return:
+        """
+        self.batcher.start()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("Crab age service listening on http://{0}:{1}".format(self.host, self.port))
+
+    async def stop(self):
+        """
+        stops accepting connections and stops the batcher
+        :return:
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        """
+        main entry function for this class
+        :return:
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+
+def parse_args():
+    """
+    sets up command line parameters
+    :return:
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_dir", default="models", help="directory of the versioned model artifacts")
+    parser.add_argument("--model_version", type=int, default=None, help="artifact version, defaults to the latest")
+    parser.add_argument("--model", choices=["forest", "compiled", "ols"], default="forest")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max_batch_rows", type=int, default=4096,
+                        help="a micro batch is scored once it has this many rows")
+    parser.add_argument("--max_wait_ms", type=float, default=5.0,
+                        help="longest time the first request of a micro batch waits for more requests")
+    parser.add_argument("--cache_entries", type=int, default=100000,
+                        help="predictions of this many unique rows are kept between batches, 0 turns the "
+                             "prediction cache off")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = parse_args()
+    # the artifact is loaded once, every request is scored with the same fitted pipelines
+    artifact, metadata = CrabModelStore(args.model_dir).load(args.model_version)
+    scorer = CrabPredictionCache(artifact, args.cache_entries) if args.cache_entries else CrabAgeScorer(artifact)
+    service = CrabAgeService(scorer, artifact["feature_columns"], args.model, args.host, args.port,
+                             args.max_batch_rows, args.max_wait_ms, metadata["version"], fitted_categories(artifact))
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
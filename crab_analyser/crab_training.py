@@ -0,0 +1,182 @@
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from crab_analyser.crab_metrics import metrics, read_peak_rss
+from crab_analyser.crab_ml import CrabAgePredictor
+
+logger = logging.getLogger('crabdata')
+
+# name -> function that runs one model on a CrabAgePredictor and returns its metrics, see register_model
+MODEL_REGISTRY = {}
+
+
+def register_model(name):
+    """
+    decorator that adds a model to the ones CrabConcurrentTrainer trains
+    the function gets a CrabAgePredictor of the shared data and returns a dict of metrics, it has to be defined at
+    module level so that worker processes can find it when they are spawned instead of forked
+    :param name:
+    :return:
+    """
+    def register(function):
+        MODEL_REGISTRY[name] = function
+        return function
+    return register
+
+
+@register_model("ols")
+def train_ols(ml):
+    ml.ols_prediction()
+    return ml.ols_report
+
+
+@register_model("forest")
+def train_forest(ml):
+    ml.rf_prediction()
+    return dict(ml.forest_report, compiled=ml.compiled_report or None)
+
+
+def share_frame(crab_data, directory):
+    """
+    saves the frame as .npy files that the workers memory map instead of getting a pickled copy
+    consecutive numeric columns of the same dtype go into one 2d block in column major order, which pandas wraps
+    without copying, text and categorical columns are saved as category codes, the categories themselves are small
+    and go with the layout
+    :param crab_data:
+    :param directory:
+    :return: layout of the blocks for load_shared_frame
+    """
+    runs = []
+    for column in crab_data.columns:
+        dtype = crab_data[column].dtype if pd.api.types.is_numeric_dtype(crab_data[column]) else None
+        # np.dtype(None) is float64, so a text column has to be ruled out before comparing dtypes
+        if dtype is not None and runs and runs[-1][0] is not None and runs[-1][0] == dtype:
+            runs[-1][1].append(column)
+        else:
+            runs.append((dtype, [column]))
+    layout = []
+    for b, (dtype, columns) in enumerate(runs):
+        location = os.path.join(directory, "block_{0}.npy".format(b))
+        if dtype is None:
+            column = crab_data[columns[0]]
+            codes, categories = pd.factorize(column)
+            np.save(location, codes)
+            layout.append((columns, location, {"categories": list(categories),
+                                               "categorical": isinstance(column.dtype, pd.CategoricalDtype)}))
+        else:
+            np.save(location, np.asfortranarray(crab_data[columns].to_numpy()))
+            layout.append((columns, location, None))
+    return layout
+
+
+def load_shared_frame(layout):
+    """
+    rebuilds the frame of share_frame, the numeric columns are views of the memory mapped blocks
+    the blocks are mapped copy on write, the workers share their pages until one writes to them, only the text
+    columns are private copies
+    :param layout:
+    :return:
+    """
+    frames = []
+    for columns, location, text in layout:
+        values = np.load(location, mmap_mode="c")
+        if text is None:
+            frames.append(pd.DataFrame(values, columns=columns, copy=False))
+        elif text["categorical"]:
+            frames.append(pd.DataFrame({columns[0]: pd.Categorical.from_codes(values, text["categories"])}))
+        else:
+            # code -1 is a missing value
+            frames.append(pd.DataFrame({columns[0]: np.append(np.array(text["categories"], dtype=object),
+                                                              np.nan)[values]}))
+    # concat keeps the blocks as they are, selecting or inserting columns would copy them
+    return pd.concat(frames, axis=1, copy=False)
+
+
+def read_private_dirty():
+    """
+    bytes this process wrote to itself, the pages it only maps or inherited without writing to them are not counted,
+    None on systems without /proc/self/smaps_rollup
+    :return:
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Private_Dirty:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def train_model(name, layout, predictor_args):
+    """
+    worker function, trains one registered model on the shared data and returns its report
+    :param name: name the model was registered with
+    :param layout: shared columns returned by share_frame
+    :param predictor_args: keyword arguments of CrabAgePredictor
+    :return:
+    """
+    metrics.reset()
+    start, cpu = time.perf_counter(), time.process_time()
+    ml = CrabAgePredictor(load_shared_frame(layout), **predictor_args)
+    model_metrics = MODEL_REGISTRY[name](ml)
+    # the model still holds the frame here, the memory mapped columns it did not write to are not part of it
+    private = read_private_dirty()
+    return {"model": name, "pid": os.getpid(), "wall_seconds": time.perf_counter() - start,
+            "cpu_seconds": time.process_time() - cpu, "peak_rss_mb": read_peak_rss() / 2 ** 20,
+            "private_mb": private / 2 ** 20 if private is not None else None,
+            "metrics": model_metrics, "stages": metrics.records}
+
+
+class CrabConcurrentTrainer:
+    def __init__(self, crab_data, models=None, workers=None, **predictor_args):
+        """
+        trains the registered models at the same time, each on its own process
+        the data is imputed once and its columns are memory mapped by the workers, nothing is pickled but the layout
+        the numeric columns of every worker are views of the same pages, the models still make their own copies of
+        the rows they train on (outlier filter, encoding, train test split), which dominate the memory of a worker
+        :param crab_data: parsed crab data
+        :param models: names of the registered models to train, all of them by default
+        :param workers: number of worker processes, one per model by default
+        :param predictor_args: keyword arguments of CrabAgePredictor, e.g. n_jobs or adaptive_forest
+        """
+        self.crab_data = crab_data
+        self.models = list(models or MODEL_REGISTRY)
+        unknown = [m for m in self.models if m not in MODEL_REGISTRY]
+        if unknown:
+            raise ValueError("Unknown models {0}, expected some of {1}".format(unknown, sorted(MODEL_REGISTRY)))
+        self.workers = workers or len(self.models)
+        self.predictor_args = predictor_args
+        self.report = {}
+        logger.debug("CrabConcurrentTrainer called")
+
+    def run(self):
+        """
+        main entry function for this class
+        returns one report with the timings and metrics of every model
+        :return:
+        """
+        logger.info("training {0} on {1} processes".format(", ".join(self.models), self.workers))
+        start = time.perf_counter()
+        # run() fits the forest on the data ols_prediction imputed in place, so every model gets the imputed data
+        crab_data = self.crab_data.fillna(self.crab_data.mean(numeric_only=True))
+        # the columns go to /dev/shm where it exists, so the workers map memory and not a file on disk
+        shared_root = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        with tempfile.TemporaryDirectory(prefix="crab_training_", dir=shared_root) as directory:
+            layout = share_frame(crab_data, directory)
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = {m: executor.submit(train_model, m, layout, self.predictor_args) for m in self.models}
+                reports = {m: f.result() for m, f in futures.items()}
+        self.report = {"wall_seconds": time.perf_counter() - start, "workers": self.workers, "models": reports}
+        for m, r in reports.items():
+            logger.info("{0}: {1:.2f}s wall, {2:.2f}s cpu, {3:.1f} MB peak, {4:.1f} MB private, {5}".format(
+                m, r["wall_seconds"], r["cpu_seconds"], r["peak_rss_mb"], r["private_mb"] or 0,
+                ", ".join("{0} {1:.4f}".format(k, v) for k, v in r["metrics"].items() if isinstance(v, float))))
+        logger.info("{0} models trained in {1:.2f}s".format(len(reports), self.report["wall_seconds"]))
+        return self.report
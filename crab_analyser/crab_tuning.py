@@ -0,0 +1,155 @@
+import datetime
+import json
+import logging
+import os
+import time
+
+from joblib import Memory
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401, enables the halving searches
+from sklearn.model_selection import HalvingGridSearchCV, HalvingRandomSearchCV, train_test_split
+from sklearn.pipeline import Pipeline
+
+from crab_analyser.crab_ml import OLS_TARGET_TRANSFORMS, CrabAgePredictor, make_target_transformer
+
+logger = logging.getLogger('crabdata')
+
+FOREST_SEARCH_SPACE = {"max_depth": [10, 15, 20, 30, None],
+                       "min_samples_leaf": [1, 2, 4, 8],
+                       "min_samples_split": [2, 4, 8],
+                       "max_features": [1.0, 0.5, "sqrt"]}
+
+
+def load_params(location):
+    """
+    reads the hyperparameters saved by CrabHyperparameterSearch.run, in the form CrabAgePredictor takes them
+    :param location:
+    :return:
+    """
+    with open(location) as f:
+        return {model: search["params"] for model, search in json.load(f)["models"].items()}
+
+
+class CrabHyperparameterSearch:
+    def __init__(self, crab_data, n_jobs=None, cache_dir=".crab_cache/tuning", max_trees=500, factor=3,
+                 cv=3, random_state=100, max_bytes=512 * 1024 * 1024):
+        """
+        successive halving search over the hyperparameters of the forest and the target transform of the linear
+        regression, on the same pipelines and the same train split CrabAgePredictor uses
+        candidates are fitted in parallel, and the fitted preprocessing of the pipelines is cached on disk so it is
+        fitted once per fold and not once per candidate
+        :param crab_data: parsed crab data
+        :param n_jobs: candidates fitted at the same time, -1 uses all the cores
+        :param cache_dir: directory of the cached preprocessing
+        :param max_trees: the forest search uses the number of trees as its budget, the last round fits this many
+        :param factor: only 1/factor of the candidates go on to the next round, with factor times the budget
+        :param cv: folds of the cross validation
+        :param random_state:
+        :param max_bytes: size the cache is trimmed back to after the search, least recently used entries first, like
+        the extraction cache
+        """
+        self.crab_data = crab_data
+        self.n_jobs = n_jobs
+        self.cache_dir = cache_dir
+        self.max_trees = max_trees
+        self.factor = factor
+        self.cv = cv
+        self.random_state = random_state
+        self.max_bytes = max_bytes
+        self.report = {}
+        logger.debug("CrabHyperparameterSearch called")
+
+    def search_forest(self, ml, memory):
+        """
+        halving random search of FOREST_SEARCH_SPACE, every round fits factor times more trees on the survivors
+        the forest is fitted on the data the linear regression imputed, like in CrabAgePredictor.run
+        :param ml: CrabAgePredictor
+        :param memory: joblib.Memory of the preprocessing
+        :return:
+        """
+        X = ml.crab_data.drop("age", axis=1)
+        y = ml.crab_data[["age"]]
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=100)
+        # candidates run in parallel, so every forest uses a single core
+        f_reg_ttr = ml.forest_pipeline(X_train, memory)
+        f_reg_ttr.set_params(regressor__model__n_jobs=1)
+        search = HalvingRandomSearchCV(
+            f_reg_ttr, {"regressor__model__" + k: v for k, v in FOREST_SEARCH_SPACE.items()},
+            n_candidates="exhaust", resource="regressor__model__n_estimators", max_resources=self.max_trees,
+            min_resources=max(1, self.max_trees // self.factor ** 3), factor=self.factor, cv=self.cv,
+            n_jobs=self.n_jobs, random_state=self.random_state)
+        search.fit(X_train, y_train)
+        # the number of trees is the budget of the search, not a tuned value, the saved parameters leave it out
+        params = {k.replace("regressor__model__", ""): v for k, v in search.best_params_.items()
+                  if k != "regressor__model__n_estimators"}
+        return self.summarise(search, params, X_test, y_test)
+
+    def search_ols(self, ml, memory):
+        """
+        halving grid search of the target transforms of the linear regression, every round uses factor times more
+        rows; the one hot encoder is part of the searched pipeline so it is cached together with it
+        :param ml: CrabAgePredictor
+        :param memory: joblib.Memory of the preprocessing
+        :return:
+        """
+        crab_df_woo = ml.pre_process_data()
+        X = crab_df_woo.drop("age", axis=1)
+        y = crab_df_woo[["age"]]
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=100)
+        ohe, t_reg = ml.ols_pipeline()
+        transformers = {name: make_target_transformer(name) for name in OLS_TARGET_TRANSFORMS}
+        search = HalvingGridSearchCV(
+            Pipeline(steps=[('encode', ohe), ('model', t_reg)], memory=memory),
+            {"model__transformer": list(transformers.values())}, factor=self.factor, cv=self.cv,
+            n_jobs=self.n_jobs, random_state=self.random_state)
+        search.fit(X_train, y_train)
+        best = search.best_params_["model__transformer"]
+        params = {"target_transform": [n for n, t in transformers.items() if t is best][0]}
+        return self.summarise(search, params, X_test, y_test)
+
+    def summarise(self, search, params, X_test, y_test):
+        """
+        best parameters of a finished search with its cross validated and held out r-squared
+        :param search:
+        :param params: best parameters in the form CrabAgePredictor takes them
+        :param X_test:
+        :param y_test:
+        :return:
+        """
+        return {"params": params,
+                "cv_r2": float(search.best_score_),
+                "test_r2": float(search.best_estimator_.score(X_test, y_test)),
+                "candidates": int(search.n_candidates_[0]),
+                "rounds": int(search.n_iterations_),
+                "fit_seconds": float(search.cv_results_["mean_fit_time"].sum() * self.cv)}
+
+    def run(self, destination_location):
+        """
+        main entry function for this class
+        searches both models and saves the best parameters as json, ml_engine reads them back with --params_file
+        :param destination_location:
+        :return:
+        """
+        start = time.perf_counter()
+        memory = Memory(self.cache_dir, verbose=0)
+        ml = CrabAgePredictor(self.crab_data.copy())
+        models = {}
+        # the linear regression goes first, its preprocessing imputes the data the forest is fitted on
+        for name, search in [("ols", self.search_ols), ("forest", self.search_forest)]:
+            model_start = time.perf_counter()
+            models[name] = search(ml, memory)
+            models[name]["seconds"] = time.perf_counter() - model_start
+            logger.info("Best {0} parameters: {1}, cross validated R-squared {2:.4f}, test R-squared {3:.4f}, "
+                        "{4} candidates in {5} rounds, {6:.2f}s".format(
+                            name, models[name]["params"], models[name]["cv_r2"], models[name]["test_r2"],
+                            models[name]["candidates"], models[name]["rounds"], models[name]["seconds"]))
+        # every search adds the preprocessing of its data, without this the cache only grows
+        memory.reduce_size(bytes_limit=self.max_bytes)
+        self.report = {"created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                       "seconds": time.perf_counter() - start,
+                       "training_rows": len(self.crab_data),
+                       "max_trees": self.max_trees,
+                       "models": models}
+        with open(destination_location, "w") as f:
+            json.dump(self.report, f, indent=2)
+        logger.info("Tuned parameters saved: {0}".format(os.path.abspath(destination_location)))
+        return self.report
@@ -1,11 +1,14 @@
 # Author: Sheikh Usman Shakeel
-from crab_analyser.crab_pdf_parser_v2 import CrabPDFParser
-from crab_analyser.crab_ml import CrabAgePredictor
+# only the light modules are imported here, every command imports what it needs when it runs so that --help and
+# parse do not pay for sklearn, scipy and category_encoders
+from crab_analyser.crab_columnar import COLUMNAR_FORMATS
+from crab_analyser.crab_dtypes import DTYPE_POLICIES
+from crab_analyser.crab_metrics import metrics
+from crab_analyser.crab_pdf_backends import BACKENDS
 import logging
 import argparse
 import os
 import sys
-import pandas as pd
 
 # set up the logger
 logger = logging.getLogger('crabdata')
@@ -16,55 +19,365 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 ch.setFormatter(formatter)
 logger.addHandler(ch)
 
-def parse_args():
+COMMANDS = ["parse", "run", "train", "predict", "tune", "update"]
+
+
+def legacy_argv(argv):
+    """
+    turns the command line of the old --mode flag into a command, ml_engine.py -i data.pdf --mode train becomes
+    ml_engine.py train -i data.pdf and no command at all is run
+    :param argv:
+    :return:
+    """
+    if not argv or argv[0] in COMMANDS or argv[0] in ("-h", "--help"):
+        return argv
+    argv, command = list(argv), "run"
+    for c, arg in enumerate(argv):
+        if arg == "--mode" and c + 1 < len(argv):
+            command = argv[c + 1]
+            del argv[c:c + 2]
+            break
+        if arg.startswith("--mode="):
+            command = arg.split("=", 1)[1]
+            del argv[c]
+            break
+    return [command] + argv
+
+
+def parse_args(argv=None):
     """
-    sets up command line parameters
+    sets up command line parameters, one command per step of the pipeline
     destination file only saves the clean crab data set
 
+    :param argv: defaults to sys.argv
     :return:
     """
     # this can be extended to include output locations for other csv files in the crab_ml script but
     #     i couldn't implement and test it due to time constraints
     #
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-i", "--input_file", help="complete location of the input pdf file", required=True)
-    parser.add_argument("-d", "--destination_file", help="complete location where output csv file will be created",
-                        required=False)
-    args = parser.parse_args()
-    input_file = None
-    output_file_location = None
-    if args.input_file:
-        input_file = args.input_file
-    if args.destination_file:
-        output_file_location = args.destination_file
+    argv = legacy_argv(sys.argv[1:] if argv is None else argv)
 
-    return input_file, output_file_location
+    # arguments of the parsing, every command starts by parsing the pdf
+    parsing = argparse.ArgumentParser(add_help=False)
+    inputs = parsing.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("-i", "--input_file", help="complete location of the input pdf file")
+    inputs.add_argument("--input_dir", help="directory of pdf files that are parsed in parallel and merged into a "
+                                            "single data set with a source_file column")
+    parsing.add_argument("-d", "--destination_file", help="complete location where output csv file will be created",
+                         required=False)
+    parsing.add_argument("--streaming", action="store_true",
+                         help="parse the pdf page by page and write the csv file in chunks to keep memory bounded")
+    parsing.add_argument("--chunk_size", type=int, default=10000,
+                         help="number of rows per csv chunk when --streaming or --out_of_core is used")
+    parsing.add_argument("--shards", type=int, default=None,
+                         help="split the pdf into this many page ranges that are parsed on separate processes, "
+                              "pypdf is needed to count and split the pages")
+    parsing.add_argument("--workers", type=int, default=None,
+                         help="number of worker processes used with --input_dir, defaults to the number of cpus")
+    parsing.add_argument("--report_file", default="crab_batch_report.csv",
+                         help="csv file with the per file row counts, dirty row counts and timings of --input_dir")
+    parsing.add_argument("--backend", choices=sorted(BACKENDS), default="tika",
+                         help="pdf text backend, pypdf runs in process and avoids starting the tika JVM")
+    parsing.add_argument("--no-cache", dest="no_cache", action="store_true",
+                         help="always parse the pdf files instead of loading unchanged ones from the extraction "
+                              "cache")
+    parsing.add_argument("--cache_dir", default=".crab_cache", help="directory of the extraction cache")
+    parsing.add_argument("--cache_size_mb", type=int, default=512,
+                         help="size the extraction cache is trimmed back to, least recently used entries go first")
+    parsing.add_argument("--columnar", choices=sorted(COLUMNAR_FORMATS), default=None,
+                         help="also save the parsed data and the predictions as feather or parquet files with "
+                              "compact dtypes and report their size and load time next to the csv files")
+    parsing.add_argument("--dtype_policy", choices=sorted(DTYPE_POLICIES), default="wide",
+                         help="dtypes of the data handed from the parser to the models, compact uses float32 "
+                              "measurements, uint8 age and categorical sex to halve their memory, the prediction csv "
+                              "files of the run command are then written from the float32 values too")
+    parsing.add_argument("--metrics-out", dest="metrics_out", default=None,
+                         help="json file with the wall time, cpu time, peak memory and rows of every stage of the "
+                              "run")
+    parsing.add_argument("--profile-stage", dest="profile_stage", default=None,
+                         help="run one stage under cProfile, e.g. parse.decode or ml.forest.fit")
+    parsing.add_argument("--profile-out", dest="profile_out", default="crab_stage.prof",
+                         help="file the profile of --profile-stage is saved to, it can be read with pstats")
+    pipelined = argparse.ArgumentParser(add_help=False)
+    pipelined.add_argument("--pipelined", action="store_true",
+                           help="score the parsed rows in batches while later pages are still being parsed instead "
+                                "of reading the csv file back, the csv file is still written")
 
+    # arguments of fitting the models
+    fitting = argparse.ArgumentParser(add_help=False)
+    fitting.add_argument("--n_jobs", type=int, default=None,
+                         help="cores used to train and score the random forest, -1 uses all of them")
+    fitting.add_argument("--adaptive_forest", action="store_true",
+                         help="grow the random forest until its out of bag error converges instead of always "
+                              "fitting 5000 trees")
+    fitting.add_argument("--compare_fixed_forest", action="store_true",
+                         help="with --adaptive_forest, also fit the fixed 5000 tree forest and report the "
+                              "difference")
+    fitting.add_argument("--compile_forest", action="store_true",
+                         help="compile the random forest into flat arrays, run reports its memory and throughput "
+                              "against sklearn and train stores it in the artifact")
+    fitting.add_argument("--params_file", default=None,
+                         help="json file of tuned hyperparameters written by the tune command")
+    store = argparse.ArgumentParser(add_help=False)
+    store.add_argument("--model_dir", default="models", help="directory of the versioned model artifacts")
+    store.add_argument("--model_version", type=int, default=None,
+                       help="artifact version to load, defaults to the latest one")
 
-if __name__ == "__main__":
-    input_file, output_file = parse_args()
+    parser = argparse.ArgumentParser(description="extracts the crab survey from a pdf file and predicts the age of "
+                                                 "the crabs")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+    # fitting needs every row before it can start, only predict overlaps the models with the parsing
+    parser.set_defaults(pipelined=False)
+    commands.add_parser("parse", parents=[parsing], help="only parse the pdf and save the csv file")
+    run = commands.add_parser("run", parents=[parsing, fitting],
+                              help="fit and evaluate both models")
+    run.add_argument("--concurrent_models", nargs="*", default=None,
+                     help="train the given models (ols, forest, all of them without a name) at the same time on "
+                          "separate processes that memory map the data")
+    run.add_argument("--out_of_core", action="store_true",
+                     help="only fit the linear regression and read the csv file in chunks so memory does not grow "
+                          "with the number of rows")
+    commands.add_parser("train", parents=[parsing, fitting, store],
+                        help="fit both models and save them as a versioned artifact")
+    predict = commands.add_parser("predict", parents=[parsing, pipelined, store],
+                                  help="score the pdf with a saved artifact without refitting")
+    predict.add_argument("--model", choices=["forest", "compiled", "ols"], default="forest",
+                         help="model used to score, compiled scores with the flat array copy of the forest")
+    predict.add_argument("--prediction_file", default="crab_predicted_age.csv",
+                         help="csv file written in the output format of the README")
+    predict.add_argument("--model_columns", nargs="*", choices=["forest", "compiled", "ols"], default=None,
+                         help="models that also get their own predicted age and percentage difference columns, the "
+                              "csv file is scored --chunk_size rows at a time")
+    predict.add_argument("--cache_entries", type=int, default=100000,
+                         help="rows with the same measurements are scored once, predictions of this many unique rows "
+                              "are kept between batches, 0 turns the prediction cache off")
+    predict.add_argument("--queue_size", type=int, default=4,
+                         help="parsed batches of --chunk_size rows that can wait for the model with --pipelined, "
+                              "batches are scored while later pages are still being parsed")
+    tune = commands.add_parser("tune", parents=[parsing],
+                               help="search the hyperparameters of both models and save the best ones")
+    tune.add_argument("--n_jobs", type=int, default=None, help="candidates fitted at the same time")
+    tune.add_argument("--params_file", default="crab_params.json", help="json file the best parameters are saved to")
+    tune.add_argument("--tune_max_trees", type=int, default=500,
+                      help="trees of the last round of the forest search")
+    update = commands.add_parser("update", parents=[parsing, fitting, store],
+                                 help="add the rows of a new pdf to a saved artifact and save it as a new version")
+    update.add_argument("--drift_tolerance", type=float, default=0.05,
+                        help="both models are fitted again on all the rows when the r-squared of one drops by more "
+                             "than this on the new rows")
+    args = parser.parse_args(argv)
+    if args.pipelined and (args.input_dir or args.streaming):
+        parser.error("--pipelined does not work with --input_dir or --streaming")
+    if getattr(args, "model_columns", None) and args.pipelined:
+        parser.error("--model_columns does not work with --pipelined")
+    if args.columnar and args.streaming:
+        parser.error("--columnar does not work with --streaming")
+    if args.shards and (args.input_dir or args.streaming or args.pipelined):
+        parser.error("--shards does not work with --input_dir, --streaming or --pipelined")
+    return args
+
+
+def parse_pdf(args, output_file):
+    """
+    parses the pdf file or the directory of pdf files and saves the csv file
+    :param args:
+    :param output_file:
+    :return: the parser
+    """
+    from crab_analyser.crab_batch import CrabBatchParser
+    from crab_analyser.crab_extraction_cache import CrabExtractionCache
+    from crab_analyser.crab_pdf_backends import get_backend
+    from crab_analyser.crab_pdf_parser_v2 import CrabPDFParser
+
+    cache = None
+    if not args.no_cache:
+        cache = CrabExtractionCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+    if args.input_dir:
+        # parse all the pdf files of the directory in parallel and save the merged csv file
+        CrabBatchParser(args.input_dir, output_file, args.report_file, args.workers, cache,
+                        get_backend(args.backend), args.columnar).process()
+        return None
+    # streaming never materialises the whole frame, so it always parses and does not use the cache
+    crab_data_parser = CrabPDFParser(args.input_file, output_file, cache, get_backend(args.backend), args.columnar,
+                                     args.shards, args.dtype_policy)
+    if args.streaming:
+        crab_data_parser.process_streaming(args.chunk_size)
+    elif not args.pipelined:
+        # with --pipelined the parsing runs together with the scoring in predict_age
+        crab_data_parser.process()
+    return crab_data_parser
+
+
+def predict_age(args, output_file, crab_data_parser):
+    """
+    scores the parsed data with a saved artifact
+    :param args:
+    :param output_file:
+    :param crab_data_parser: parser of the pdf, --pipelined runs it here
+    :return:
+    """
+    from crab_analyser.crab_ml import CrabAgeScorer
+    from crab_analyser.crab_model_store import CrabModelStore
+    from crab_analyser.crab_prediction_cache import CrabPredictionCache
+    from crab_analyser.crab_scoring_writer import CrabScoringWriter
+
+    artifact, metadata = CrabModelStore(args.model_dir).load(args.model_version)
+    scorer = CrabPredictionCache(artifact, args.cache_entries) if args.cache_entries else CrabAgeScorer(artifact)
+    if args.pipelined:
+        from crab_analyser.crab_pipeline import CrabPipeline
+
+        with metrics.stage("pipeline"):
+            CrabPipeline(crab_data_parser, scorer, args.model, args.chunk_size, args.queue_size).run(
+                args.prediction_file)
+    else:
+        CrabScoringWriter(scorer, args.model, args.model_columns, args.chunk_size).write(output_file,
+                                                                                         args.prediction_file)
+    if args.cache_entries:
+        stats = scorer.stats()
+        logger.info("Prediction cache: {0} of {1} rows scored by the model, hit rate {2:.1%}".format(
+            stats["misses"], stats["rows"], stats["hit_rate"] or 0))
+
+
+def read_history_rows(output_file):
+    """
+    the parsed rows at the precision of the csv file, the history the update command refits on is written from them
+    and not from the frame of the models, which holds float32 values under the compact dtype policy
+    :param output_file:
+    :return:
+    """
+    import pandas as pd
+
+    return pd.read_csv(output_file).drop(columns=["source_file"], errors="ignore")
+
+
+def fit_models(args, output_file):
+    """
+    fits the models of the run, train, tune and update commands on the rows of the csv file
+    :param args:
+    :param output_file:
+    :return: report of the concurrent training, if there was one
+    """
+    if getattr(args, "out_of_core", False):
+        from crab_analyser.crab_incremental_ols import CrabIncrementalOLS
+
+        # the forest needs all the rows in memory, only the linear regression is fitted out of core
+        CrabIncrementalOLS(output_file, args.chunk_size).run()
+        return None
+    import pandas as pd
+
+    from crab_analyser.crab_dtypes import apply_dtype_policy, csv_dtypes
+
+    # the source file is only kept in the csv file, it is not a feature of the models
+    with metrics.stage("ml.read_csv") as stage:
+        crab_data = pd.read_csv(output_file, dtype=csv_dtypes(args.dtype_policy)).drop(columns=["source_file"],
+                                                                                       errors="ignore")
+        crab_data = apply_dtype_policy(crab_data, args.dtype_policy)
+        stage["rows"] = len(crab_data)
+    metrics.frame("ml.read_csv", crab_data)
+    if args.command == "tune":
+        from crab_analyser.crab_tuning import CrabHyperparameterSearch
+
+        CrabHyperparameterSearch(crab_data, args.n_jobs, os.path.join(args.cache_dir, "tuning"), args.tune_max_trees,
+                                 max_bytes=args.cache_size_mb * 1024 * 1024).run(args.params_file)
+        return None
+    from crab_analyser.crab_ml import CrabAgePredictor
+    from crab_analyser.crab_tuning import load_params
+
+    params = load_params(args.params_file) if args.params_file else None
+    if getattr(args, "concurrent_models", None) is not None:
+        from crab_analyser.crab_training import CrabConcurrentTrainer
+
+        return CrabConcurrentTrainer(
+            crab_data, args.concurrent_models, n_jobs=args.n_jobs, adaptive_forest=args.adaptive_forest,
+            compare_fixed_forest=args.compare_fixed_forest, compile_forest=args.compile_forest,
+            columnar_format=args.columnar, params=params, dtype_policy=args.dtype_policy).run()
+    ml = CrabAgePredictor(crab_data, args.n_jobs, args.adaptive_forest, args.compare_fixed_forest,
+                          args.compile_forest, args.columnar, params, args.dtype_policy)
+    if args.command == "train":
+        from crab_analyser.crab_model_store import CrabModelStore
+
+        store = CrabModelStore(args.model_dir)
+        os.makedirs(args.model_dir, exist_ok=True)
+        # the update command appends to the rows the models were trained on, fit_ols imputes crab_data in place
+        read_history_rows(output_file).to_csv(store.history_location(), index=False)
+        store.save(ml.train(), {"training_data": os.path.abspath(output_file)})
+    elif args.command == "update":
+        from crab_analyser.crab_model_store import CrabModelStore
+
+        store = CrabModelStore(args.model_dir)
+        artifact, metadata = store.load(args.model_version)
+        store.save(ml.update(artifact, store.history_location(), args.drift_tolerance,
+                             history_data=read_history_rows(output_file)),
+                   {"training_data": os.path.abspath(output_file), "updated_from": metadata["version"]})
+    else:
+        ml.run()
+    return None
+
+
+def compare_columnar(output_file, columnar_format):
+    """
+    reports the size and load time of the columnar copies next to their csv files
+    :param output_file:
+    :param columnar_format:
+    :return:
+    """
+    from crab_analyser.crab_columnar import columnar_location, compare_with_csv
+
+    for csv_file in [output_file, "crab_predit_ols.csv", "crab_predit_forest.csv"]:
+        columnar_file = columnar_location(csv_file, columnar_format)
+        if os.path.exists(columnar_file):
+            compare_with_csv(csv_file, columnar_file)
+    # readers that only need a few columns do not load the others
+    compare_with_csv(output_file, columnar_location(output_file, columnar_format), ["sex", "age"])
+
+
+def main(argv=None):
+    """
+    entry point of the command line
+    :param argv: defaults to sys.argv
+    :return:
+    """
+    args = parse_args(argv)
+    output_file = args.destination_file
+    if args.profile_stage:
+        metrics.profile(args.profile_stage, args.profile_out)
+    status = "failed"
+    training_report = None
 
     try:
         logger.info("main called")
         # input_file, output_file = "data.pdf", None
         if not output_file:
             output_file = "crab_data.csv"
-        if not os.path.exists(input_file):
+        if not os.path.exists(args.input_dir or args.input_file):
             logger.critical("please provide a valid input path")
             logger.critical("exiting execution")
             sys.exit(1)
-        # parse the pdf file and save the csv file
-        crab_data_parser = CrabPDFParser(input_file, output_file)
-        crab_data_parser.process()
+        crab_data_parser = parse_pdf(args, output_file)
         logger.info("data extraction complete")
-        logger.info("starting crab age prediction")
-        ml = CrabAgePredictor(pd.read_csv(output_file))
-        ml.run()
-        logger.info("crab age prediction finished")
+        if args.command != "parse":
+            logger.info("starting crab age prediction")
+            if args.command == "predict":
+                predict_age(args, output_file, crab_data_parser)
+            else:
+                training_report = fit_models(args, output_file)
+            logger.info("crab age prediction finished")
+        if args.columnar:
+            compare_columnar(output_file, args.columnar)
+        metrics.log_memory()
         logger.info("main execution finished successfully")
+        status = "succeeded"
 
     except:
         logger.critical("Exception occurred.", exc_info=True)
         sys.exit(1)
+    finally:
+        # failed runs are written too, the stages that finished show where the time went
+        if args.metrics_out:
+            metrics.write(args.metrics_out, argv=sys.argv[1:] if argv is None else argv, mode=args.command,
+                          status=status, training=training_report)
 
 
+if __name__ == "__main__":
+    main()
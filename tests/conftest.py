@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# standard deviation of the measurement noise added to the columns that are derived from the length
+NOISE = {"diameter": 0.05, "height": 0.05, "weight": 1.0, "shucked_weight": 1.0, "viscera_weight": 0.5,
+         "shell_weight": 0.5}
+
+
+def synthetic_crab_data(rows=200, seed=100, noise=False, dirty=False):
+    """
+    synthetic crab survey with the columns of the parser output, the age grows with the length
+    :param rows:
+    :param seed:
+    :param noise: adds measurement noise to the columns derived from the length
+    :param dirty: a few missing measurements and an outlier, like in the parsed pdf
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    length = rng.uniform(0.5, 2.0, rows)
+    crab_data = pd.DataFrame({"sex": rng.choice(["F", "M", "I"], rows), "length": length,
+                              "diameter": length * 0.8, "height": length * 0.3, "weight": length ** 3 * 10,
+                              "shucked_weight": length ** 3 * 4, "viscera_weight": length ** 3 * 2,
+                              "shell_weight": length ** 3 * 3})
+    if noise:
+        for column, scale in NOISE.items():
+            crab_data[column] += rng.normal(0, scale, rows)
+    crab_data["age"] = np.rint(length * 8 + rng.normal(0, 1, rows)).astype(int)
+    if dirty:
+        crab_data.loc[[3, rows // 2], "weight"] = np.nan
+        crab_data.loc[rows // 3, "height"] = 25.0
+    return crab_data
+
+
+@pytest.fixture
+def make_crab_data():
+    """
+    factory of synthetic crab surveys, the tests pick the rows, seed, noise and dirt they need
+    :return:
+    """
+    return synthetic_crab_data
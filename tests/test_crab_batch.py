@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from mock import patch
+
+import crab_analyser.crab_batch
+
+
+def fake_extract(self):
+    if self.source_location.endswith("broken.pdf"):
+        raise RuntimeError("Number of feature rows does not match")
+    self.dirty_rows.append("omg such dirty data")
+    return pd.DataFrame({"sex": ["F"], "length": [1.0], "age": [len(self.source_location)]})
+
+
+class TestCrabBatchParser:
+    def test_list_source_files(self, tmp_path):
+        # Arrange
+        for name in ["b.pdf", "a.PDF", "notes.txt"]:
+            (tmp_path / name).write_text("")
+        batch_parser = crab_analyser.crab_batch.CrabBatchParser(str(tmp_path), "")
+
+        # Act
+        ret_val = batch_parser.list_source_files()
+
+        # Assert
+        assert ret_val == [str(tmp_path / "a.PDF"), str(tmp_path / "b.pdf")]
+
+    @patch("crab_analyser.crab_batch.ProcessPoolExecutor", ThreadPoolExecutor)
+    @patch("crab_analyser.crab_batch.CrabPDFParser.extract", fake_extract)
+    def test_process(self, tmp_path):
+        # Arrange
+        for name in ["second.pdf", "broken.pdf", "first.pdf"]:
+            (tmp_path / name).write_text("")
+        destination = tmp_path / "merged.csv"
+        batch_parser = crab_analyser.crab_batch.CrabBatchParser(str(tmp_path), str(destination), workers=2)
+
+        # Act
+        report = batch_parser.process()
+
+        # Assert
+        merged = pd.read_csv(destination)
+        assert merged["source_file"].tolist() == ["first.pdf", "second.pdf"]
+        assert report["source_file"].tolist() == ["broken.pdf", "first.pdf", "second.pdf"]
+        assert report["dirty_rows"].tolist() == [0, 1, 1]
+        assert report["error"].notna().tolist() == [True, False, False]
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import crab_analyser.crab_columnar
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def crab_data(make_crab_data):
+    crab_data = make_crab_data(rows=4)
+    # a row with a missing length and age, the age becomes a float column like in the parsed csv
+    crab_data.loc[2, ["length", "age"]] = np.nan
+    return crab_data
+
+
+class TestCrabColumnar:
+    @pytest.mark.parametrize("columnar_format", ["feather", "parquet"])
+    def test_round_trip(self, tmp_path, columnar_format, crab_data):
+        # Arrange
+        location = crab_analyser.crab_columnar.columnar_location(str(tmp_path / "crab_data.csv"), columnar_format)
+
+        # Act
+        crab_analyser.crab_columnar.write_columnar(crab_data, location, columnar_format)
+        subset = crab_analyser.crab_columnar.read_columnar(location, ["sex", "age"])
+        full = crab_analyser.crab_columnar.read_columnar(location)
+
+        # Assert
+        assert location.endswith("crab_data." + columnar_format)
+        assert list(subset.columns) == ["sex", "age"]
+        assert subset["sex"].astype(str).tolist() == crab_data["sex"].tolist()
+        np.testing.assert_allclose(full["weight"].to_numpy(), crab_data["weight"], rtol=1e-6)
+        assert full["age"].tolist()[:2] == crab_data["age"].tolist()[:2]
+
+    def test_compare_with_csv(self, tmp_path, crab_data):
+        # Arrange
+        csv_location = str(tmp_path / "crab_data.csv")
+        crab_data.to_csv(csv_location, index=False)
+        location = str(tmp_path / "crab_data.feather")
+        crab_analyser.crab_columnar.write_columnar(crab_data, location, "feather")
+
+        # Act
+        report = crab_analyser.crab_columnar.compare_with_csv(csv_location, location, ["age"], repeat=1)
+
+        # Assert
+        assert report["csv_bytes"] > 0
+        assert report["columnar_bytes"] > 0
+        assert report["columnar_load_seconds"] > 0
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import crab_analyser.crab_dtypes
+
+
+class TestCrabDtypes:
+    def test_apply_dtype_policy(self):
+        # Arrange
+        crab_data = pd.DataFrame({"sex": ["F", "M", "I"], "length": [1.5, np.nan, 1.0], "weight": [3.0, 1.0, 2.0],
+                                  "age": [9, 5, 7], "source_file": ["a.pdf"] * 3})
+
+        # Act
+        ret_val = crab_analyser.crab_dtypes.apply_dtype_policy(crab_data, "compact")
+
+        # Assert
+        assert ret_val.dtypes.astype(str).to_dict() == {"sex": "category", "length": "float32", "weight": "float32",
+                                                        "age": "int8", "source_file": "category"}
+        assert ret_val["age"].tolist() == [9, 5, 7]
+        assert crab_data["length"].dtype == np.float64
+        assert crab_analyser.crab_dtypes.apply_dtype_policy(crab_data, "wide") is crab_data
+
+    def test_age_dtype(self):
+        # Arrange
+        crab_data = pd.DataFrame({"age": [9, np.nan, 300]})
+
+        # Act
+        ret_val = crab_analyser.crab_dtypes.apply_dtype_policy(crab_data, "compact")
+
+        # Assert
+        assert ret_val["age"].dtype == np.float64
+        assert crab_analyser.crab_dtypes.apply_dtype_policy(crab_data.fillna(5), "compact")["age"].dtype == np.int16
+        assert crab_analyser.crab_dtypes.apply_dtype_policy(crab_data.fillna(40000), "compact")["age"].dtype == \
+            np.float64
+        assert crab_analyser.crab_dtypes.age_dtype(pd.Series([1.5, 2.0]), "compact") == np.float32
+        assert crab_analyser.crab_dtypes.age_dtype(crab_data["age"], "wide", nullable=True) == "Int64"
+
+    def test_nullable_age(self, make_crab_data):
+        # Arrange
+        crab_data = make_crab_data(rows=4)
+        # a row with a missing length and age, the age becomes a float column like in the parsed csv
+        crab_data.loc[2, ["length", "age"]] = np.nan
+
+        # Act
+        compact = crab_analyser.crab_dtypes.apply_dtype_policy(crab_data, "compact", nullable_age=True)
+
+        # Assert
+        assert compact["sex"].dtype == "category"
+        assert compact["length"].dtype == np.float32
+        assert compact["age"].dtype == "Int8"
+        assert compact["age"].isna().tolist() == [False, False, True, False]
+        assert crab_data["age"].dtype == np.float64
+
+    def test_csv_dtypes(self):
+        # Act
+        ret_val = crab_analyser.crab_dtypes.csv_dtypes("compact")
+
+        # Assert
+        assert ret_val["sex"] == "category"
+        assert ret_val["shell_weight"] == np.float32
+        assert "age" not in ret_val
+        assert ret_val["source_file"] == "category"
+        with pytest.raises(ValueError):
+            crab_analyser.crab_dtypes.csv_dtypes("tiny")
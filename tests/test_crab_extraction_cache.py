@@ -0,0 +1,72 @@
+import os
+
+import pandas as pd
+from mock import patch
+
+import crab_analyser.crab_extraction_cache
+import crab_analyser.crab_pdf_parser_v2
+
+
+class TestCrabExtractionCache:
+    def test_key(self, tmp_path):
+        # Arrange
+        first = tmp_path / "first.pdf"
+        copy = tmp_path / "copy.pdf"
+        first.write_bytes(b"crabs")
+        copy.write_bytes(b"crabs")
+        cache = crab_analyser.crab_extraction_cache.CrabExtractionCache(str(tmp_path / "cache"))
+
+        # Act / Assert
+        assert cache.key(str(first), "1") == cache.key(str(copy), "1")
+        assert cache.key(str(first), "1") != cache.key(str(first), "2")
+
+    def test_put_get(self, tmp_path):
+        # Arrange
+        frame = pd.DataFrame({"sex": ["F"], "length": [1.5], "age": [5]})
+        cache = crab_analyser.crab_extraction_cache.CrabExtractionCache(str(tmp_path))
+
+        # Act
+        missing = cache.get("key")
+        cache.put("key", frame, ["omg such dirty data"])
+        cached_frame, dirty_rows = cache.get("key")
+
+        # Assert
+        assert missing is None
+        pd.testing.assert_frame_equal(cached_frame, frame)
+        assert dirty_rows == ["omg such dirty data"]
+
+    def test_evict(self, tmp_path):
+        # Arrange
+        frame = pd.DataFrame({"length": [1.5] * 100})
+        cache = crab_analyser.crab_extraction_cache.CrabExtractionCache(str(tmp_path))
+        cache.put("old", frame, [])
+        cache.put("used", frame, [])
+        os.utime(cache.entry_location("old"), (1, 1))
+        os.utime(cache.entry_location("used"), (2, 2))
+        cache.get("used")
+        cache.max_bytes = 2 * os.path.getsize(cache.entry_location("used"))
+
+        # Act
+        cache.put("new", frame, [])
+
+        # Assert
+        assert cache.get("old") is None
+        assert cache.get("used") is not None
+        assert cache.get("new") is not None
+
+    @patch("crab_analyser.crab_pdf_parser_v2.CrabPDFParser.parse_document")
+    def test_parser_extract_uses_cache(self, mock_parse_document, tmp_path):
+        # Arrange
+        source = tmp_path / "data.pdf"
+        source.write_bytes(b"crabs")
+        frame = pd.DataFrame({"sex": ["F"], "length": [1.5], "age": [5]})
+        mock_parse_document.return_value = frame
+        cache = crab_analyser.crab_extraction_cache.CrabExtractionCache(str(tmp_path / "cache"))
+
+        # Act
+        first = crab_analyser.crab_pdf_parser_v2.CrabPDFParser(str(source), "", cache).extract()
+        second = crab_analyser.crab_pdf_parser_v2.CrabPDFParser(str(source), "", cache).extract()
+
+        # Assert
+        mock_parse_document.assert_called_once_with()
+        pd.testing.assert_frame_equal(first, second)
@@ -0,0 +1,77 @@
+import numpy as np
+from mock import patch
+from sklearn.compose import TransformedTargetRegressor, make_column_transformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, RobustScaler
+
+import crab_analyser.crab_forest_compiler
+
+
+def fit_small_forest(make_crab_data, rows=300):
+    # same pipeline as CrabAgePredictor.fit_forest with fewer trees
+    crab_data = make_crab_data(rows=rows, noise=True)
+    X = crab_data[["sex", "length", "weight"]]
+    y = crab_data[["age"]]
+    numerical_features = X.dtypes == 'float'
+    preprocess = make_column_transformer((RobustScaler(), numerical_features),
+                                         (OneHotEncoder(), ~numerical_features))
+    forest = RandomForestRegressor(n_estimators=25, max_depth=20, min_samples_leaf=2, min_samples_split=4,
+                                   random_state=100)
+    f_reg_ttr = TransformedTargetRegressor(regressor=Pipeline(steps=[('preprocess', preprocess), ('model', forest)]))
+    return f_reg_ttr.fit(X, y), X
+
+
+class TestCompiledForest:
+    def test_sibling_order(self):
+        # Arrange
+        # 0 -> (1, 2), 1 -> (3, 4)
+        children_left = np.array([1, 3, -1, -1, -1])
+        children_right = np.array([2, 4, -1, -1, -1])
+
+        # Act
+        order = crab_analyser.crab_forest_compiler.CompiledForest.sibling_order(children_left, children_right)
+
+        # Assert
+        assert list(order) == [0, 1, 2, 3, 4]
+
+    def test_predict(self, make_crab_data):
+        # Arrange
+        f_reg_ttr, X = fit_small_forest(make_crab_data)
+
+        # Act
+        compiled = crab_analyser.crab_forest_compiler.CompiledForest.compile(f_reg_ttr)
+
+        # Assert
+        assert compiled.feature.dtype == np.int32
+        assert compiled.threshold.dtype == np.float32
+        assert compiled.value.dtype == np.float32
+        assert len(compiled.roots) == 25
+        np.testing.assert_allclose(compiled.predict(X), f_reg_ttr.predict(X).ravel(), atol=1e-4)
+
+    def test_predict_in_blocks(self, make_crab_data):
+        # Arrange
+        f_reg_ttr, X = fit_small_forest(make_crab_data)
+        compiled = crab_analyser.crab_forest_compiler.CompiledForest.compile(f_reg_ttr)
+        expected = compiled.predict(X)
+
+        # Act
+        with patch("crab_analyser.crab_forest_compiler.EVALUATION_BLOCK", 25 * 7):
+            predicted = compiled.predict(X)
+
+        # Assert
+        np.testing.assert_allclose(predicted, expected)
+
+    def test_compare(self, make_crab_data):
+        # Arrange
+        f_reg_ttr, X = fit_small_forest(make_crab_data)
+        compiled = crab_analyser.crab_forest_compiler.CompiledForest.compile(f_reg_ttr)
+
+        # Act
+        report = compiled.compare(f_reg_ttr, X, repeat=1)
+
+        # Assert
+        assert report["trees"] == 25
+        assert report["compiled_bytes"] < report["sklearn_bytes"]
+        assert report["max_abs_difference"] < 1e-4
+        assert report["compiled_rows_per_second"] > 0
@@ -0,0 +1,64 @@
+import category_encoders as ce
+import numpy as np
+import pandas as pd
+from sklearn import linear_model
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.preprocessing import QuantileTransformer
+
+import crab_analyser.crab_incremental_ols
+import crab_analyser.crab_ml
+
+
+class TestCrabIncrementalOLS:
+    def test_same_fit_as_in_memory(self, tmp_path, make_crab_data):
+        # Arrange
+        location = str(tmp_path / "crab_data.csv")
+        crab_data = make_crab_data(rows=600, noise=True, dirty=True)
+        crab_data.to_csv(location, index=False)
+        crab_df_woo = crab_analyser.crab_ml.CrabAgePredictor(crab_data).pre_process_data()
+        crab_df_woo_enc = ce.OneHotEncoder(handle_unknown='ignore', use_cat_names=True,
+                                           drop_invariant=True).fit_transform(crab_df_woo)
+        X = crab_df_woo_enc.drop("age", axis=1)
+        y = crab_df_woo_enc[["age"]]
+        test = crab_analyser.crab_incremental_ols.holdout_mask(0, len(X), 0.2, 100)
+        t_reg = TransformedTargetRegressor(regressor=linear_model.LinearRegression(),
+                                           transformer=QuantileTransformer(output_distribution='normal'))
+        t_reg.fit(X[~test], y[~test])
+
+        # Act
+        model = crab_analyser.crab_incremental_ols.CrabIncrementalOLS(location, chunk_size=64).fit()
+        s = model.score(str(tmp_path / "crab_predit_ols.csv"))
+
+        # Assert
+        coef = pd.Series(t_reg.regressor_.coef_.ravel(), index=X.columns)[model.feature_columns]
+        np.testing.assert_allclose(model.coef_, coef, atol=1e-9)
+        np.testing.assert_allclose(model.intercept_, np.ravel(t_reg.regressor_.intercept_), atol=1e-9)
+        assert model.training_rows == (~test).sum()
+        assert np.isclose(s, t_reg.score(X[test], y[test]))
+        predictions = pd.read_csv(str(tmp_path / "crab_predit_ols.csv"))
+        assert len(predictions) == len(X)
+        np.testing.assert_allclose(predictions["age_ols"], t_reg.predict(X).ravel(), atol=1e-9)
+
+    def test_weighted_percentiles(self):
+        # Arrange
+        values = np.array([3.0, 5.0, 6.0, 11.0])
+        counts = np.array([4, 1, 7, 2])
+        references = np.linspace(0, 1, 14)
+
+        # Act
+        quantiles = crab_analyser.crab_incremental_ols.weighted_percentiles(values, counts, references)
+
+        # Assert
+        np.testing.assert_array_equal(quantiles, np.nanpercentile(np.repeat(values, counts), references * 100))
+
+    def test_holdout_mask_independent_of_chunks(self):
+        # Arrange
+        whole = crab_analyser.crab_incremental_ols.holdout_mask(0, 1000, 0.2, 100)
+
+        # Act
+        chunked = np.concatenate([crab_analyser.crab_incremental_ols.holdout_mask(s, s + 100, 0.2, 100)
+                                  for s in range(0, 1000, 100)])
+
+        # Assert
+        np.testing.assert_array_equal(whole, chunked)
+        assert 0.15 < whole.mean() < 0.25
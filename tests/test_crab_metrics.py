@@ -0,0 +1,99 @@
+import json
+import pstats
+
+import numpy as np
+import pandas as pd
+
+import crab_analyser.crab_metrics
+
+
+class TestCrabMetrics:
+    def test_nested_stages(self):
+        # Arrange
+        metrics = crab_analyser.crab_metrics.CrabMetrics()
+
+        # Act
+        with metrics.stage("parse") as stage:
+            with metrics.stage("parse.read_pdf", rows=10):
+                pass
+            with metrics.stage("parse.decode"):
+                # about 80 MB that are freed again before the stage ends
+                block = np.ones(10 * 2 ** 20)
+                del block
+            stage["rows"] = 5
+
+        # Assert
+        records = {r["stage"]: r for r in metrics.records}
+        assert [r["stage"] for r in metrics.records] == ["parse.read_pdf", "parse.decode", "parse"]
+        assert records["parse.read_pdf"]["parent"] == "parse"
+        assert records["parse"]["parent"] is None
+        assert records["parse.read_pdf"]["rows"] == 10
+        assert records["parse"]["rows"] == 5
+        assert records["parse"]["wall_seconds"] >= records["parse.decode"]["wall_seconds"]
+        assert records["parse"]["peak_rss_mb"] >= records["parse.decode"]["peak_rss_mb"]
+        assert records["parse.decode"]["peak_rss_mb"] >= 80
+
+    def test_stage_recorded_on_exception(self):
+        # Arrange
+        metrics = crab_analyser.crab_metrics.CrabMetrics()
+
+        # Act
+        try:
+            with metrics.stage("ml.forest.fit"):
+                raise ValueError("failed")
+        except ValueError:
+            pass
+
+        # Assert
+        assert [r["stage"] for r in metrics.records] == ["ml.forest.fit"]
+        assert metrics.stack == []
+
+    def test_profile_stage(self, tmp_path):
+        # Arrange
+        metrics = crab_analyser.crab_metrics.CrabMetrics()
+        profile_location = str(tmp_path / "stage.prof")
+        metrics.profile("ml.ols.fit", profile_location)
+
+        # Act
+        with metrics.stage("ml.ols.preprocess"):
+            sorted(range(1000))
+        with metrics.stage("ml.ols.fit"):
+            np.linalg.lstsq(np.ones((100, 3)), np.ones(100), rcond=None)
+
+        # Assert
+        stats = pstats.Stats(profile_location)
+        assert any(function == "lstsq" for _, _, function in stats.stats)
+        assert metrics.profile_stage is None
+
+    def test_write(self, tmp_path):
+        # Arrange
+        metrics = crab_analyser.crab_metrics.CrabMetrics()
+        destination_location = str(tmp_path / "metrics.json")
+        with metrics.stage("parse", rows=3):
+            pass
+
+        # Act
+        metrics.write(destination_location, mode="run", status="succeeded")
+
+        # Assert
+        with open(destination_location) as f:
+            report = json.load(f)
+        assert report["mode"] == "run"
+        assert report["status"] == "succeeded"
+        assert report["stages"][0]["stage"] == "parse"
+        assert report["peak_rss_mb"] > 0
+
+    def test_frame(self):
+        # Arrange
+        metrics = crab_analyser.crab_metrics.CrabMetrics()
+        frame = pd.DataFrame({"length": np.ones(10, dtype=np.float32), "age": np.ones(10, dtype=np.uint8)})
+
+        # Act
+        metrics.frame("ml.read_csv", frame)
+        metrics.frame("ml.forest.preprocess", np.ones((2, 10), dtype=np.float32), rows=100)
+
+        # Assert
+        assert metrics.frames[0]["bytes_per_row"] == 5
+        assert metrics.frames[0]["dtypes"] == {"float32": 1, "uint8": 1}
+        assert metrics.frames[1]["bytes"] == 4000
+        assert metrics.report()["frames"] == metrics.frames
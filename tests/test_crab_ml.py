@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+import crab_analyser.crab_incremental_ols
+import crab_analyser.crab_ml
+
+
+class TestCrabAgePredictor:
+    def test_adaptive_forest(self, make_crab_data):
+        # Arrange
+        predictor = crab_analyser.crab_ml.CrabAgePredictor(make_crab_data(), adaptive_forest=True)
+
+        # Act
+        f_reg_ttr, X, y, X_test, y_test = predictor.fit_forest()
+
+        # Assert
+        forest = f_reg_ttr.regressor_.named_steps['model']
+        assert forest.n_estimators == predictor.forest_report["trees"]
+        assert crab_analyser.crab_ml.FOREST_GROWTH_STEP < forest.n_estimators <= 5000
+        assert len(forest.estimators_) == forest.n_estimators
+        assert predictor.forest_report["oob_mse"] > 0
+        assert len(f_reg_ttr.predict(X_test)) == len(X_test)
+
+    def test_compact_dtype_policy(self, make_crab_data):
+        # Arrange
+        crab_data = make_crab_data()
+        predictor = crab_analyser.crab_ml.CrabAgePredictor(crab_data.copy(), adaptive_forest=True,
+                                                           dtype_policy="compact")
+
+        # Act
+        artifact = predictor.train()
+        scorer = crab_analyser.crab_ml.CrabAgeScorer(artifact)
+        predicted_age = scorer.predict(crab_data)
+
+        # Assert
+        assert predictor.crab_data["length"].dtype == np.float32
+        assert predictor.crab_data["age"].dtype == np.int8
+        assert artifact["dtype_policy"] == "compact"
+        assert artifact["forest_model"].regressor_.named_steps['preprocess'].transform(
+            scorer.prepare(crab_data)).dtype == np.float32
+        assert len(predicted_age) == len(crab_data)
+        assert artifact["metrics"]["forest_r2"] > 0.5
+        assert crab_analyser.crab_ml.fitted_categories(artifact) == {"sex": ["F", "I", "M"]}
+
+    def test_update(self, tmp_path, make_crab_data):
+        # Arrange
+        crab_data = make_crab_data(rows=600)
+        rng = np.random.default_rng(7)
+        for column in ["diameter", "height", "weight"]:
+            crab_data[column] += rng.normal(0, 0.05, len(crab_data))
+        old, new = crab_data.iloc[:400].reset_index(drop=True), crab_data.iloc[400:].reset_index(drop=True)
+        history_location = str(tmp_path / "crab_history.csv")
+        old.to_csv(history_location, index=False)
+        artifact = crab_analyser.crab_ml.CrabAgePredictor(old.copy(), adaptive_forest=True).train()
+        trees = len(artifact["forest_model"].regressor_.named_steps['model'].estimators_)
+        training_rows = artifact["ols_statistics"]["count"]
+        revision = artifact["revision"]
+
+        # Act
+        # the r-squared of a few held out rows is noisy, the tolerance only catches real drift
+        artifact = crab_analyser.crab_ml.CrabAgePredictor(new.copy()).update(artifact, history_location,
+                                                                              drift_tolerance=0.2, min_drift_rows=10)
+
+        # Assert
+        report = artifact["updates"][-1]
+        forest = artifact["forest_model"].regressor_.named_steps['model']
+        assert not report["refit"]
+        assert len(forest.estimators_) == trees
+        assert 0 < report["trees_replaced"] < trees
+        assert artifact["ols_statistics"]["count"] == training_rows + report["new_rows"] - report["outliers"] - \
+            report["test_rows"]
+        assert len(pd.read_csv(history_location)) == 600
+        assert "ols_r2" in report
+        assert artifact["revision"] != revision
+
+    def test_update_drift(self, tmp_path, make_crab_data):
+        # Arrange
+        crab_data = make_crab_data(rows=500)
+        old, new = crab_data.iloc[:400].reset_index(drop=True), crab_data.iloc[400:].reset_index(drop=True)
+        # the new survey measured crabs of the same size that are much older
+        new["age"] = new["age"] * 2
+        history_location = str(tmp_path / "crab_history.csv")
+        old.to_csv(history_location, index=False)
+        artifact = crab_analyser.crab_ml.CrabAgePredictor(old.copy(), adaptive_forest=True).train()
+
+        # Act
+        artifact = crab_analyser.crab_ml.CrabAgePredictor(new.copy(), adaptive_forest=True).update(
+            artifact, history_location, min_drift_rows=10)
+
+        # Assert
+        assert artifact["updates"][-1]["refit"]
+        assert artifact["history_rows"] == 500
+
+    def test_update_sketch_target_transform(self, tmp_path, make_crab_data):
+        # Arrange
+        crab_data = make_crab_data(rows=500)
+        old, new = crab_data.iloc[:400].reset_index(drop=True), crab_data.iloc[400:].reset_index(drop=True)
+        history_location = str(tmp_path / "crab_history.csv")
+        old.to_csv(history_location, index=False)
+        artifact = crab_analyser.crab_ml.CrabAgePredictor(
+            old.copy(), adaptive_forest=True, params={"ols": {"target_transform": "sketch_normal"}}).train()
+
+        # Act
+        artifact = crab_analyser.crab_ml.CrabAgePredictor(new.copy(), adaptive_forest=True).update(
+            artifact, history_location, drift_tolerance=1.0, min_drift_rows=10)
+
+        # Assert
+        statistics = artifact["ols_statistics"]
+        values = np.array(sorted(statistics["age_rows"]))
+        expected = crab_analyser.crab_incremental_ols.fit_quantile_transformer(
+            values, np.array([statistics["age_rows"][v] for v in values]))
+        transformer = artifact["ols_model"].transformer_
+        assert transformer.sketches_[0].count == statistics["count"]
+        np.testing.assert_array_equal(transformer.quantiles_, expected.quantiles_)
+
+    def test_reverse_one_hot(self):
+        # Arrange
+        crab_df = pd.DataFrame({"length": [1.0, 2.0, 3.0, 4.0], "sex_F": [1.0, 0.0, 0.0, 0.0],
+                                "sex_M": [0.0, 0.0, 1.0, 0.0], "sex_I": [0.0, 1.0, 0.0, 0.0]})
+        predictor = crab_analyser.crab_ml.CrabAgePredictor(crab_df)
+
+        # Act
+        sex = crab_analyser.crab_ml.reverse_one_hot(crab_df)
+
+        # Assert
+        assert sex.tolist() == ["F", "I", "M", "na"]
+        assert sex.tolist() == crab_df.apply(lambda row: predictor.reverse_ohe(row), axis=1).tolist()
@@ -0,0 +1,23 @@
+import crab_analyser.crab_model_store
+
+
+class TestCrabModelStore:
+    def test_save_load_versions(self, tmp_path):
+        # Arrange
+        store = crab_analyser.crab_model_store.CrabModelStore(str(tmp_path / "models"))
+        artifact = {"feature_columns": ["sex", "length"], "training_rows": 2, "metrics": {"forest_r2": 0.5},
+                    "fill_values": {"length": 1.5}}
+
+        # Act
+        first = store.save(artifact)
+        second = store.save(dict(artifact, training_rows=3), {"training_data": "crab_data.csv"})
+        latest, metadata = store.load()
+        older, _ = store.load(first)
+
+        # Assert
+        assert (first, second) == (1, 2)
+        assert store.versions() == [1, 2]
+        assert latest["training_rows"] == 3
+        assert older["training_rows"] == 2
+        assert metadata["version"] == 2
+        assert metadata["training_data"] == "crab_data.csv"
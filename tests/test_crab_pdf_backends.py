@@ -0,0 +1,78 @@
+import os
+
+import pytest
+from mock import patch
+
+import crab_analyser.crab_pdf_backends
+
+DATA_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data.pdf")
+
+
+class TestCrabPDFBackends:
+    def test_get_backend(self):
+        # Act
+        ret_val = crab_analyser.crab_pdf_backends.get_backend("pypdf")
+
+        # Assert
+        assert isinstance(ret_val, crab_analyser.crab_pdf_backends.PyPDFBackend)
+        with pytest.raises(ValueError):
+            crab_analyser.crab_pdf_backends.get_backend("adobe")
+
+    @patch("crab_analyser.crab_pdf_backends.parser.from_file")
+    def test_tika_read_lines(self, mock_tika_from_file):
+        # Arrange
+        mock_tika_from_file.return_value = {"status": "something", "content": "\n\nSheet 1\nPage 1\nAge\n5\n"}
+        backend = crab_analyser.crab_pdf_backends.TikaBackend()
+
+        # Act
+        ret_val = backend.read_lines("file_input_location")
+
+        # Assert
+        assert ret_val == ["Sheet 1", "Page 1", "Age", "5"]
+        mock_tika_from_file.assert_called_once_with("file_input_location")
+
+    def test_pypdf_read_pages(self):
+        # Arrange
+        pytest.importorskip("pypdf")
+        backend = crab_analyser.crab_pdf_backends.PyPDFBackend()
+
+        # Act
+        first_page = next(iter(backend.read_pages(DATA_PDF)))
+
+        # Assert
+        assert first_page[:2] == ["Sheet1", "Page 1"]
+        assert first_page[3].split(' ')[0] in ("F", "M", "I")
+        assert len(first_page[3].split(' ')) == 8
+
+    def test_read_page_range(self):
+        # Arrange
+        pytest.importorskip("pypdf")
+        backend = crab_analyser.crab_pdf_backends.PyPDFBackend()
+        pages = [["Sheet1", "Page {0}".format(c)] for c in range(1, 6)]
+
+        # Act
+        ret_val = list(backend.read_page_range(DATA_PDF, 2, 4))
+
+        # Assert
+        assert [page[:2] for page in ret_val] == [["Sheet1", "Page 3"], ["Sheet1", "Page 4"]]
+        assert crab_analyser.crab_pdf_backends.count_pages(DATA_PDF) > 4
+        with patch.object(crab_analyser.crab_pdf_backends.CrabPDFBackend, "read_pages", return_value=iter(pages)):
+            assert list(crab_analyser.crab_pdf_backends.CrabPDFBackend().read_page_range("", 1, 3)) == pages[1:3]
+
+    @patch("crab_analyser.crab_pdf_backends.parser.from_file")
+    def test_tika_stream_pages(self, mock_tika_from_file):
+        # Arrange
+        pytest.importorskip("pypdf")
+        pages = crab_analyser.crab_pdf_backends.count_pages(DATA_PDF)
+        mock_tika_from_file.side_effect = lambda source_location, xmlContent: {
+            "content": "<div class=\"page\"><p>{0}</p></div>".format(
+                crab_analyser.crab_pdf_backends.count_pages(source_location))}
+        backend = crab_analyser.crab_pdf_backends.TikaBackend()
+
+        # Act
+        ret_val = list(backend.stream_pages(DATA_PDF))
+
+        # Assert
+        assert mock_tika_from_file.call_count == -(-pages // crab_analyser.crab_pdf_backends.TIKA_STREAM_PAGES)
+        assert DATA_PDF not in [call.args[0] for call in mock_tika_from_file.call_args_list]
+        assert sum(int(lines[0]) for lines in ret_val) == pages
@@ -1,9 +1,29 @@
 import pytest
 from mock import patch
 import numpy as np
+import pandas as pd
 
 import crab_analyser.crab_pdf_parser_v2
 
+HEADER = "Sex Length Diameter Height Weight Shucked Weight Viscera Weight Shell Weight"
+
+SHARDED_PAGES = [[["Sheet 1", "Page 1", HEADER, "F 1.1512 1.175 0.4125 24.123 12.123 5 6",
+                   "M 1.1 Gooood 0.4 24.1 12.1 5 6"],
+                  ["Sheet 1", "Page 2", "omg such dirty data", "I 0.5 0.4 0.1 2.5 1.2 0.5 0.7", "4"],
+                  ["Sheet 1", "Page 3", "Age", "5", "Sheet 2", "Page 4"],
+                  ["Sheet 2", "Page 5", "7"],
+                  ["Sheet 2", "Page 6", "9"]],
+                 [["F 1 2 3 4 5 6 7", "M 1 2 3 4 5 6 7", "I 1 2 3 4 5 6 7"], ["4"], [], ["Page 2", "6"]]]
+
+
+class FakeBackend:
+    # module level so that the shard workers can unpickle it
+    def __init__(self, pages):
+        self.pages = pages
+
+    def read_page_range(self, source_location, start, stop):
+        return iter(self.pages[start:stop])
+
 
 class TestCrabPDFParser:
     @patch("crab_analyser.crab_pdf_parser_v2.CrabPDFParser.extract_age")
@@ -35,7 +55,7 @@ class TestCrabPDFParser:
         mock_get_index.assert_called_once_with(lines)
         mock_extract_age.assert_called_once_with(length_of_features, age_index)
 
-    @patch("crab_analyser.crab_pdf_parser_v2.parser.from_file")
+    @patch("crab_analyser.crab_pdf_backends.parser.from_file")
     def test_raw_pdf(self, mock_tika_from_file):
         # Arrange
         raw_file = {"status": "something",
@@ -140,3 +160,173 @@ class TestCrabPDFParser:
 
         # Assert
         assert ret_val == expected_value
+
+    @patch("crab_analyser.crab_pdf_backends.count_pages", return_value=2)
+    @patch("crab_analyser.crab_pdf_backends.parser.from_file")
+    def test_read_raw_pages(self, mock_tika_from_file, mock_count_pages):
+        # Arrange
+        raw_file = {"status": "something",
+                    "content": "<html><body><div class=\"page\"><p>Sheet 1\nPage 1\nF 1 2 3 4 5 6 7\n</p></div>\n"
+                               "<div class=\"page\"><p>Sheet 2\nPage 2\nAge\n5\n</p></div></body></html>"}
+        mock_tika_from_file.return_value = raw_file
+        parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("file_input_location", "")
+
+        # Act
+        ret_val = list(parser.read_raw_pages())
+
+        # Assert
+        assert ret_val == [["Sheet 1", "Page 1", "F 1 2 3 4 5 6 7"], ["Sheet 2", "Page 2", "Age", "5"]]
+        mock_tika_from_file.assert_called_once_with("file_input_location", xmlContent=True)
+
+    @patch("crab_analyser.crab_pdf_parser_v2.CrabPDFParser.read_raw_pages")
+    def test_iter_record_chunks(self, mock_read_raw_pages):
+        # Arrange
+        pages = [["Sheet 1", "Page 1", "Sex Length Diameter Height Weight Shucked Weight Viscera Weight Shell Weight",
+                  "F 1.1512 1.175 0.4125 24.123 12.123 5 6",
+                  "M 1.1 Gooood 0.4 24.1 12.1 5 6",
+                  "omg such dirty data"],
+                 ["Sheet 1", "Page 2", "I 0.5 0.4 0.1 2.5 1.2 0.5 0.7", "Age", "5"],
+                 ["Sheet 1", "Page 3", "7", "9"]]
+        mock_read_raw_pages.return_value = iter(pages)
+        parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", "")
+
+        # Act
+        ret_val = list(parser.iter_record_chunks(chunk_size=2))
+
+        # Assert
+        assert [len(chunk) for chunk in ret_val] == [2, 1]
+        assert list(ret_val[0].columns) == crab_analyser.crab_pdf_parser_v2.FEATURE_COLUMNS + ["age"]
+        assert list(ret_val[0]["age"]) + list(ret_val[1]["age"]) == [5, 7, 9]
+        assert np.isnan(ret_val[0]["diameter"][1])
+        assert parser.dirty_rows == ["M 1.1 Gooood 0.4 24.1 12.1 5 6", "omg such dirty data"]
+
+    @patch("crab_analyser.crab_pdf_parser_v2.CrabPDFParser.read_raw_pages")
+    def test_iter_records_count_mismatch(self, mock_read_raw_pages):
+        # Arrange
+        mock_read_raw_pages.return_value = iter([["F 1 2 3 4 5 6 7", "Age"]])
+        parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", "")
+
+        # Act / Assert
+        with pytest.raises(RuntimeError):
+            list(parser.iter_records())
+
+    @pytest.mark.parametrize("pages", SHARDED_PAGES)
+    def test_parse_shards(self, pages):
+        # Arrange
+        tokenizer = crab_analyser.crab_pdf_parser_v2.CrabLineTokenizer()
+        for lines in pages:
+            tokenizer.feed(lines)
+        tokenizer.finish()
+        expected_parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", "")
+        expected = expected_parser.join_age(expected_parser.drain_features(tokenizer), tokenizer.ages)
+
+        for shards in range(1, len(pages) + 2):
+            parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", "", backend=FakeBackend(pages),
+                                                                    shards=shards)
+
+            # Act
+            with patch("crab_analyser.crab_pdf_parser_v2.count_pages", return_value=len(pages)):
+                ret_val = parser.extract()
+
+            # Assert
+            pd.testing.assert_frame_equal(ret_val, expected)
+            assert parser.dirty_rows == expected_parser.dirty_rows
+
+    @patch("crab_analyser.crab_pdf_parser_v2.count_pages", return_value=2)
+    def test_parse_shards_count_mismatch(self, mock_count_pages):
+        # Arrange
+        pages = [["F 1 2 3 4 5 6 7", "Age", "5"], ["M 1 2 3 4 5 6 7"]]
+        parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", "", backend=FakeBackend(pages), shards=2)
+
+        # Act / Assert
+        with pytest.raises(RuntimeError):
+            parser.extract()
+
+    def test_extract_raw_features(self):
+        # Arrange
+        lines = ["Sheet 1"
+            , "Page 1"
+            , "Sex Length Diameter Height Weight Shucked Weight Viscera Weight Shell Weight"
+            , "F 1.1512 1.175 0.4125 24.123 12.123 5 6"
+            , "omg such dirty data"
+            , "M 1.1 Gooood 0.4 24.1 nan 5 6"
+            , " I 0.5 0.4 0.1 2.5 1.2 0.5 0.7 "
+            , "Age"
+            , "5"]
+        parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", "")
+        expected = [parser.get_converted_row(line.strip().split(' '))[:-1] for line in lines
+                    if len(line.strip().split(' ')) == 8]
+
+        # Act
+        ret_val = parser.extract_raw_features(lines)
+
+        # Assert
+        assert list(ret_val.columns) == crab_analyser.crab_pdf_parser_v2.FEATURE_COLUMNS
+        assert ret_val["sex"].tolist() == ["F", "M", "I"]
+        np.testing.assert_array_equal(ret_val.iloc[:, 1:].to_numpy(), np.array([row[1:] for row in expected]))
+        assert parser.dirty_rows == ["omg such dirty data", "M 1.1 Gooood 0.4 24.1 nan 5 6"]
+
+    def test_decode_feature_rows(self):
+        # Arrange
+        rows = ["F 1 2 3 4 5 6 7"] * 100 + ["M 1 2 x 4 5 6 7"] + ["I 1.5 2 3 4 5 6 7"] * 99 + ["I 1_0 2 3 4 5 6 7"]
+        parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", "")
+
+        # Act
+        with patch.object(parser, "tokenize_feature_rows", wraps=parser.tokenize_feature_rows) as mock_tokenize:
+            sex, measurements, dirty = parser.decode_feature_rows(rows, block_size=64)
+
+        # Assert
+        assert parser.tokenize_feature_rows(rows).shape == (201, 8)
+        assert sex[100] == "M"
+        assert np.flatnonzero(dirty).tolist() == [100]
+        assert np.isnan(measurements[100, 2])
+        assert measurements[199, 0] == 1.5
+        # float() takes underscores, np.loadtxt does not, so that block is decoded cell by cell
+        assert measurements[200, 0] == 10.0
+        # only the block with the dirty row and the one with the underscore leave np.loadtxt
+        assert [c.args[0][0] for c in mock_tokenize.call_args_list] == [rows[64], rows[192]]
+
+
+class TestCrabLineTokenizer:
+    def test_feed(self):
+        # Arrange
+        lines = ["Sheet 1"
+            , "Page 1"
+            , "Sex Length Diameter Height Weight Shucked Weight Viscera Weight Shell Weight"
+            , "F 1.1512 1.175 0.4125 24.123 12.123 5 6"
+            , "omg such dirty data"
+            , "3"
+            , "Age"
+            , "Sheet 2"
+            , "Page 2"
+            , "5"]
+        tokenizer = crab_analyser.crab_pdf_parser_v2.CrabLineTokenizer()
+
+        # Act
+        tokenizer.feed(lines[:5])
+        tokenizer.feed(lines[5:])
+        tokenizer.finish()
+
+        # Assert
+        assert tokenizer.feature_rows == ["F 1.1512 1.175 0.4125 24.123 12.123 5 6"]
+        assert tokenizer.feature_positions == [3]
+        assert tokenizer.dirty_lines == [(4, "omg such dirty data")]
+        assert tokenizer.ages == [5]
+
+    test_data = [(["F 1 2 3 4 5 6 7", "Age", "4", "Age", "5", "6"], [5, 6]),
+                 (["F 1 2 3 4 5 6 7", "4", "Page 1", "6"], [6, 4, 6]),
+                 (["F 1 2 3 4 5 6 7", "Page 1"], [])]
+
+    @pytest.mark.parametrize("lines, expected_value", test_data)
+    def test_ages_match_index_lookup(self, lines, expected_value):
+        # Arrange
+        tokenizer = crab_analyser.crab_pdf_parser_v2.CrabLineTokenizer()
+        parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", "")
+
+        # Act
+        tokenizer.feed(lines)
+        tokenizer.finish()
+
+        # Assert
+        assert tokenizer.ages == expected_value
+        assert tokenizer.ages == parser.extract_age(1, parser.get_index_of_age_variable(lines), lines)
@@ -0,0 +1,98 @@
+import pandas as pd
+import pytest
+from mock import patch
+
+import crab_analyser.crab_extraction_cache
+import crab_analyser.crab_ml
+import crab_analyser.crab_pdf_parser_v2
+import crab_analyser.crab_pipeline
+
+HEADER = "Sex Length Diameter Height Weight Shucked Weight Viscera Weight Shell Weight"
+
+
+def make_pages(rows=7, rows_per_page=2):
+    features = ["{0} {1} 1.175 0.4125 24.123 12.123 5 6".format("FMI"[c % 3], 1 + c / 10) for c in range(rows)]
+    features[3] = "M 1.3 LOL 0.4125 24.123 12.123 5 6"
+    pages = [["Sheet1", "Page 1", HEADER]]
+    for start in range(0, rows, rows_per_page):
+        pages.append(["Sheet1", "Page {0}".format(len(pages) + 1)] + features[start:start + rows_per_page])
+    pages.append(["Sheet1", "Page {0}".format(len(pages) + 1), "Age"] + [str(c + 3) for c in range(rows)])
+    return pages
+
+
+class FakeScorer(crab_analyser.crab_ml.CrabAgeScorer):
+    def __init__(self, fail=False):
+        super().__init__({"feature_columns": crab_analyser.crab_pdf_parser_v2.FEATURE_COLUMNS, "fill_values": {}})
+        self.fail = fail
+        self.batches = []
+
+    def predict(self, crab_data, model="forest"):
+        if self.fail:
+            raise ValueError("model failed")
+        self.batches.append(len(crab_data))
+        return crab_data["length"].to_numpy() * 10
+
+
+class TestCrabPipeline:
+    @patch("crab_analyser.crab_pdf_parser_v2.CrabPDFParser.read_raw_pages")
+    def test_run(self, mock_read_raw_pages, tmp_path):
+        # Arrange
+        mock_read_raw_pages.side_effect = lambda: iter(make_pages())
+        destination_location = str(tmp_path / "crab_data.csv")
+        prediction_location = str(tmp_path / "crab_predicted_age.csv")
+        parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", destination_location)
+        scorer = FakeScorer()
+        pipeline = crab_analyser.crab_pipeline.CrabPipeline(parser, scorer, batch_rows=3, queue_size=1)
+        expected_parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", None)
+        expected_parser.read_raw_pdf = lambda: [line for page in make_pages() for line in page]
+        expected = expected_parser.parse_document()
+
+        # Act
+        crab_df = pipeline.run(prediction_location)
+
+        # Assert
+        assert scorer.batches == [4, 3]
+        pd.testing.assert_frame_equal(pd.read_csv(destination_location), expected)
+        assert crab_df["Age"].tolist() == expected["age"].tolist()
+        assert crab_df["Predicted Age"].tolist() == (expected["length"] * 10).round().astype(int).tolist()
+        assert pd.read_csv(prediction_location).columns[-1] == "Predicted Age"
+        assert parser.dirty_rows == ["M 1.3 LOL 0.4125 24.123 12.123 5 6"]
+        assert pipeline.report["batches"] == 2
+
+    @patch("crab_analyser.crab_pdf_parser_v2.CrabPDFParser.read_raw_pages")
+    def test_scoring_error(self, mock_read_raw_pages, tmp_path):
+        # Arrange
+        mock_read_raw_pages.side_effect = lambda: iter(make_pages(rows=200))
+        parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser("", str(tmp_path / "crab_data.csv"))
+        pipeline = crab_analyser.crab_pipeline.CrabPipeline(parser, FakeScorer(fail=True), batch_rows=2,
+                                                            queue_size=1)
+
+        # Act
+        with pytest.raises(ValueError):
+            pipeline.run(str(tmp_path / "crab_predicted_age.csv"))
+
+        # Assert
+        assert not (tmp_path / "crab_data.csv").exists()
+
+    @patch("crab_analyser.crab_pdf_parser_v2.CrabPDFParser.read_raw_pages")
+    def test_extraction_cache(self, mock_read_raw_pages, tmp_path):
+        # Arrange
+        mock_read_raw_pages.side_effect = lambda: iter(make_pages())
+        source_location = tmp_path / "data.pdf"
+        source_location.write_bytes(b"pdf")
+        cache = crab_analyser.crab_extraction_cache.CrabExtractionCache(str(tmp_path / "cache"))
+        pipelines = []
+        for _ in range(2):
+            parser = crab_analyser.crab_pdf_parser_v2.CrabPDFParser(str(source_location), str(tmp_path / "crab.csv"),
+                                                                    cache)
+            pipelines.append(crab_analyser.crab_pipeline.CrabPipeline(parser, FakeScorer(), batch_rows=3))
+
+        # Act
+        parsed = pipelines[0].run(str(tmp_path / "parsed.csv"))
+        cached = pipelines[1].run(str(tmp_path / "cached.csv"))
+
+        # Assert
+        assert mock_read_raw_pages.call_count == 1
+        pd.testing.assert_frame_equal(cached, parsed)
+        assert pipelines[1].scorer.batches == [3, 3, 1]
+        assert pipelines[1].parser.dirty_rows == ["M 1.3 LOL 0.4125 24.123 12.123 5 6"]
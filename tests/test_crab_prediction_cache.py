@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+import crab_analyser.crab_prediction_cache
+
+
+class FakeModel:
+    def __init__(self, offset=0):
+        self.offset = offset
+        self.rows = []
+
+    def predict(self, X):
+        self.rows.append(len(X))
+        return (X["length"] * 10 + self.offset).to_numpy().reshape(-1, 1)
+
+
+def make_artifact(offset=0):
+    return {"feature_columns": ["sex", "length", "weight"], "fill_values": {"length": 1.0, "weight": 2.0},
+            "forest_model": FakeModel(offset), "history_rows": 10, "updates": []}
+
+
+class TestCrabPredictionCache:
+    def test_predict(self):
+        # Arrange
+        crab_data = pd.DataFrame({"sex": ["F", "M", "F", "F", "I"], "length": [1.5, 0.5, 1.5, np.nan, 1.0],
+                                  "weight": [3.0, 1.0, 3.0, 2.0, 2.0], "age": [9, 5, 7, 8, 6]})
+        artifact = make_artifact()
+        cache = crab_analyser.crab_prediction_cache.CrabPredictionCache(artifact, max_entries=3)
+
+        # Act
+        first = cache.predict(crab_data)
+        second = cache.predict(crab_data.iloc[[4, 0]])
+
+        # Assert
+        assert first.tolist() == [15.0, 5.0, 15.0, 10.0, 10.0]
+        assert second.tolist() == [10.0, 15.0]
+        assert artifact["forest_model"].rows == [4, 1]
+        assert cache.stats() == {"rows": 7, "unique_rows": 6, "hits": 1, "misses": 5, "hit_rate": 1 / 6,
+                                 "scored_fraction": 5 / 7, "entries": 3, "evictions": 2, "invalidations": 0}
+
+    def test_invalidate(self):
+        # Arrange
+        crab_data = pd.DataFrame({"sex": ["F", "F"], "length": [1.5, 1.5], "weight": [3.0, 3.0]})
+        artifact = make_artifact()
+        cache = crab_analyser.crab_prediction_cache.CrabPredictionCache(artifact)
+        cache.predict(crab_data)
+
+        # Act
+        # CrabAgePredictor.update refits the models in place and gives them a new revision
+        artifact["updates"].append({"new_rows": 2})
+        artifact["revision"] = "updated"
+        updated = cache.predict(crab_data)
+        cache.artifact = make_artifact(offset=1)
+        replaced = cache.predict(crab_data)
+
+        # Assert
+        assert artifact["forest_model"].rows == [1, 1]
+        assert updated.tolist() == [15.0, 15.0]
+        assert replaced.tolist() == [16.0, 16.0]
+        assert cache.invalidations == 2
+        assert "revision" in cache.artifact
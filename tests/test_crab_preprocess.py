@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import crab_analyser.crab_ml
+import crab_analyser.crab_preprocess
+
+
+@pytest.fixture
+def crab_data(make_crab_data):
+    crab_data = make_crab_data(rows=500, noise=True, dirty=True)
+    # a missing age and a second outlier
+    crab_data["age"] = crab_data["age"].astype(float)
+    crab_data.loc[100, "age"] = np.nan
+    crab_data.loc[400, "height"] = 25.0
+    return crab_data
+
+
+class TestCrabStreamingPreprocessor:
+    @pytest.mark.parametrize("extension", ["csv", "parquet"])
+    def test_same_result_as_in_memory(self, tmp_path, extension, crab_data):
+        # Arrange
+        if extension == "parquet":
+            pytest.importorskip("pyarrow")
+        source_location = str(tmp_path / "crab_data.{0}".format(extension))
+        if extension == "parquet":
+            crab_data.to_parquet(source_location, index=False)
+        else:
+            crab_data.to_csv(source_location, index=False)
+        expected = crab_analyser.crab_ml.CrabAgePredictor(crab_data.copy()).pre_process_data()
+
+        # Act
+        chunks = list(crab_analyser.crab_preprocess.CrabStreamingPreprocessor(source_location, 64).iter_clean_chunks())
+
+        # Assert
+        result = pd.concat(chunks, ignore_index=True)
+        assert len(chunks) == -(-len(crab_data) // 64)
+        assert len(result) == len(expected) == len(crab_data) - 2
+        pd.testing.assert_frame_equal(result, expected.reset_index(drop=True), check_exact=False, rtol=1e-12)
+
+    def test_statistics(self, tmp_path, crab_data):
+        # Arrange
+        source_location = str(tmp_path / "crab_data.csv")
+        crab_data.to_csv(source_location, index=False)
+        preprocessor = crab_analyser.crab_preprocess.CrabStreamingPreprocessor(source_location, 37)
+
+        # Act
+        preprocessor.collect_statistics()
+
+        # Assert
+        imputed = crab_data.fillna(crab_data.mean(numeric_only=True))
+        np.testing.assert_allclose(preprocessor.fill_values, crab_data.mean(numeric_only=True), rtol=1e-12)
+        np.testing.assert_allclose(preprocessor.scale, imputed.std(ddof=0, numeric_only=True), rtol=1e-12)
+        assert preprocessor.missing_columns == ["weight", "age"]
+        assert preprocessor.categories == list(crab_data["sex"].unique())
+        assert preprocessor.rows == len(crab_data)
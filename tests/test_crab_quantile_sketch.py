@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import QuantileTransformer
+
+import crab_analyser.crab_quantile_sketch
+
+
+class TestCrabQuantileSketch:
+    def test_exact_while_few_values(self):
+        # Arrange
+        rng = np.random.default_rng(100)
+        ages = rng.integers(1, 30, 5000).astype(float)
+        references = np.linspace(0, 1, 101)
+        sketch = crab_analyser.crab_quantile_sketch.CrabQuantileSketch(k=64, seed=100)
+
+        # Act
+        for chunk in np.array_split(ages, 7):
+            sketch.update(chunk)
+
+        # Assert
+        assert sketch.exact is not None
+        assert sketch.count == 5000
+        np.testing.assert_array_equal(sketch.quantiles(references), np.percentile(ages, references * 100))
+
+    def test_rank_error_bound(self):
+        # Arrange
+        rng = np.random.default_rng(100)
+        values = rng.lognormal(2, 0.5, 200000)
+        k = 128
+        sketch = crab_analyser.crab_quantile_sketch.CrabQuantileSketch(k=k, seed=100)
+
+        # Act
+        for chunk in np.array_split(values, 50):
+            sketch.update(chunk)
+        quantiles = sketch.quantiles(np.linspace(0, 1, 101))
+
+        # Assert
+        assert sketch.exact is None
+        assert sum(len(level) for level in sketch.levels) <= k * len(sketch.levels)
+        ranks = np.searchsorted(np.sort(values), quantiles) / len(values)
+        assert np.abs(ranks - np.linspace(0, 1, 101)).max() <= 2 * np.log2(len(values) / k) / k
+
+    def test_merge(self):
+        # Arrange
+        rng = np.random.default_rng(100)
+        ages = rng.integers(1, 30, 3000).astype(float)
+        values = rng.normal(10, 3, 3000)
+        references = np.linspace(0, 1, 11)
+        sketches = [crab_analyser.crab_quantile_sketch.CrabQuantileSketch(k=64, seed=s) for s in range(4)]
+        sketches[0].update(ages[:1000])
+        sketches[1].update(ages[1000:])
+        sketches[2].update(values[:1000])
+        sketches[3].update(values[1000:])
+
+        # Act
+        exact = sketches[0].merge(sketches[1])
+        compacted = sketches[2].merge(sketches[3])
+
+        # Assert
+        assert sketches[1].count == 2000
+        np.testing.assert_array_equal(exact.quantiles(references), np.percentile(ages, references * 100))
+        assert compacted.count == 3000
+        ranks = np.searchsorted(np.sort(values), compacted.quantiles(references)) / len(values)
+        assert np.abs(ranks - references).max() <= 2 * np.log2(len(values) / 64) / 64
+
+
+class TestCrabSketchQuantileTransformer:
+    def test_same_as_quantile_transformer_on_ages(self):
+        # Arrange
+        rng = np.random.default_rng(100)
+        ages = rng.integers(1, 30, (4000, 1)).astype(float)
+        expected = QuantileTransformer(output_distribution='normal').fit(ages)
+
+        # Act
+        transformer = crab_analyser.crab_quantile_sketch.CrabSketchQuantileTransformer(
+            output_distribution='normal').fit(ages)
+
+        # Assert
+        np.testing.assert_array_equal(transformer.quantiles_, expected.quantiles_)
+        np.testing.assert_array_equal(transformer.transform(ages), expected.transform(ages))
+        np.testing.assert_array_equal(transformer.inverse_transform(transformer.transform(ages)), ages)
+
+    def test_partial_fit_and_merge(self):
+        # Arrange
+        rng = np.random.default_rng(100)
+        X = np.column_stack([rng.lognormal(2, 0.5, 100000), rng.integers(1, 30, 100000)])
+        expected = QuantileTransformer(subsample=len(X)).fit(X).transform(X)
+        tolerance = 2 * np.log2(len(X) / 256) / 256
+
+        # Act
+        streamed = crab_analyser.crab_quantile_sketch.CrabSketchQuantileTransformer(random_state=100)
+        for chunk in np.array_split(X, 10):
+            streamed.partial_fit(chunk)
+        merged = crab_analyser.crab_quantile_sketch.CrabSketchQuantileTransformer(random_state=1).fit(X[:30000])
+        merged.merge(crab_analyser.crab_quantile_sketch.CrabSketchQuantileTransformer(random_state=2).fit(X[30000:]))
+
+        # Assert
+        for transformer in [streamed, merged]:
+            assert np.abs(transformer.transform(X) - expected).max() <= tolerance
+            np.testing.assert_allclose(transformer.transform(X)[:, 1], expected[:, 1], atol=1e-12)
+        with pytest.raises(ValueError):
+            streamed.partial_fit(X[:, :1])
+
+    def test_missing_values(self):
+        # Arrange
+        rng = np.random.default_rng(100)
+        X = rng.integers(1, 30, (4000, 3)).astype(float)
+        X[:3000, 1] = np.nan
+        X[:, 2] = np.nan
+        with pytest.warns(RuntimeWarning):
+            expected = QuantileTransformer().fit(X)
+
+        # Act
+        transformer = crab_analyser.crab_quantile_sketch.CrabSketchQuantileTransformer()
+        for chunk in np.array_split(X, 4):
+            transformer.partial_fit(chunk)
+
+        # Assert
+        assert transformer.n_quantiles_ == expected.n_quantiles_ == 1000
+        assert transformer.n_features_in_ == 3
+        np.testing.assert_array_equal(transformer.quantiles_, expected.quantiles_)
+        np.testing.assert_array_equal(transformer.transform(X), expected.transform(X))
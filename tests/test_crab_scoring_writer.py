@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+import crab_analyser.crab_ml
+import crab_analyser.crab_scoring_writer
+
+
+class FakeModel:
+    def __init__(self, offset=0):
+        self.offset = offset
+        self.rows = []
+
+    def predict(self, X):
+        self.rows.append(len(X))
+        return (X["length"] * 10 + self.offset).to_numpy()
+
+
+def make_artifact():
+    return {"feature_columns": ["sex", "length", "weight"], "fill_values": {"length": 1.0, "weight": 2.0},
+            "forest_model": FakeModel(), "compiled_forest": FakeModel(offset=1)}
+
+
+class TestCrabScoringWriter:
+    def test_write(self, tmp_path):
+        # Arrange
+        crab_data = pd.DataFrame({"sex": ["F", "M", "I", "F", "M"], "length": [1.0, 0.5, np.nan, 2.0, 0.8],
+                                  "weight": [3.0, 1.0, 2.0, 4.0, 1.5], "age": [10, 4, 12, 20, 0],
+                                  "source_file": ["data.pdf"] * 5})
+        source_location = str(tmp_path / "crab_data.csv")
+        crab_data.to_csv(source_location, index=False)
+        destination_location = str(tmp_path / "crab_predicted_age.csv")
+        artifact = make_artifact()
+        scorer = crab_analyser.crab_ml.CrabAgeScorer(artifact)
+
+        # Act
+        report = crab_analyser.crab_scoring_writer.CrabScoringWriter(
+            scorer, "forest", ["forest", "compiled"], chunk_size=2).write(source_location, destination_location)
+
+        # Assert
+        predictions = pd.read_csv(destination_location)
+        assert list(predictions.columns) == ["Sex", "Length", "Weight", "Age", "Predicted Age",
+                                             "Predicted Age (forest)", "Percentage Difference (forest)",
+                                             "Predicted Age (compiled)", "Percentage Difference (compiled)"]
+        assert predictions["Predicted Age"].tolist() == [10, 5, 10, 20, 8]
+        assert predictions["Predicted Age (compiled)"].tolist() == [11, 6, 11, 21, 9]
+        np.testing.assert_allclose(predictions["Percentage Difference (forest)"], [0, 25, 100 / 6, 0, np.nan])
+        assert artifact["forest_model"].rows == [2, 2, 1]
+        assert report["rows"] == 5
+        assert report["chunks"] == 3
+        assert report["models"]["forest"]["rows"] == 4
+        assert np.isclose(report["models"]["forest"]["mae"], 3 / 4)
+        assert np.isclose(report["models"]["compiled"]["mean_percentage_difference"],
+                          np.mean([10, 50, 100 / 12, 5]))
+
+    def test_write_without_age(self, tmp_path):
+        # Arrange
+        crab_data = pd.DataFrame({"sex": ["F", "M"], "length": [1.0, 0.5], "weight": [3.0, 1.0]})
+        destination_location = str(tmp_path / "crab_predicted_age.csv")
+        scorer = crab_analyser.crab_ml.CrabAgeScorer(make_artifact())
+
+        # Act
+        report = crab_analyser.crab_scoring_writer.CrabScoringWriter(scorer).write(crab_data, destination_location)
+
+        # Assert
+        predictions = pd.read_csv(destination_location)
+        assert list(predictions.columns) == ["Sex", "Length", "Weight", "Predicted Age"]
+        assert predictions["Predicted Age"].tolist() == [10, 5]
+        assert report["models"] == {}
@@ -0,0 +1,165 @@
+import asyncio
+import json
+
+import numpy as np
+
+import crab_analyser.crab_service
+
+FEATURE_COLUMNS = ["sex", "length", "diameter", "height", "weight", "shucked_weight", "viscera_weight",
+                   "shell_weight"]
+README_ROW = {"Sex": "M", "Length": 1.5, "Diameter": 1.2, "Height": 0.4, "Weight": 30.1, "Shucked Weight": 12.0,
+              "Viscera Weight": 6.5, "Shell Weight": 8.8, "Age": 10}
+
+
+class FakeScorer:
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, crab_data, model="forest"):
+        self.batches.append(len(crab_data))
+        return crab_data["length"].to_numpy() * 10
+
+
+class StrictScorer(FakeScorer):
+    def predict(self, crab_data, model="forest"):
+        # like the one hot encoder of the forest, an unknown sex fails the whole frame
+        if "sex" in crab_data and not crab_data["sex"].isin(["F", "M", "I"]).all():
+            self.batches.append(-len(crab_data))
+            raise ValueError("Found unknown categories")
+        return super().predict(crab_data, model)
+
+
+async def post(port, path, payload):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode()
+    writer.write("POST {0} HTTP/1.1\r\nContent-Length: {1}\r\nConnection: close\r\n\r\n".format(path, len(body))
+                 .encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(content)
+
+
+class TestCrabMicroBatcher:
+    def test_concurrent_requests_share_a_batch(self):
+        # Arrange
+        scorer = FakeScorer()
+
+        async def score():
+            batcher = crab_analyser.crab_service.CrabMicroBatcher(scorer, max_wait_ms=50)
+            batcher.start()
+            results = await asyncio.gather(batcher.predict([{"length": 1.0}]),
+                                           batcher.predict([{"length": 2.0}, {"length": 3.0}]),
+                                           batcher.predict([{"length": 4.0}]))
+            await batcher.stop()
+            return results, batcher.stats
+
+        # Act
+        results, stats = asyncio.run(score())
+
+        # Assert
+        assert results == [[10.0], [20.0, 30.0], [40.0]]
+        assert scorer.batches == [4]
+        assert (stats.batches, stats.requests, stats.rows) == (1, 3, 4)
+
+    def test_max_batch_rows(self):
+        # Arrange
+        scorer = FakeScorer()
+
+        async def score():
+            batcher = crab_analyser.crab_service.CrabMicroBatcher(scorer, max_batch_rows=2, max_wait_ms=50)
+            batcher.start()
+            await asyncio.gather(*[batcher.predict([{"length": float(i)}]) for i in range(5)])
+            await batcher.stop()
+
+        # Act
+        asyncio.run(score())
+
+        # Assert
+        assert scorer.batches == [2, 2, 1]
+
+    def test_failed_batch_is_scored_per_request(self):
+        # Arrange
+        scorer = StrictScorer()
+
+        async def score():
+            batcher = crab_analyser.crab_service.CrabMicroBatcher(scorer, max_wait_ms=50)
+            batcher.start()
+            results = await asyncio.gather(batcher.predict([{"sex": "F", "length": 1.0}]),
+                                           batcher.predict([{"sex": "X", "length": 2.0}]),
+                                           batcher.predict([{"sex": "M", "length": 3.0}]),
+                                           return_exceptions=True)
+            await batcher.stop()
+            return results, batcher.stats
+
+        # Act
+        results, stats = asyncio.run(score())
+
+        # Assert
+        assert results[0] == [10.0]
+        assert isinstance(results[1], ValueError)
+        assert results[2] == [30.0]
+        assert scorer.batches == [-3, 1, -1, 1]
+        assert (stats.batches, stats.requests, stats.rows) == (2, 2, 2)
+
+
+class TestCrabAgeService:
+    def test_predict_and_stats(self):
+        # Arrange
+        scorer = FakeScorer()
+
+        async def serve():
+            service = crab_analyser.crab_service.CrabAgeService(scorer, FEATURE_COLUMNS, port=0, max_wait_ms=1)
+            await service.start()
+            single = await post(service.port, "/predict", README_ROW)
+            batch = await post(service.port, "/predict", [README_ROW, dict(README_ROW, Length=2.0)])
+            missing = await post(service.port, "/predict", {"Sex": "M"})
+            await service.stop()
+            return single, batch, missing, service.stats.snapshot()
+
+        # Act
+        single, batch, missing, stats = asyncio.run(serve())
+
+        # Assert
+        assert single == (200, {"predicted_age": [15.0]})
+        assert batch == (200, {"predicted_age": [15.0, 20.0]})
+        assert missing[0] == 400
+        assert "Length" in missing[1]["error"]
+        assert stats["requests"] == 2
+        assert stats["rows"] == 3
+        assert stats["errors"] == 1
+        assert stats["p50_ms"] is not None
+
+    def test_unknown_category(self):
+        # Arrange
+        scorer = StrictScorer()
+
+        async def serve():
+            service = crab_analyser.crab_service.CrabAgeService(scorer, FEATURE_COLUMNS, port=0, max_wait_ms=1,
+                                                                categories={"sex": ["F", "I", "M"]})
+            await service.start()
+            responses = await asyncio.gather(post(service.port, "/predict", README_ROW),
+                                             post(service.port, "/predict", dict(README_ROW, Sex="X")))
+            await service.stop()
+            return responses
+
+        # Act
+        valid, unknown = asyncio.run(serve())
+
+        # Assert
+        assert valid == (200, {"predicted_age": [15.0]})
+        assert unknown[0] == 400
+        assert "'X'" in unknown[1]["error"]
+        assert scorer.batches == [1]
+
+    def test_stats_without_requests(self):
+        # Arrange
+        stats = crab_analyser.crab_service.CrabServiceStats()
+
+        # Act
+        snapshot = stats.snapshot()
+
+        # Assert
+        assert snapshot["p99_ms"] is None
+        assert np.isclose(snapshot["rows_per_second"], 0)
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+from mock import patch
+
+import crab_analyser.crab_training
+
+
+def count_rows(ml):
+    ml.crab_data.loc[0, "length"] = -1.0
+    return {"rows": len(ml.crab_data), "missing": int(ml.crab_data.isna().sum().sum())}
+
+
+def is_memory_mapped(values):
+    while values is not None:
+        if isinstance(values, np.memmap):
+            return True
+        values = values.base
+    return False
+
+
+class TestCrabConcurrentTrainer:
+    @pytest.mark.parametrize("sex_dtype", [object, "category"])
+    def test_share_frame(self, tmp_path, sex_dtype):
+        # Arrange
+        crab_data = pd.DataFrame({"length": [1.5, 0.5, np.nan, 1.0], "weight": [3.0, 1.0, 2.0, 4.0],
+                                  "sex": pd.Series(["F", np.nan, "I", "F"], dtype=sex_dtype),
+                                  "age": [9, 5, 7, 11]})
+
+        # Act
+        layout = crab_analyser.crab_training.share_frame(crab_data, str(tmp_path))
+        shared = crab_analyser.crab_training.load_shared_frame(layout)
+        shared.loc[0, "length"] = -1.0
+
+        # Assert
+        assert len(layout) == 3
+        assert all(is_memory_mapped(shared[c].to_numpy()) for c in ["length", "weight", "age"])
+        pd.testing.assert_frame_equal(shared.iloc[1:], crab_data.iloc[1:])
+        # copy on write, the other workers still see the saved value
+        assert crab_analyser.crab_training.load_shared_frame(layout).loc[0, "length"] == 1.5
+
+    @patch.dict(crab_analyser.crab_training.MODEL_REGISTRY, {"rows": count_rows})
+    def test_run(self):
+        # Arrange
+        crab_data = pd.DataFrame({"sex": ["F", "M", "I"], "length": [1.5, np.nan, 1.0], "age": [9, 5, 7]})
+        trainer = crab_analyser.crab_training.CrabConcurrentTrainer(crab_data, ["rows"])
+
+        # Act
+        report = trainer.run()
+
+        # Assert
+        assert report["models"]["rows"]["metrics"] == {"rows": 3, "missing": 0}
+        assert report["models"]["rows"]["wall_seconds"] > 0
+        assert crab_data.loc[0, "length"] == 1.5
+
+    def test_unknown_model(self):
+        # Act / Assert
+        with pytest.raises(ValueError):
+            crab_analyser.crab_training.CrabConcurrentTrainer(pd.DataFrame(), ["boosting"])
@@ -0,0 +1,36 @@
+import pytest
+
+import crab_analyser.crab_ml
+import crab_analyser.crab_tuning
+
+
+class TestCrabHyperparameterSearch:
+    def test_run(self, tmp_path, make_crab_data):
+        # Arrange
+        destination_location = str(tmp_path / "crab_params.json")
+        crab_data = make_crab_data(rows=300, noise=True)
+        search = crab_analyser.crab_tuning.CrabHyperparameterSearch(crab_data.copy(), cache_dir=str(tmp_path),
+                                                                     max_trees=9, max_bytes=0)
+
+        # Act
+        report = search.run(destination_location)
+        params = crab_analyser.crab_tuning.load_params(destination_location)
+
+        # Assert
+        assert report["models"]["forest"]["rounds"] == 3
+        assert set(params["forest"]) == set(crab_analyser.crab_tuning.FOREST_SEARCH_SPACE)
+        assert params["ols"]["target_transform"] in crab_analyser.crab_ml.OLS_TARGET_TRANSFORMS
+        ml = crab_analyser.crab_ml.CrabAgePredictor(crab_data, params=params)
+        assert ml.forest_params == params["forest"]
+        assert ml.ols_params == params["ols"]
+        assert not list(tmp_path.rglob("output.pkl"))
+
+    def test_make_target_transformer(self):
+        # Act
+        transformer = crab_analyser.crab_ml.make_target_transformer("quantile_uniform")
+
+        # Assert
+        assert transformer.output_distribution == "uniform"
+        assert crab_analyser.crab_ml.make_target_transformer("none") is None
+        with pytest.raises(ValueError):
+            crab_analyser.crab_ml.make_target_transformer("log")
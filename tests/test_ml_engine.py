@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+from mock import patch
+
+import crab_analyser.crab_ml
+import ml_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the parse command runs in a fresh interpreter, the other tests have already imported sklearn in this one
+PARSE_ONLY = """
+import sys
+from mock import patch
+import ml_engine
+with patch("crab_analyser.crab_pdf_parser_v2.CrabPDFParser.process") as mock_process:
+    ml_engine.main(["parse", "-i", "data.pdf", "--backend", "pypdf", "--no-cache"])
+    assert mock_process.called
+print(",".join(m for m in ["sklearn", "scipy", "category_encoders"] if m in sys.modules))
+"""
+
+
+class TestMlEngine:
+    def test_legacy_argv(self):
+        # Act / Assert
+        assert ml_engine.legacy_argv(["-i", "data.pdf", "--mode", "train", "--n_jobs", "2"]) == \
+            ["train", "-i", "data.pdf", "--n_jobs", "2"]
+        assert ml_engine.legacy_argv(["-i", "data.pdf", "--mode=predict"]) == ["predict", "-i", "data.pdf"]
+        assert ml_engine.legacy_argv(["-i", "data.pdf"]) == ["run", "-i", "data.pdf"]
+        assert ml_engine.legacy_argv(["parse", "-i", "data.pdf"]) == ["parse", "-i", "data.pdf"]
+
+    def test_parse_args(self):
+        # Act
+        args = ml_engine.parse_args(["predict", "-i", "data.pdf", "--model", "ols", "--pipelined"])
+
+        # Assert
+        assert args.command == "predict"
+        assert args.model == "ols"
+        assert args.pipelined
+        assert not ml_engine.parse_args(["parse", "-i", "data.pdf"]).pipelined
+        assert not ml_engine.parse_args(["train", "-i", "data.pdf"]).pipelined
+        with pytest.raises(SystemExit):
+            ml_engine.parse_args(["train", "-i", "data.pdf", "--pipelined"])
+        assert ml_engine.parse_args(["predict", "-i", "data.pdf", "--model_columns", "forest", "ols"]).model_columns \
+            == ["forest", "ols"]
+
+    def test_parse_does_not_import_models(self):
+        # Act
+        result = subprocess.run([sys.executable, "-c", PARSE_ONLY], cwd=ROOT, capture_output=True, text=True,
+                                check=True)
+
+        # Assert
+        assert result.stdout.strip() == ""
+
+    def test_default_run_matches_wide_policy(self, tmp_path, monkeypatch, make_crab_data):
+        # Arrange
+        monkeypatch.chdir(tmp_path)
+        # measurements with the digits of the pdf, float32 would round them
+        make_crab_data(noise=True).round(7).to_csv("crab_data.csv", index=False)
+        args = ml_engine.parse_args(["run", "-i", "data.pdf"])
+
+        # Act
+        with patch("crab_analyser.crab_ml.CrabAgePredictor.rf_prediction"):
+            ml_engine.fit_models(args, "crab_data.csv")
+            default = pd.read_csv("crab_predit_ols.csv")
+            crab_analyser.crab_ml.CrabAgePredictor(pd.read_csv("crab_data.csv"), dtype_policy="wide").ols_prediction()
+        wide = pd.read_csv("crab_predit_ols.csv")
+
+        # Assert
+        assert args.dtype_policy == "wide"
+        pd.testing.assert_frame_equal(default, wide, check_exact=True)
+
+    def test_history_keeps_precision(self, tmp_path, monkeypatch, make_crab_data):
+        # Arrange
+        monkeypatch.chdir(tmp_path)
+        crab_data = make_crab_data(noise=True).round(7)
+        crab_data.to_csv("crab_data.csv", index=False)
+        train_args = ml_engine.parse_args(["train", "-i", "data.pdf", "--dtype_policy", "compact"])
+        update_args = ml_engine.parse_args(["update", "-i", "data.pdf", "--dtype_policy", "compact"])
+
+        # Act
+        with patch("crab_analyser.crab_ml.CrabAgePredictor.train", return_value={}), \
+                patch("crab_analyser.crab_model_store.CrabModelStore.save"):
+            ml_engine.fit_models(train_args, "crab_data.csv")
+            with patch("crab_analyser.crab_model_store.CrabModelStore.load", return_value=({}, {"version": 1})), \
+                    patch("crab_analyser.crab_ml.CrabAgePredictor.update") as mock_update:
+                ml_engine.fit_models(update_args, "crab_data.csv")
+
+        # Assert
+        pd.testing.assert_frame_equal(pd.read_csv("models/crab_history.csv"), crab_data, check_exact=True)
+        pd.testing.assert_frame_equal(mock_update.call_args.kwargs["history_data"], crab_data, check_exact=True)